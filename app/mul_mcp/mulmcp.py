@@ -1,22 +1,27 @@
 import os
 from app.rag.model import SimpleRagQA
-from config import MUL_TEST_DIR, SERVICE_INFO
+from app.service_registry import ready_services, get_registry
+from config import MUL_TEST_DIR
 from qwen_agent.agents import Assistant
 import json
 from tqdm import tqdm
-from config import SUMMARY_PATH, FAISS_PATH
+from config import SERVICE_CATALOG, FAISS_PATH
 
 
 class MulMCP(object):
     def __init__(self):
         self.mul_test_dir = MUL_TEST_DIR
-        self.summary2other = json.loads(open(SUMMARY_PATH, encoding="utf-8").read())
-        
+        # 工具 id 即 RAG 语料中的下标，检索结果直接按 id 查服务和端口
+        self.registry = get_registry()
+
+        # 检索语料是服务目录中的工具描述，与 SigMCP 共用同一个 FAISS 索引
         self.simple_qa = SimpleRagQA(
             faiss_path=FAISS_PATH,
-            data_path=MUL_TEST_DIR,
+            data_path=SERVICE_CATALOG,
             embedding_name='summary'
         )
+        if self.simple_qa.qa_engine.data_sum != self.registry.tool_summaries:
+            raise ValueError(f"RAG 语料与服务目录不一致: {SERVICE_CATALOG}")
 
     def init_agent_service(self, tools, llm_set, sys_mes=''):
         """
@@ -35,6 +40,17 @@ class MulMCP(object):
         )
         return bot
 
+    def rerank_ids(self, query, tool_ids):
+        """
+        使用层级描述 (type、service、tool) 对工具重排
+        :param query: 用户查询
+        :param tool_ids: 检索得到的工具 id
+        :return: 重排后的工具 id
+        """
+        hier_descriptions = self.registry.hier_descriptions
+        results = self.simple_qa.qa_engine.search_engine.rerank(query, [hier_descriptions[i] for i in tool_ids])
+        return [tool_ids[i] for i in results.ids.tolist()]
+
     def test(self, query: str, llm_set):
         """
         使用所有可用服务进行测试（基线方法）
@@ -47,11 +63,10 @@ class MulMCP(object):
             'mcpServers': {}
         }]
         
-        # 加载前23个服务
-        for line in open(SERVICE_INFO, encoding="utf-8").readlines()[:23]:
-            service_name, service_port = line.strip().split("\t")
-            tools[0]['mcpServers'][service_name] = {
-                'url': f"http://localhost:{service_port}/sse"
+        # 加载前23个已就绪的服务
+        for service_i in ready_services()[:23]:
+            tools[0]['mcpServers'][service_i['name']] = {
+                'url': f"http://localhost:{service_i['port']}/sse"
             }
         
         print("tools:", tools)
@@ -76,20 +91,10 @@ class MulMCP(object):
         :param prompt: 系统提示
         :return: 最终响应
         """
-        res_no_hi_des = self.simple_qa.qa_engine.search(query, w)
-        res_str = res_no_hi_des[0]
-        
-        service_find = self.summary2other[res_str]['service_name']
-        port_find = self.summary2other[res_str]['port']
-        
+        tool_ids = self.simple_qa.qa_engine.search_ids(query, w)
+
         # Define the agent
-        tools = [{
-            'mcpServers': {
-                service_find: {
-                    'url': f"http://localhost:{port_find}/sse"
-                }
-            }
-        }]
+        tools = [self.registry.mcp_servers(self.registry.unique_services(tool_ids[:1]))]
         
         bot = self.init_agent_service(tools, llm_set=llm_set, sys_mes=prompt)
         
@@ -112,26 +117,10 @@ class MulMCP(object):
         :param prompt: 系统提示
         :return: 最终响应
         """
-        res_no_hi_des = self.simple_qa.qa_engine.search(query, w)
-        service_find_list = []
-        port_find_list = []
-
-        for res_str_i in res_no_hi_des:
-            service_find_i = self.summary2other[res_str_i]['service_name']
-            port_find_i = self.summary2other[res_str_i]['port']
-            if service_find_i not in service_find_list:
-                service_find_list.append(service_find_i)
-                port_find_list.append(port_find_i)
+        tool_ids = self.simple_qa.qa_engine.search_ids(query, w)
 
         # Define the agent
-        tools = [{
-            'mcpServers': {}
-        }]
-
-        for i in range(len(service_find_list[:3])):
-            tools[0]['mcpServers'][service_find_list[i]] = {
-                'url': f"http://localhost:{port_find_list[i]}/sse"
-            }
+        tools = [self.registry.mcp_servers(self.registry.unique_services(tool_ids, limit=3))]
         
         bot = self.init_agent_service(tools, llm_set=llm_set, sys_mes=prompt)
         
@@ -145,20 +134,13 @@ class MulMCP(object):
         final_response = responses[-1] if responses else {}
         return final_response
 
-    def filter_service(self, res):
+    def filter_service(self, tool_ids):
         """
         过滤服务，确保至少有3个不同的服务
-        :param res: 检索结果列表
+        :param tool_ids: 检索得到的工具 id
         :return: 是否满足条件
         """
-        service_names = []
-        for service_des in res:
-            if self.summary2other[service_des]['service_name'] not in service_names:
-                service_names.append(self.summary2other[service_des]['service_name'])
-        if len(service_names) >= 3:
-            return True
-        else:
-            return False
+        return len(self.registry.unique_services(tool_ids, limit=3)) >= 3
 
     def hi_rag_test(self, query, llm_set, w, prompt):
         """
@@ -170,35 +152,15 @@ class MulMCP(object):
         :return: 最终响应
         """
         # 调用RAG进行工具检索
-        res_no_hi_des = self.simple_qa.qa_engine.search(query, w, flat_flag=False)
-        res_no_hi_des = res_no_hi_des[:10]
-        res_no_hi_des_dict = {}
-
-        for res_j in res_no_hi_des:
-            res_no_hi_des_dict[res_j] = f"This is hierarchical information: type={self.summary2other[res_j]['type']}, service={self.summary2other[res_j]['title']}, tool={res_j}"
-
-        value_list = list(res_no_hi_des_dict.values())
-        res_no_hi_des_dict_res = {v: k for k, v in res_no_hi_des_dict.items()}
+        tool_ids = self.simple_qa.qa_engine.search_ids(query, w, flat_flag=False)
+        tool_ids = tool_ids[:10]
 
         # 重排序
-        results = self.simple_qa.qa_engine.search_engine.rerank(query, value_list)
-        res_list = list(results.keys())
-        end_summary_list = [res_no_hi_des_dict_res[k] for k in res_list]
-        
-        # 选择top 1
-        res_str = end_summary_list[0]
+        end_tool_ids = self.rerank_ids(query, tool_ids)
 
-        service_find = self.summary2other[res_str]['service_name']
-        port_find = self.summary2other[res_str]['port']
-        
+        # 选择top 1
         # Define the agent
-        tools = [{
-            'mcpServers': {
-                service_find: {
-                    'url': f"http://localhost:{port_find}/sse"
-                }
-            }
-        }]
+        tools = [self.registry.mcp_servers(self.registry.unique_services(end_tool_ids[:1]))]
         
         bot = self.init_agent_service(tools, llm_set=llm_set, sys_mes=prompt)
 
@@ -212,55 +174,29 @@ class MulMCP(object):
         final_response = responses[-1] if responses else {}
         return final_response
 
-    def hi_rag_test_top3(self, query, llm_set, w, prompt):
+    def hi_rag_test_top3(self, query, llm_set, w, prompt, max_candidates=10):
         """
         使用层次化RAG检索Top3相关服务
         :param query: 用户查询
         :param llm_set: LLM配置
         :param w: 搜索权重
         :param prompt: 系统提示
+        :param max_candidates: 前 10 个工具不足 3 个服务时扩大到的候选数，默认 10 即不扩大，与以往的结果可比，
+            与 SigMCP.hi_rag_test_top3 相同
         :return: 最终响应
         """
         # 调用RAG进行工具检索
-        res_no_hi_des = self.simple_qa.qa_engine.search(query, w, flat_flag=False)
-        res_no_hi_des = res_no_hi_des[:10]
-
-        if not self.filter_service(res_no_hi_des):
-            res_no_hi_des = res_no_hi_des[:20]
-
-        res_no_hi_des_dict = {}
+        all_tool_ids = self.simple_qa.qa_engine.search_ids(query, w, flat_flag=False)
+        tool_ids = all_tool_ids[:10]
 
-        for res_j in res_no_hi_des:
-            res_no_hi_des_dict[res_j] = f"This is hierarchical information: type={self.summary2other[res_j]['type']}, service={self.summary2other[res_j]['title']}, tool={res_j}"
-
-        value_list = list(res_no_hi_des_dict.values())
-        res_no_hi_des_dict_res = {v: k for k, v in res_no_hi_des_dict.items()}
+        if not self.filter_service(tool_ids):
+            tool_ids = all_tool_ids[:max_candidates]
 
         # 重排序
-        results = self.simple_qa.qa_engine.search_engine.rerank(query, value_list)
-        res_list = list(results.keys())
-        end_summary_list = [res_no_hi_des_dict_res[k] for k in res_list]
+        end_tool_ids = self.rerank_ids(query, tool_ids)
 
         # Define the agent
-        tools = [{
-            'mcpServers': {}
-        }]
-
-        filter_service_name = []
-        filter_port = []
-
-        for service_des in end_summary_list:
-            if self.summary2other[service_des]['service_name'] not in filter_service_name:
-                filter_service_name.append(self.summary2other[service_des]['service_name'])
-                filter_port.append(self.summary2other[service_des]['port'])
-
-        for i in range(len(filter_service_name[:3])):
-            service_find = filter_service_name[i]
-            port_find = filter_port[i]
-
-            tools[0]['mcpServers'][service_find] = {
-                'url': f"http://localhost:{port_find}/sse"
-            }
+        tools = [self.registry.mcp_servers(self.registry.unique_services(end_tool_ids, limit=3))]
         
         bot = self.init_agent_service(tools, llm_set=llm_set, sys_mes=prompt)
         
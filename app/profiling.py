@@ -0,0 +1,230 @@
+"""
+入口脚本的 --profile 模式: 在运行期间对主线程做栈采样，按调用边界把耗时分到
+检索 / Agent / LLM 等待 / 工具等待等阶段，输出火焰图可用的折叠栈文件和热点函数报告，
+以及峰值 RSS。--profile-memory 另外用 tracemalloc 统计内存分配热点，它会明显拖慢 Python 代码、扭曲阶段耗时，
+应当单独运行一次
+
+    python run_sig_HI_rag.py --profile
+    python run_sig_HI_rag.py --profile-memory
+    flamegraph.pl data/profile/run_sig_HI_rag-20250101-120000/stacks.collapsed > flame.svg
+
+折叠栈也可以直接拖进 speedscope 查看。只采样调用入口函数的线程，多进程分片评测时子进程不在采样范围内
+"""
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+
+from config import PROJECT_DIR, PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_TOP_N
+
+# (阶段, 文件路径片段, 函数名)，函数名为 None 时匹配文件中的所有函数。
+# 按顺序匹配，栈中任意一帧命中即归入该阶段: LLM 和工具调用发生在 Agent 内部，所以排在 Agent 前面。
+# 只采样主线程: 开启合并请求 (max_wait_ms) 时向量化和重排请求在 BatchDispatcher 线程中发出，重排也可能在
+# ToolSelector 的线程池中进行，主线程只是在等待结果，所以按主线程上发起等待的函数划分
+PHASE_RULES = (
+    ('LLM 等待', '/qwen_agent/llm/', None),
+    ('工具等待', '/qwen_agent/tools/', None),
+    ('工具等待', '/qwen_agent/', '_call_tool'),
+    ('向量化等待', '/app/rag/embedding/remote_model.py', 'encode'),
+    ('重排等待', '/app/rag/embedding/remote_model.py', 'score'),
+    ('重排等待', '/app/rag/selector.py', 'rerank_all'),
+    ('检索', '/app/rag/', None),
+    ('Agent', '/qwen_agent/', None),
+)
+OTHER_PHASE = '其他'
+
+
+def pop_flag(flag, argv=None):
+    """
+    从命令行参数中取出开关，入口脚本自己的参数解析不会看到它
+    """
+    argv = sys.argv if argv is None else argv
+    if flag not in argv:
+        return False
+    argv.remove(flag)
+    return True
+
+
+class StackSampler(object):
+    """
+    后台线程按固定间隔读取目标线程的调用栈，每个样本按距上个样本的实际间隔计时
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        # (根 -> 叶的 code 对象) -> [样本数, 秒]
+        self.stacks = defaultdict(lambda: [0, 0.0])
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            if codes:
+                sample = self.stacks[tuple(reversed(codes))]
+                sample[0] += 1
+                sample[1] += now - last
+            last = now
+
+
+class Profiler(object):
+    """
+    用法:
+        with Profiler('run_sig_HI_rag') as profiler:
+            ...
+    退出时把报告写到 PROFILE_DIR/{name}-{时间}/ 下并打印摘要
+    """
+
+    def __init__(self, name, rules=(), interval=PROFILE_INTERVAL_MS / 1000, top_n=PROFILE_TOP_N,
+                 trace_memory=False, output_dir=None):
+        """
+        :param rules: 入口脚本自己的阶段规则，格式同 PHASE_RULES，优先于默认规则匹配
+        :param trace_memory: 是否用 tracemalloc 统计内存分配，开启后 Python 代码会明显变慢，阶段耗时不再准确
+        """
+        self.name = name
+        self.rules = tuple(rules) + PHASE_RULES
+        self.interval = interval
+        self.top_n = top_n
+        self.trace_memory = trace_memory
+        self.output_dir = output_dir or os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        self.sampler = None
+        self._phase_of_code = {}
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.sampler = StackSampler(threading.get_ident(), self.interval)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.sampler.stop()
+        self.wall_seconds = time.perf_counter() - self._wall
+        self.cpu_seconds = time.process_time() - self._cpu
+        snapshot = None
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.report(snapshot)
+        return False
+
+    def _phase(self, code):
+        """
+        一帧命中的阶段，按 code 对象缓存
+        """
+        if code not in self._phase_of_code:
+            filename = code.co_filename.replace(os.sep, '/')
+            self._phase_of_code[code] = next(
+                (i for i, (_, path, func) in enumerate(self.rules)
+                 if path in filename and (func is None or func == code.co_name)), None)
+        return self._phase_of_code[code]
+
+    def phase_of(self, stack):
+        matched = [i for i in map(self._phase, stack) if i is not None]
+        return self.rules[min(matched)][0] if matched else OTHER_PHASE
+
+    @staticmethod
+    def frame_name(code):
+        filename = code.co_filename
+        if filename.startswith(PROJECT_DIR):
+            filename = os.path.relpath(filename, PROJECT_DIR)
+        else:
+            # 第三方库只保留包内路径
+            parts = filename.replace(os.sep, '/').split('/site-packages/')
+            filename = parts[-1]
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ',')
+
+    def report(self, snapshot=None):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stacks = dict(self.sampler.stacks)
+        sampled = sum(seconds for _, seconds in stacks.values()) or 1e-9
+
+        phases = Counter()
+        self_seconds = Counter()
+        total_seconds = Counter()
+        with open(os.path.join(self.output_dir, 'stacks.collapsed'), 'w', encoding='utf-8') as f:
+            for stack, (count, seconds) in stacks.items():
+                phase = self.phase_of(stack)
+                phases[phase] += seconds
+                self_seconds[stack[-1]] += seconds
+                for code in set(stack):
+                    total_seconds[code] += seconds
+                # 以阶段作为根节点，火焰图第一层就是阶段的耗时拆分
+                f.write(';'.join([phase] + [self.frame_name(code) for code in stack]) + f" {count}\n")
+
+        lines = [f"剖析: {self.name}",
+                 f"墙钟时间: {self.wall_seconds:.2f}s，进程 CPU 时间: {self.cpu_seconds:.2f}s，"
+                 f"样本: {sum(count for count, _ in stacks.values())} 个 (间隔 {self.interval * 1000:.0f}ms)",
+                 ""]
+        if snapshot is not None:
+            lines += ["注意: 本次开启了 tracemalloc，Python 代码的耗时被放大，阶段耗时仅供参考", ""]
+        lines.append("阶段耗时:")
+        for phase, seconds in phases.most_common():
+            lines.append(f"  {seconds:9.2f}s {seconds / sampled:7.1%}  {phase}")
+
+        for title, counter in (("自身耗时最多的函数:", self_seconds), ("累计耗时最多的函数 (含调用的函数):", total_seconds)):
+            lines += ["", title]
+            for code, seconds in counter.most_common(self.top_n):
+                lines.append(f"  {seconds:9.2f}s {seconds / sampled:7.1%}  {self.frame_name(code)}")
+
+        lines += ["", "内存:"]
+        peak_rss = peak_rss_bytes()
+        lines.append(f"  峰值 RSS: {peak_rss / 2 ** 20:.1f}MB" if peak_rss else "  峰值 RSS: 当前平台不支持")
+        if snapshot is not None:
+            lines.append(f"  tracemalloc 峰值: {self.traced_peak / 2 ** 20:.1f}MB")
+            lines += ["", "剖析结束时仍未释放的分配 (按代码行):"]
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<unknown>'),
+            ))
+            for stat in snapshot.statistics('lineno')[:self.top_n]:
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size / 2 ** 20:9.2f}MB {stat.count:9d} 次  {frame.filename}:{frame.lineno}")
+
+        text = '\n'.join(lines) + '\n'
+        with open(os.path.join(self.output_dir, 'report.txt'), 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(text)
+        print(f"剖析结果已保存到: {self.output_dir}")
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_main(name, main, rules=()):
+    """
+    运行入口函数，命令行带 --profile 时在剖析下运行，带 --profile-memory 时剖析并统计内存分配
+    """
+    profile = pop_flag('--profile')
+    trace_memory = pop_flag('--profile-memory')
+    if not (profile or trace_memory):
+        return main()
+    with Profiler(name, rules=rules, trace_memory=trace_memory):
+        return main()
@@ -0,0 +1,72 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class BatchDispatcher(object):
+    """
+    后台线程合并并发的请求: 收到第一个请求后最多再等待 max_wait 秒，或凑满 max_items 个条目 (文本数或
+    (query, doc) 对数)，把这一批请求交给线程池中的 fn 处理，再把结果分发回各个等待的调用方。
+    最多 max_inflight 批同时处理，处理期间继续凑下一批；处理中的批数已满时新请求继续排队，下一批会更大
+    """
+
+    def __init__(self, fn, max_wait=0.005, max_items=64, max_inflight=4, name='batch-dispatcher'):
+        """
+        :param fn: fn(payloads) -> 与 payloads 一一对应的结果列表
+        :param max_wait: 凑批最多等待的秒数
+        :param max_items: 一批的最大条目数
+        :param max_inflight: 同时处理的最大批数
+        """
+        self.fn = fn
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix=name)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, payload, size=1):
+        """
+        提交一个请求并等待结果
+        :param size: 请求包含的条目数
+        """
+        future = Future()
+        self._queue.put((payload, size, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            num_items = items[0][1]
+            deadline = time.monotonic() + self.max_wait
+            while num_items < self.max_items:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                items.append(item)
+                num_items += item[1]
+            self._slots.acquire()
+            self._executor.submit(self._dispatch, items)
+
+    def _dispatch(self, items):
+        try:
+            results = self.fn([payload for payload, _, _ in items])
+            if len(results) != len(items):
+                raise RuntimeError(f"批处理返回 {len(results)} 个结果，但提交了 {len(items)} 个请求")
+        except BaseException as e:
+            # 任何异常都要通知所有调用方，否则 submit() 会一直阻塞
+            for _, _, future in items:
+                future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        finally:
+            self._slots.release()
+        for (_, _, future), result in zip(items, results):
+            future.set_result(result)
@@ -1,9 +1,24 @@
-import requests
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from config import RemoteConfig
+from app.rag.embedding.batching import BatchDispatcher
 
 class RemoteEmbedder:
     def __init__(self):
+        # requests 在创建客户端时才导入，只导入检索模块的进程不需要加载
+        import requests
         self.url = RemoteConfig.embedding_config['model_url']
+        self.max_batch = RemoteConfig.embedding_config.get('max_batch', 64)
+        self.session = requests.Session()
+        # 并发的小请求在后台合并成一次请求，max_wait_ms 为 0 时不合并
+        max_wait_ms = RemoteConfig.embedding_config.get('max_wait_ms', 0)
+        self._dispatcher = BatchDispatcher(self._encode_batches, max_wait=max_wait_ms / 1000,
+                                           max_items=self.max_batch,
+                                           max_inflight=RemoteConfig.embedding_config.get('max_inflight', 4),
+                                           name='embedding-dispatcher') \
+            if max_wait_ms > 0 else None
 
     def encode(self, texts):
         """embedding
@@ -16,35 +31,152 @@ class RemoteEmbedder:
         """
         if isinstance(texts, str):
             texts = [texts]
-        response = requests.post(self.url, json={
-            "model": RemoteConfig.embedding_config.get('model_name',''), 
+        # 本身已经足够大的请求直接发送
+        if self._dispatcher is None or len(texts) >= self.max_batch:
+            return self._post(texts)
+        return self._dispatcher.submit(texts, len(texts))
+
+    def _post(self, texts):
+        response = self.session.post(self.url, json={
+            "model": RemoteConfig.embedding_config.get('model_name',''),
             "input": texts
         })
         response.raise_for_status()
         return [item["embedding"] for item in response.json()["data"]]
 
+    def _encode_batches(self, batches):
+        """
+        把多个调用方的文本拼成一次请求，再按原来的切分返回
+        """
+        embeddings = self._post([text for texts in batches for text in texts])
+        results = []
+        offset = 0
+        for texts in batches:
+            results.append(embeddings[offset:offset + len(texts)])
+            offset += len(texts)
+        return results
+
+class RerankResult(NamedTuple):
+    """
+    ids: 候选在输入列表中的下标，按分数从高到低；scores: 对应的分数
+    """
+    ids: np.ndarray
+    scores: np.ndarray
+
+
+def rank_scores(scores):
+    """
+    :param scores: 与候选一一对应的分数
+    :return: RerankResult，分数相同时保持候选原来的顺序
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    ids = np.argsort(-scores, kind='stable')
+    return RerankResult(ids, scores[ids])
+
+
 class RemoteReranker:
     def __init__(self):
+        import requests
         self.url = RemoteConfig.rerank_config['model_url']
+        # 可选的成对打分接口 (如 vLLM 的 /score)，配置后不同 query 的 (query, doc) 对也合并到同一个请求
+        self.score_url = RemoteConfig.rerank_config.get('score_url')
+        self.max_pairs = RemoteConfig.rerank_config.get('max_pairs', 256)
+        self.session = requests.Session()
+        max_wait_ms = RemoteConfig.rerank_config.get('max_wait_ms', 0)
+        self._dispatcher = BatchDispatcher(self._score_batches, max_wait=max_wait_ms / 1000,
+                                           max_items=self.max_pairs,
+                                           max_inflight=RemoteConfig.rerank_config.get('max_inflight', 4),
+                                           name='rerank-dispatcher') \
+            if max_wait_ms > 0 else None
+        # 合并请求且没有成对打分接口时，一批中不同 query 的 rerank 请求并发发出
+        self._pool = ThreadPoolExecutor(max_workers=RemoteConfig.rerank_config.get('max_concurrency', 8)) \
+            if self._dispatcher is not None and not self.score_url else None
 
     def compute_score(self, query, docs):
         """重排
 
         Args:
-            query (str): 
-            docs (list): 
+            query (str):
+            docs (list):
 
         Returns:
-            list:score
+            RerankResult: 候选下标和分数，按分数从高到低。文本相同的候选各自保留
+        """
+        return rank_scores(self.score(query, docs))
+
+    def score(self, query, docs):
+        """
+        :return: 与 docs 一一对应的分数
         """
+        if not docs:
+            return np.zeros(0, dtype=np.float32)
+        if self._dispatcher is None:
+            return self._score_unique(query, docs, self._rerank)
+        return self._dispatcher.submit((query, docs), len(docs))
 
-        response = requests.post(self.url, json={
-            "model": RemoteConfig.rerank_config.get("model_name",""),  
+    @staticmethod
+    def _score_unique(query, docs, fn):
+        """
+        文本相同的候选只打一次分
+        :param fn: fn(query, 不重复的 docs) -> 分数
+        """
+        unique = {}
+        positions = [unique.setdefault(doc, len(unique)) for doc in docs]
+        return np.asarray(fn(query, list(unique)), dtype=np.float32)[positions]
+
+    def _rerank(self, query, docs):
+        """
+        :return: 与 docs 一一对应的分数
+        """
+        response = self.session.post(self.url, json={
+            "model": RemoteConfig.rerank_config.get("model_name",""),
             "query": query,
-            "documents": docs
+            "documents": docs,
+            # 只按下标返回分数，不回传候选文本
+            "return_documents": False
         })
 
         response.raise_for_status()
-        results = response.json()["results"]
+        scores = np.zeros(len(docs), dtype=np.float32)
+        for item_i in response.json()["results"]:
+            scores[item_i['index']] = item_i['relevance_score']
+        return scores
+
+    def _score_pairs(self, pairs):
+        """
+        :param pairs: [(query, doc)]
+        :return: 与 pairs 一一对应的分数
+        """
+        scores = []
+        for i in range(0, len(pairs), self.max_pairs):
+            chunk = pairs[i:i + self.max_pairs]
+            response = self.session.post(self.score_url, json={
+                "model": RemoteConfig.rerank_config.get("model_name",""),
+                "text_1": [query for query, _ in chunk],
+                "text_2": [doc for _, doc in chunk]
+            })
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item['index'])
+            scores.extend(item['score'] for item in data)
+        return scores
+
+    def _score_batches(self, items):
+        """
+        合并一批 (query, docs) 请求: 相同 query 的文档去重后只打一次分
+        :return: 每个请求中与 docs 一一对应的分数
+        """
+        docs_of_query = {}
+        for query, docs in items:
+            docs_of_query.setdefault(query, {}).update(dict.fromkeys(docs))
+
+        if self.score_url:
+            pairs = [(query, doc) for query, docs in docs_of_query.items() for doc in docs]
+            scores = dict(zip(pairs, self._score_pairs(pairs)))
+        else:
+            queries = list(docs_of_query)
+            scores = {}
+            for query, query_scores in zip(queries, self._pool.map(
+                    lambda query: self._rerank(query, list(docs_of_query[query])), queries)):
+                scores.update(zip(((query, doc) for doc in docs_of_query[query]), query_scores.tolist()))
 
-        return {item_i['document']['text']:item_i['relevance_score'] for item_i in results}
+        return [np.array([scores[(query, doc)] for doc in docs], dtype=np.float32) for query, docs in items]
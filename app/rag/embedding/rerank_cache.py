@@ -0,0 +1,199 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.rag.embedding.remote_model import rank_scores
+
+# 命中时只有访问时间早于这么多秒才更新，避免每次读都写库
+ATIME_RESOLUTION = 3600
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class RerankCache(object):
+    """
+    持久化的 (query, 候选) 重排分数缓存，键为 (重排模型, hash(query), 候选 id)。候选 id 取候选文本的哈希，
+    服务目录变化导致工具编号变化时也不会读到错误的分数。
+
+    SQLite (WAL 模式) 持久化，多进程可以共享同一个缓存文件；进程内再加一层 LRU，
+    超过 max_entries 条时按最近访问时间淘汰
+    """
+
+    def __init__(self, path, max_entries=1000000, memory_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._conn
+        conn.execute('CREATE TABLE IF NOT EXISTS scores ('
+                     'model TEXT NOT NULL, query_hash TEXT NOT NULL, doc_hash TEXT NOT NULL, '
+                     'score REAL NOT NULL, atime REAL NOT NULL, PRIMARY KEY (model, query_hash, doc_hash))')
+        conn.execute('CREATE INDEX IF NOT EXISTS scores_atime ON scores (atime)')
+
+    @property
+    def _conn(self):
+        # sqlite 连接不能跨线程使用，也不能在 fork 之后继续使用
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get_many(self, model, query, docs):
+        """
+        :return: {doc: score}，只包含已缓存的候选
+        """
+        query_hash = text_hash(query)
+        keys = {doc: (model, query_hash, text_hash(doc)) for doc in dict.fromkeys(docs)}
+        scores = {}
+        missing = []
+        with self._lock:
+            for doc, key in keys.items():
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    scores[doc] = self._memory[key]
+                else:
+                    missing.append(doc)
+
+        if missing:
+            doc_of_hash = {keys[doc][2]: doc for doc in missing}
+            hashes = list(doc_of_hash)
+            rows = []
+            # 旧版本 sqlite 最多 999 个绑定参数
+            for i in range(0, len(hashes), 900):
+                batch = hashes[i:i + 900]
+                rows.extend(self._conn.execute(
+                    f'SELECT doc_hash, score, atime FROM scores WHERE model = ? AND query_hash = ? '
+                    f'AND doc_hash IN ({",".join("?" * len(batch))})', [model, query_hash, *batch]))
+            now = time.time()
+            stale = []
+            for doc_hash, score, atime in rows:
+                scores[doc_of_hash[doc_hash]] = score
+                if atime < now - ATIME_RESOLUTION:
+                    stale.append((now, model, query_hash, doc_hash))
+            if stale:
+                try:
+                    self._conn.executemany(
+                        'UPDATE scores SET atime = ? WHERE model = ? AND query_hash = ? AND doc_hash = ?', stale)
+                except sqlite3.OperationalError:
+                    # 访问时间只影响淘汰顺序，数据库繁忙时不影响读取
+                    pass
+            self._remember({keys[doc_of_hash[doc_hash]]: score for doc_hash, score, _ in rows})
+
+        with self._lock:
+            self.hits += len(scores)
+            self.misses += len(keys) - len(scores)
+        return scores
+
+    def put_many(self, model, query, scores):
+        """
+        :param scores: {doc: score}
+        """
+        if not scores:
+            return
+        query_hash = text_hash(query)
+        now = time.time()
+        rows = [(model, query_hash, text_hash(doc), float(score), now) for doc, score in scores.items()]
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO scores (model, query_hash, doc_hash, score, atime) '
+                             'VALUES (?, ?, ?, ?, ?)', rows)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._remember({row[:3]: row[3] for row in rows})
+
+        with self._lock:
+            self._writes += len(rows)
+            check = self._writes >= max(self.max_entries // 100, 1)
+            if check:
+                self._writes = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """
+        超过 max_entries 条时删除最久未访问的分数，保留 90%
+        """
+        conn = self._conn
+        count = conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+        if count <= self.max_entries:
+            return 0
+        num_deleted = count - int(self.max_entries * 0.9)
+        conn.execute('DELETE FROM scores WHERE rowid IN (SELECT rowid FROM scores ORDER BY atime LIMIT ?)',
+                     (num_deleted,))
+        return num_deleted
+
+    def _remember(self, scores):
+        with self._lock:
+            for key, score in scores.items():
+                self._memory[key] = score
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': self._conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0],
+        }
+
+
+class CachedReranker(object):
+    """
+    带缓存的重排模型，接口与 RemoteReranker 相同，只有未缓存的候选才会发给重排服务
+    """
+
+    def __init__(self, reranker, cache, model_name):
+        self.reranker = reranker
+        self.cache = cache
+        self.model_name = model_name
+
+    def compute_score(self, query, docs):
+        """重排
+
+        Args:
+            query (str):
+            docs (list):
+
+        Returns:
+            RerankResult: 候选下标和分数，按分数从高到低
+        """
+        return rank_scores(self.score(query, docs))
+
+    def score(self, query, docs):
+        """
+        :return: 与 docs 一一对应的分数
+        """
+        scores = self.cache.get_many(self.model_name, query, docs)
+        missing = [doc for doc in dict.fromkeys(docs) if doc not in scores]
+        if missing:
+            fresh = dict(zip(missing, self.reranker.score(query, missing).tolist()))
+            self.cache.put_many(self.model_name, query, fresh)
+            scores.update(fresh)
+        return np.array([scores[doc] for doc in docs], dtype=np.float32)
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,6 +1,12 @@
+from config import RemoteConfig
 from app.rag.embedding.remote_model import RemoteEmbedder,RemoteReranker
+from app.rag.embedding.rerank_cache import RerankCache,CachedReranker
 
 class TextEmbedding(object):
     def __init__(self):
         self.embedding_model = RemoteEmbedder()
         self.reranker = RemoteReranker()
+        cache_path = RemoteConfig.rerank_config.get('cache_path')
+        if cache_path:
+            cache = RerankCache(cache_path, RemoteConfig.rerank_config.get('cache_max_entries', 1000000))
+            self.reranker = CachedReranker(self.reranker, cache, RemoteConfig.rerank_config.get('model_name', ''))
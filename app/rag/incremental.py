@@ -0,0 +1,577 @@
+import os
+import json
+import base64
+import shutil
+import threading
+
+import numpy as np
+import faiss
+
+from app.rag.model import RagQA
+from app.rag.keyword_search import cut
+from app.rag.write import DataWrite
+from app.rag.quantization import is_quantized, load_vectors, rescore
+from app.service_registry import ServiceRegistry
+from config import (SERVICE_CATALOG, SUMMARY_PATH, FAISS_PATH, SEARCH_TOPK, VECTOR_RESCORE_FACTOR,
+                    INDEX_SNAPSHOT_DIR, INDEX_REBUILD_RATIO, INDEX_REBUILD_MIN)
+
+
+def encode_vector(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def decode_vector(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+class IndexSnapshot(object):
+    """
+    某一版本的检索索引: 基础索引 + 删除标记 + 增量索引 + BM25，以及这一版本的服务和工具。
+
+    创建后不再修改，更新时生成新的快照再整体替换引用，读取方拿到的快照在一次查询中保持不变
+    """
+
+    def __init__(self, version, services, tools, embedding_model, bm25, base_index, base_vectors, base_ids, stale,
+                 delta):
+        """
+        :param version: 版本号，与预写日志中的记录对应
+        :param services: {服务名: (服务目录中的条目, type, title)}
+        :param tools: 按工具 id 的 (服务名, endpoint)，已删除的工具为 None
+        :param bm25: IncrementalBM25，文档 id 即工具 id
+        :param base_index: 基础索引，第 i 个向量对应工具 base_ids[i]
+        :param base_vectors: 基础索引是量化索引时用于精排的 float32 向量
+        :param stale: 按工具 id 标记基础索引中已经删除或修改的向量
+        :param delta: 之后新增或修改的向量，IndexIDMap2，id 即工具 id
+        """
+        self.version = version
+        self.services = services
+        self.tools = tools
+        self.embedding_model = embedding_model
+        self.bm25 = bm25
+        self.base_index = base_index
+        self.base_vectors = base_vectors
+        self.base_ids = base_ids
+        self.stale = stale
+        self.delta = delta
+        self.num_stale = int(stale[base_ids].sum()) if len(base_ids) else 0
+
+    def vector_search_ids_batch(self, queries):
+        """
+        与 VectorSearch.vector_search_ids_batch 相同，返回工具 id
+        """
+        query_embeddings = np.array(self.embedding_model.encode(queries), dtype=np.float32)
+        return self.search_embeddings(query_embeddings, SEARCH_TOPK)
+
+    def search_embeddings(self, query_embeddings, k):
+        """
+        基础索引多取已删除的向量个数，过滤后与增量索引的结果按距离合并
+        """
+        fetch = k + self.num_stale
+        if self.base_vectors is None:
+            D, I = self.base_index.search(query_embeddings, fetch)
+        else:
+            _, candidates = self.base_index.search(query_embeddings, fetch * VECTOR_RESCORE_FACTOR)
+            D, I = rescore(self.base_vectors, query_embeddings, candidates, fetch)
+        I = np.where(I >= 0, self.base_ids[np.maximum(I, 0)], -1)
+        if self.num_stale:
+            I[(I >= 0) & self.stale[np.maximum(I, 0)]] = -1
+        if self.delta.ntotal:
+            delta_D, delta_I = self.delta.search(query_embeddings, k)
+            D, I = np.hstack([D, delta_D]), np.hstack([I, delta_I])
+
+        results = []
+        for distances, ids in zip(D, I):
+            keep = ids >= 0
+            order = np.argsort(distances[keep], kind='stable')[:k]
+            results.append(ids[keep][order].tolist())
+        return results
+
+    def updated(self, version, services, tools, vectors):
+        """
+        :param vectors: {工具 id: 向量}，None 表示删除。只改了服务信息或 summary 以外的字段时不需要传
+        :return: 新的快照，只复制增量索引和改动的倒排表
+        """
+        stale = np.zeros(len(tools), dtype=bool)
+        stale[:len(self.stale)] = self.stale
+        delta, bm25 = self.delta, self.bm25
+        if vectors:
+            ids = np.fromiter(vectors, dtype=np.int64)
+            stale[ids] = True
+            delta = faiss.clone_index(self.delta)
+            delta.remove_ids(ids)
+            added = [tool_id for tool_id, vector in vectors.items() if vector is not None]
+            if added:
+                delta.add_with_ids(np.array([vectors[tool_id] for tool_id in added], dtype=np.float32),
+                                   np.array(added, dtype=np.int64))
+            bm25 = self.bm25.updated({
+                tool_id: None if tools[tool_id] is None else cut(tools[tool_id][1]['summary'])
+                for tool_id in vectors
+            })
+        return IndexSnapshot(version, services, tools, self.embedding_model, bm25, self.base_index,
+                             self.base_vectors, self.base_ids, stale, delta)
+
+    def rebased(self, base_index, base_vectors, base_ids, changed):
+        """
+        换成重建好的基础索引
+        :param changed: 重建开始之后改动过的工具 id，这些工具在新的基础索引中仍是旧的向量
+        """
+        changed = np.fromiter(changed, dtype=np.int64)
+        stale = np.zeros(len(self.tools), dtype=bool)
+        stale[changed] = True
+        delta = faiss.clone_index(self.delta)
+        if delta.ntotal:
+            delta.remove_ids(np.setdiff1d(faiss.vector_to_array(delta.id_map), changed))
+        return IndexSnapshot(self.version, self.services, self.tools, self.embedding_model, self.bm25, base_index,
+                             base_vectors, base_ids, stale, delta)
+
+    def vectors(self, tool_ids):
+        """
+        :return: 工具当前的 float32 向量。量化的基础索引没有保存 float32 向量时取解码后的近似值
+        """
+        base_pos = np.full(len(self.tools), -1, dtype=np.int64)
+        base_pos[self.base_ids] = np.arange(len(self.base_ids))
+        base_vectors = self.base_vectors
+        if base_vectors is None:
+            base_vectors = self.base_index.reconstruct_n(0, self.base_index.ntotal)
+        delta_ids = set(faiss.vector_to_array(self.delta.id_map).tolist()) if self.delta.ntotal else set()
+
+        embeddings = np.empty((len(tool_ids), self.base_index.d), dtype=np.float32)
+        for row, tool_id in enumerate(tool_ids):
+            if tool_id in delta_ids:
+                embeddings[row] = self.delta.reconstruct(tool_id)
+            else:
+                embeddings[row] = base_vectors[base_pos[tool_id]]
+        return embeddings
+
+    def export(self):
+        """
+        :return: (服务目录, summary2other, 按服务目录顺序的工具 id)，格式与 data/ 下的文件相同
+        """
+        service_tools = {name: [] for name in self.services}
+        for tool_id, tool in enumerate(self.tools):
+            if tool is not None:
+                service_tools[tool[0]].append(tool_id)
+
+        catalog, summary2other, tool_ids = [], {}, []
+        for name, (item, type_name, title) in self.services.items():
+            catalog.append(dict(item, endpoints=[self.tools[i][1] for i in service_tools[name]]))
+            for tool_id in service_tools[name]:
+                endpoint = self.tools[tool_id][1]
+                summary2other[endpoint['summary']] = {
+                    'service_name': name,
+                    'port': item['port'],
+                    'path': endpoint['path'],
+                    'method': endpoint['method'].lower(),
+                    'title': title,
+                    'type': type_name,
+                }
+                tool_ids.append(tool_id)
+        return catalog, summary2other, tool_ids
+
+
+class IncrementalIndex(object):
+    """
+    可以在线增删改工具的 Hi-RAG 索引。
+
+    - 每次更新先写预写日志 (记录服务名、path、method 和向量，不依赖工具 id)，再更新服务注册表，最后整体替换
+      IndexSnapshot，查询从不加锁。修改和删除的工具在基础索引中只标记删除，新的向量写入增量索引
+    - 标记删除和增量索引中的工具超过基础索引的 rebuild_ratio 时在后台重建基础索引，连同服务目录和
+      summary2other 写入 root 下新的检查点目录，再原子替换 CURRENT 并截短预写日志
+    - 启动时从 CURRENT 指向的检查点加载并重放预写日志；还没有检查点时从 data/ 下的服务目录开始
+
+    工具 id 在进程内保持不变，删除的 id 不会复用；从检查点重启后按检查点中服务目录的顺序重新编号
+    """
+
+    def __init__(self, qa_engine, registry, catalog, version=0, root=INDEX_SNAPSHOT_DIR,
+                 rebuild_ratio=INDEX_REBUILD_RATIO, rebuild_min=INDEX_REBUILD_MIN):
+        """
+        :param qa_engine: 用 catalog 建好索引的 RagQA
+        :param registry: 与 catalog 一致的 ServiceRegistry，之后原地更新
+        :param catalog: 服务目录
+        :param version: catalog 对应的版本号，预写日志中不大于它的记录已经包含在内
+        """
+        self.qa_engine = qa_engine
+        self.registry = registry
+        self.root = root
+        self.rebuild_ratio = rebuild_ratio
+        self.rebuild_min = rebuild_min
+        self.embedding_model = qa_engine.model.embedding_model
+
+        services = {}
+        for item in catalog:
+            service_id = registry.service_ids[item['name']]
+            services[item['name']] = (dict(item, endpoints=None),
+                                      registry.type_names[registry.service_types[service_id]],
+                                      registry.service_titles[service_id])
+        tools = [(item['name'], endpoint) for item in catalog for endpoint in item.get('endpoints') or []]
+        index, vectors = qa_engine.search_engine.vector_search.load()
+        delta = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+        self.snapshot = IndexSnapshot(version, services, tools, self.embedding_model, qa_engine.bm25_engine, index,
+                                      vectors, np.arange(index.ntotal), np.zeros(len(tools), dtype=bool), delta)
+        self._summary_ids = {endpoint['summary']: tool_id for tool_id, (_, endpoint) in enumerate(tools)}
+
+        # 更新互斥，查询不需要加锁
+        self._lock = threading.RLock()
+        # 重建基础索引期间改动的工具 id，没有在重建时为 None
+        self._changed = None
+        self._compaction = None
+
+        os.makedirs(root, exist_ok=True)
+        self.wal_path = os.path.join(root, 'wal.jsonl')
+        self._replay()
+        self._wal = open(self.wal_path, 'a', encoding='utf-8')
+
+    @classmethod
+    def open(cls, root=INDEX_SNAPSHOT_DIR, **kwargs):
+        """
+        从最新的检查点加载并重放预写日志
+        """
+        current_path = os.path.join(root, 'CURRENT')
+        if os.path.exists(current_path):
+            with open(current_path, encoding='utf-8') as f:
+                current = json.load(f)
+            snapshot_dir = os.path.join(root, current['snapshot'])
+            catalog_path = os.path.join(snapshot_dir, 'catalog.json')
+            summary_path = os.path.join(snapshot_dir, 'summary2other.json')
+            faiss_path = os.path.join(snapshot_dir, 'data.index')
+            version = current['version']
+        else:
+            catalog_path, summary_path, faiss_path, version = SERVICE_CATALOG, SUMMARY_PATH, FAISS_PATH, 0
+
+        registry = ServiceRegistry(catalog_path, summary_path)
+        qa_engine = RagQA(faiss_path, catalog_path, 'summary')
+        catalog = json.loads(open(catalog_path, encoding="utf-8").read())
+        return cls(qa_engine, registry, catalog, version=version, root=root, **kwargs)
+
+    def search_scored_batch(self, queries, w=0.1, flat_flag=True, top_k=None):
+        """
+        与 RagSearch.search_scored_batch 相同，在当前快照上检索
+        """
+        snapshot = self.snapshot
+        return self.qa_engine.search_engine.search_scored_batch(queries, snapshot.bm25, w=w, flat_flag=flat_flag,
+                                                                top_k=top_k, vector_search=snapshot)
+
+    def upsert_service(self, item):
+        """
+        增加服务或替换服务的工具列表: 按 (path, method) 与已有的工具对应，summary 变化的工具重新向量化，
+        不再出现的工具删除
+        :param item: 与服务目录中的条目格式相同，至少包含 name、path、port 和 endpoints。可以用 type 和
+            hier_title 指定层级描述中的 type 和 service，默认沿用已有的；新服务取 path 的第一级目录和服务名
+        :return: {'added', 'updated', 'deleted'}: 工具 id
+        """
+        name = item['name']
+        with self._lock:
+            snapshot = self.snapshot
+            old = snapshot.services.get(name)
+            type_name = item.get('type') or (old[1] if old else item['path'].split('/')[0])
+            title = item.get('hier_title') or (old[2] if old else f"{name.lower()} service")
+            service_item = dict({key: value for key, value in item.items() if key not in ('type', 'hier_title')},
+                                endpoints=None)
+
+            current = {}
+            if name in self.registry.service_ids:
+                for tool_id in self.registry.service_tools[self.registry.service_ids[name]]:
+                    endpoint = snapshot.tools[tool_id][1]
+                    current[(endpoint['path'], endpoint['method'].lower())] = (tool_id, endpoint)
+
+            changes = []
+            endpoints = item.get('endpoints') or []
+            for endpoint in endpoints:
+                tool_id, old_endpoint = current.get((endpoint['path'], endpoint['method'].lower()), (None, None))
+                if old_endpoint != endpoint:
+                    changes.append((name, endpoint, None, old_endpoint))
+            keys = {(endpoint['path'], endpoint['method'].lower()) for endpoint in endpoints}
+            deletes = [(name, path, method) for (path, method) in current if (path, method) not in keys]
+
+            record = self._record(changes, deletes, service={'item': service_item, 'type': type_name,
+                                                              'title': title})
+            self._commit(record)
+            return {
+                'added': [self.registry.find_tool(name, e['path'], e['method']) for _, e, _, old in changes
+                          if old is None],
+                'updated': [self.registry.find_tool(name, e['path'], e['method']) for _, e, _, old in changes
+                            if old is not None],
+                'deleted': [current[(path, method)][0] for _, path, method in deletes],
+            }
+
+    def add_tools(self, service_name, endpoints):
+        """
+        向已有的服务增加工具，(path, method) 已存在时修改该工具
+        :param endpoints: [{'path', 'method', 'summary', ...}]
+        :return: 工具 id
+        """
+        with self._lock:
+            if service_name not in self.registry.service_ids:
+                raise ValueError(f"服务不存在: {service_name}，请先用 upsert_service 增加服务")
+            changes = []
+            for endpoint in endpoints:
+                tool_id = self.registry.find_tool(service_name, endpoint['path'], endpoint['method'])
+                changes.append((service_name, endpoint, None,
+                                None if tool_id is None else self.snapshot.tools[tool_id][1]))
+            self._commit(self._record(changes, []))
+            return [self.registry.find_tool(service_name, e['path'], e['method']) for e in endpoints]
+
+    def update_tool(self, tool_id, endpoint):
+        """
+        修改工具，工具 id 不变
+        :param endpoint: 新的 {'path', 'method', 'summary', ...}，path 和 method 也可以修改
+        """
+        with self._lock:
+            service_name, old_endpoint = self._get_tool(tool_id)
+            old_key = (old_endpoint['path'], old_endpoint['method'])
+            self._commit(self._record([(service_name, endpoint, old_key, old_endpoint)], []))
+
+    def delete_tools(self, tool_ids):
+        with self._lock:
+            deletes = []
+            for tool_id in tool_ids:
+                service_name, endpoint = self._get_tool(tool_id)
+                deletes.append((service_name, endpoint['path'], endpoint['method']))
+            self._commit(self._record([], deletes))
+
+    def delete_service(self, service_name):
+        """
+        删除服务的所有工具，服务本身保留在服务目录中
+        :return: 删除的工具 id
+        """
+        with self._lock:
+            if service_name not in self.registry.service_ids:
+                raise ValueError(f"服务不存在: {service_name}")
+            tool_ids = list(self.registry.service_tools[self.registry.service_ids[service_name]])
+            self.delete_tools(tool_ids)
+            return tool_ids
+
+    def _get_tool(self, tool_id):
+        tool = self.snapshot.tools[tool_id] if 0 <= tool_id < len(self.snapshot.tools) else None
+        if tool is None:
+            raise KeyError(f"工具不存在: {tool_id}")
+        return tool
+
+    def _record(self, changes, deletes, service=None):
+        """
+        校验并生成预写日志记录，summary 变化的工具在这里向量化。校验失败的改动不会写入预写日志，
+        因此也不会在重放时出现
+        :param changes: [(服务名, endpoint, 原来的 (path, method) 或 None, 原来的 endpoint 或 None)]
+        :param deletes: [(服务名, path, method)]
+        """
+        summaries = {}
+        keys = set()
+        for service_name, endpoint, old_key, old_endpoint in changes:
+            missing = [key for key in ('path', 'method', 'summary') if not endpoint.get(key)]
+            if missing:
+                raise ValueError(f"{service_name} 的工具缺少 {', '.join(missing)}: {endpoint}")
+            # 同一服务中 (path, method) 唯一: 修改 path 或 method 时不能改成该服务另一个工具的
+            key = (service_name, endpoint['path'], endpoint['method'].lower())
+            if key in keys:
+                raise ValueError(f"{service_name} 的工具重复: {endpoint['method']} {endpoint['path']}")
+            keys.add(key)
+            if old_key is not None:
+                key_owner = self.registry.find_tool(*key)
+                if key_owner is not None and key_owner != self.registry.find_tool(service_name, *old_key):
+                    raise ValueError(f"{service_name} 的工具 {key_owner} 已使用 "
+                                     f"{endpoint['method']} {endpoint['path']}")
+            owner = self._summary_ids.get(endpoint['summary'])
+            old_id = None
+            if old_endpoint is not None:
+                old_id = self._summary_ids.get(old_endpoint['summary'])
+            if endpoint['summary'] in summaries or (owner is not None and owner != old_id):
+                raise ValueError(f"工具描述重复: {endpoint['summary']}")
+            summaries[endpoint['summary']] = True
+
+        texts = [endpoint['summary'] for _, endpoint, _, old_endpoint in changes
+                 if old_endpoint is None or old_endpoint['summary'] != endpoint['summary']]
+        vectors = iter(self.embedding_model.encode(texts) if texts else [])
+
+        upserts = []
+        for service_name, endpoint, old_key, old_endpoint in changes:
+            reembed = old_endpoint is None or old_endpoint['summary'] != endpoint['summary']
+            upserts.append({
+                'service': service_name,
+                'endpoint': endpoint,
+                'old': old_key,
+                'vector': encode_vector(next(vectors)) if reembed else None,
+            })
+        return {
+            'service': service,
+            'upserts': upserts,
+            'deletes': [{'service': s, 'path': path, 'method': method} for s, path, method in deletes],
+        }
+
+    def _commit(self, record):
+        """
+        先写预写日志再更新，写入的记录在崩溃后由 _replay 重放
+        """
+        record['version'] = self.snapshot.version + 1
+        self._wal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        self._apply(record)
+        self._maybe_compact()
+
+    def _apply(self, record):
+        registry = self.registry
+        snapshot = self.snapshot
+        services = snapshot.services
+        if record.get('service'):
+            service = record['service']
+            name = service['item']['name']
+            services = dict(services)
+            services[name] = (service['item'], service['type'], service['title'])
+            registry.add_service(name, service['item']['port'], service['type'], service['title'])
+
+        tools = list(snapshot.tools)
+        vectors = {}
+        for upsert in record['upserts']:
+            endpoint = upsert['endpoint']
+            path, method = upsert['old'] or (endpoint['path'], endpoint['method'])
+            tool_id = registry.find_tool(upsert['service'], path, method)
+            if tool_id is None:
+                # 与注册表同步追加，新工具的 id 为 num_tools
+                tool_id = len(tools)
+                tools.append(None)
+            else:
+                self._summary_ids.pop(tools[tool_id][1]['summary'], None)
+            tools[tool_id] = (upsert['service'], endpoint)
+            registry.set_tool(tool_id, registry.service_ids[upsert['service']], endpoint['summary'],
+                              endpoint['path'], endpoint['method'])
+            self._summary_ids[endpoint['summary']] = tool_id
+            if upsert['vector'] is not None:
+                vectors[tool_id] = decode_vector(upsert['vector'])
+
+        for delete in record['deletes']:
+            tool_id = registry.find_tool(delete['service'], delete['path'], delete['method'])
+            if tool_id is None:
+                continue
+            self._summary_ids.pop(tools[tool_id][1]['summary'], None)
+            tools[tool_id] = None
+            registry.remove_tool(tool_id)
+            vectors[tool_id] = None
+
+        self.snapshot = snapshot.updated(record['version'], services, tools, vectors)
+        if self._changed is not None:
+            self._changed.update(vectors)
+
+    def _replay(self):
+        """
+        重放预写日志中检查点之后的记录。崩溃时写了一半的最后一行直接丢弃
+        """
+        if not os.path.exists(self.wal_path):
+            return
+        base_version = self.snapshot.version
+        num_records = 0
+        with open(self.wal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"预写日志的最后一条记录不完整，已忽略: {self.wal_path}")
+                    break
+                if record['version'] <= self.snapshot.version:
+                    continue
+                if record['version'] != self.snapshot.version + 1:
+                    raise ValueError(f"预写日志与检查点不连续: 检查点版本 {self.snapshot.version}，"
+                                     f"记录版本 {record['version']}")
+                self._apply(record)
+                num_records += 1
+        if num_records:
+            print(f"已重放预写日志: {num_records} 条记录，当前版本 {self.snapshot.version}")
+        self._rewrite_wal(base_version)
+
+    def _rewrite_wal(self, version):
+        """
+        只保留版本大于 version 的记录
+        """
+        records = []
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        if json.loads(line)['version'] > version:
+                            records.append(line if line.endswith('\n') else line + '\n')
+                    except json.JSONDecodeError:
+                        break
+        tmp_path = f"{self.wal_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.wal_path)
+
+    def _maybe_compact(self):
+        snapshot = self.snapshot
+        pending = snapshot.num_stale + snapshot.delta.ntotal
+        if self._changed is None and pending > max(self.rebuild_min, self.rebuild_ratio * len(snapshot.base_ids)):
+            self._changed = set()
+            self._compaction = threading.Thread(target=self._compact, args=(snapshot,), name='index-compaction',
+                                                daemon=True)
+            self._compaction.start()
+
+    def compact(self):
+        """
+        立即重建基础索引并写入检查点，已经在后台重建时等待其完成
+        """
+        with self._lock:
+            if self._changed is None:
+                self._changed = set()
+                self._compaction = threading.Thread(target=self._compact, args=(self.snapshot,),
+                                                    name='index-compaction', daemon=True)
+                self._compaction.start()
+            compaction = self._compaction
+        compaction.join()
+
+    def _current_snapshot(self):
+        """
+        :return: CURRENT 指向的检查点目录名，没有检查点时为 None
+        """
+        current_path = os.path.join(self.root, 'CURRENT')
+        if not os.path.exists(current_path):
+            return None
+        with open(current_path, encoding='utf-8') as f:
+            return json.load(f)['snapshot']
+
+    def _compact(self, snapshot):
+        try:
+            name = f"snapshot-{snapshot.version:08d}"
+            if self._current_snapshot() == name:
+                # 检查点之后没有更新，不能删除 CURRENT 正在指向的目录
+                with self._lock:
+                    self._changed = None
+                return
+            catalog, summary2other, tool_ids = snapshot.export()
+            embeddings = snapshot.vectors(tool_ids)
+            snapshot_dir = os.path.join(self.root, name)
+            tmp_dir = f"{snapshot_dir}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            with open(os.path.join(tmp_dir, 'catalog.json'), 'w', encoding='utf-8') as f:
+                json.dump(catalog, f, indent=4, ensure_ascii=False)
+            with open(os.path.join(tmp_dir, 'summary2other.json'), 'w', encoding='utf-8') as f:
+                json.dump(summary2other, f, indent=4, ensure_ascii=False)
+            data_list = [snapshot.tools[tool_id][1]['summary'] for tool_id in tool_ids]
+            index = DataWrite.index_write(data_list, embeddings, os.path.join(tmp_dir, 'data.index'))
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            os.replace(tmp_dir, snapshot_dir)
+            faiss_path = os.path.join(snapshot_dir, 'data.index')
+            base_vectors = load_vectors(faiss_path) if is_quantized(index) else None
+
+            with self._lock:
+                # 先切换 CURRENT 再截短预写日志，两步之间崩溃时重放会跳过检查点已包含的记录
+                tmp_path = os.path.join(self.root, f"CURRENT.{os.getpid()}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'snapshot': name, 'version': snapshot.version}, f)
+                os.replace(tmp_path, os.path.join(self.root, 'CURRENT'))
+                self._wal.close()
+                self._rewrite_wal(snapshot.version)
+                self._wal = open(self.wal_path, 'a', encoding='utf-8')
+                self.snapshot = self.snapshot.rebased(index, base_vectors, np.array(tool_ids, dtype=np.int64),
+                                                      self._changed)
+                self._changed = None
+
+            for entry in os.listdir(self.root):
+                if entry.startswith('snapshot-') and entry != name and not entry.endswith('.tmp'):
+                    shutil.rmtree(os.path.join(self.root, entry), ignore_errors=True)
+            print(f"索引已重建: 版本 {snapshot.version}，{len(tool_ids)} 个工具")
+        except Exception as e:
+            print(f"重建索引失败: {type(e).__name__}: {e}")
+            with self._lock:
+                self._changed = None
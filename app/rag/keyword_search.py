@@ -1,27 +1,155 @@
-import jieba
+import math
+import copy
+from collections import Counter
+
 import numpy as np
 
 from config import SEARCH_TOPK
 
 
+def cut(text):
+    """
+    jieba 分词。jieba 在第一次分词时才导入并加载词典，只导入检索模块的进程不需要等待
+    """
+    import jieba
+    return list(jieba.cut(text))
+
+
+class IncrementalBM25(object):
+    """
+    与 rank_bm25.BM25Okapi 打分相同的 BM25，倒排表可以按文档 id 增删。
+
+    实例创建后不再修改: updated 返回新实例，只复制改动的词的倒排表，读取方拿到的实例不受之后的更新影响。
+    查询只遍历查询词的倒排表，不再逐个文档统计词频；已删除的文档分数为 -inf
+    """
+
+    def __init__(self, k1=1.5, b=0.75, epsilon=0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        # 词 -> (文档 id 数组, 词频数组)
+        self.postings = {}
+        # 每个文档的 {词: 词频}，已删除的文档为 None
+        self.doc_freqs = []
+        self.doc_len = np.zeros(0)
+        self.alive = np.zeros(0, dtype=bool)
+        self.corpus_size = 0
+        self.avgdl = 0.0
+        self.idf = {}
+
+    @classmethod
+    def from_corpus(cls, tokenized_corpus, **kwargs):
+        bm25 = cls(**kwargs)
+        return bm25.updated(dict(enumerate(tokenized_corpus)))
+
+    def updated(self, changes):
+        """
+        :param changes: {文档 id: 分好的词}，None 表示删除。新文档的 id 可以超出现有的文档数
+        :return: 更新后的新实例
+        """
+        new = copy.copy(self)
+        new.postings = dict(self.postings)
+        new.doc_freqs = list(self.doc_freqs)
+        size = max(len(self.doc_freqs), max(changes, default=-1) + 1)
+        new.doc_freqs.extend([None] * (size - len(new.doc_freqs)))
+        new.doc_len = np.zeros(size)
+        new.doc_len[:len(self.doc_len)] = self.doc_len
+        new.alive = np.zeros(size, dtype=bool)
+        new.alive[:len(self.alive)] = self.alive
+
+        removed, added = {}, {}
+        for doc_id, tokens in changes.items():
+            for word in new.doc_freqs[doc_id] or ():
+                removed.setdefault(word, []).append(doc_id)
+            frequencies = None if tokens is None else dict(Counter(tokens))
+            for word, freq in (frequencies or {}).items():
+                added.setdefault(word, []).append((doc_id, freq))
+            new.doc_freqs[doc_id] = frequencies
+            new.doc_len[doc_id] = len(tokens) if tokens is not None else 0
+            new.alive[doc_id] = tokens is not None
+
+        for word in dict.fromkeys(list(removed) + list(added)):
+            ids, tfs = new.postings.get(word, (np.zeros(0, dtype=np.int64), np.zeros(0)))
+            if word in removed:
+                keep = ~np.isin(ids, removed[word])
+                ids, tfs = ids[keep], tfs[keep]
+            if word in added:
+                ids = np.concatenate([ids, np.array([doc_id for doc_id, _ in added[word]], dtype=np.int64)])
+                tfs = np.concatenate([tfs, np.array([freq for _, freq in added[word]], dtype=np.float64)])
+            if len(ids):
+                new.postings[word] = (ids, tfs)
+            else:
+                new.postings.pop(word, None)
+
+        new.corpus_size = int(new.alive.sum())
+        new.avgdl = new.doc_len.sum() / new.corpus_size if new.corpus_size else 0.0
+        new._calc_idf()
+        return new
+
+    def _calc_idf(self):
+        # 与 BM25Okapi 相同: idf 为负的词取平均 idf 的 epsilon 倍
+        self.idf = {}
+        idf_sum = 0
+        negative_idfs = []
+        for word, (ids, _) in self.postings.items():
+            idf = math.log(self.corpus_size - len(ids) + 0.5) - math.log(len(ids) + 0.5)
+            self.idf[word] = idf
+            idf_sum += idf
+            if idf < 0:
+                negative_idfs.append(word)
+        self.average_idf = idf_sum / len(self.idf) if self.idf else 0.0
+
+        eps = self.epsilon * self.average_idf
+        for word in negative_idfs:
+            self.idf[word] = eps
+
+    def get_scores(self, query):
+        """
+        :param query: 分好的查询词
+        :return: 每个文档的分数
+        """
+        score = np.zeros(len(self.doc_len))
+        for q in query:
+            if q not in self.postings:
+                continue
+            ids, q_freq = self.postings[q]
+            score[ids] += (self.idf.get(q) or 0) * (q_freq * (self.k1 + 1) / (
+                q_freq + self.k1 * (1 - self.b + self.b * self.doc_len[ids] / self.avgdl)))
+        score[~self.alive] = -np.inf
+        return score
+
+
 class KeyWordSearch(object):
     """
     keyword search
     """
 
-    def keyword_search(self, query, bm25, data_list):
+    def keyword_search_ids(self, query, bm25):
         """use bm25 search
 
         Args:
             query (str): question
             bm25 (object): bm25
-            data_list (list): data list
 
         Returns:
-            list: bm25 search list
+            list: ids of the top bm25 results
         """
-        tokenized_query = list(jieba.cut(query))  
+        tokenized_query = cut(query)
         bm25_scores = bm25.get_scores(tokenized_query)  
         top_n = np.argsort(bm25_scores)[::-1][:SEARCH_TOPK] 
 
-        return [data_list[i] for i in top_n]
+        # 已删除的文档分数为 -inf
+        return [i for i in top_n.tolist() if bm25_scores[i] > -np.inf]
+
+    def keyword_search(self, query, bm25, data_list):
+        """use bm25 search
+
+        Args:
+            query (str): question
+            bm25 (object): bm25
+            data_list (list): data list
+
+        Returns:
+            list: bm25 search list
+        """
+        return [data_list[i] for i in self.keyword_search_ids(query, bm25)]
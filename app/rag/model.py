@@ -28,13 +28,8 @@ class RagQA(object):
         self._initialize_data()
     
     def _initialize_data(self):
-        try:
-            if os.path.exists(self.faiss_path):
-                self.bm25_engine = self.write_engine.vector_write(self.data_sum, self.faiss_path)
-            else:
-                self.bm25_engine = self.data_save()
-        except Exception as e:
-            self.bm25_engine = self.data_save()
+        # 索引与语料一致时直接复用，多个进程不会重复向量化同一份语料
+        self.bm25_engine = self.write_engine.load_or_write(self.data_sum, self.faiss_path)
     
     def data_save(self):
         bm25 = self.write_engine.vector_write(self.data_sum, self.faiss_path)
@@ -48,6 +43,12 @@ class RagQA(object):
             search_list = self.search_engine.search(query, self.bm25_engine, self.data_sum,w=w,flat_flag=False)
         return search_list
 
+    def search_ids(self, query, w=0.1, flat_flag=True):
+        """
+        与 search 相同，但返回 data_sum 中的下标，可直接作为 ServiceRegistry 的工具 id
+        """
+        return self.search_engine.search_ids(query, self.bm25_engine, w=w, flat_flag=flat_flag)
+
 
 class SimpleRagQA:
     
@@ -0,0 +1,82 @@
+import os
+import math
+
+import numpy as np
+
+# flat: float32；fp16、int8: 标量量化，每维 2、1 字节；pq: 乘积量化，每个子空间 1 字节
+QUANTIZATIONS = ('flat', 'fp16', 'int8', 'pq')
+
+
+def build_index(embeddings, quantization='flat', pq_m=128):
+    """
+    构建 L2 距离的 FAISS 索引
+    :param embeddings: float32 向量，shape (n, d)
+    :param quantization: QUANTIZATIONS 之一
+    :param pq_m: pq 的子空间数，不能整除维度时取不超过它的最大约数
+    """
+    import faiss
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    num, dimension = embeddings.shape
+    if quantization == 'flat':
+        index = faiss.IndexFlatL2(dimension)
+    elif quantization == 'fp16':
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif quantization == 'int8':
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif quantization == 'pq':
+        m = max(i for i in range(1, min(pq_m, dimension) + 1) if dimension % i == 0)
+        # 每个子空间 256 个中心至少需要 256 条训练数据，语料太小时减少中心数
+        nbits = max(1, min(8, int(math.log2(max(num, 2)))))
+        index = faiss.IndexPQ(dimension, m, nbits, faiss.METRIC_L2)
+    else:
+        raise ValueError(f"未知的向量量化方式: {quantization}，可选 {QUANTIZATIONS}")
+
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def is_quantized(index):
+    import faiss
+    return not isinstance(index, faiss.IndexFlat)
+
+
+def vectors_path(faiss_path):
+    """
+    量化索引旁保存的 float32 向量，用于精排
+    """
+    return f"{faiss_path}.f32.npy"
+
+
+def load_vectors(faiss_path):
+    """
+    以内存映射方式打开 float32 向量，精排时只读入候选所在的页，不占常驻内存
+    """
+    path = vectors_path(faiss_path)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+
+def rescore(vectors, queries, candidates, k):
+    """
+    用 float32 向量对量化索引返回的候选精确重算 L2 距离
+    :param vectors: 全部 float32 向量 (可以是内存映射)
+    :param queries: 查询向量，shape (nq, d)
+    :param candidates: 量化索引返回的候选 id，-1 为填充
+    :return: (D, I)，与 faiss 的 search 相同，不足 k 个时用 inf 和 -1 填充
+    """
+    D = np.full((len(queries), k), np.inf, dtype=np.float32)
+    I = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, (query, ids) in enumerate(zip(queries, candidates)):
+        # 排好序的 id 顺序读取内存映射
+        ids = np.unique(ids[ids >= 0])
+        if not len(ids):
+            continue
+        distances = ((np.asarray(vectors[ids], dtype=np.float32) - query) ** 2).sum(axis=1)
+        top = np.argsort(distances, kind='stable')[:k]
+        D[row, :len(top)] = distances[top]
+        I[row, :len(top)] = ids[top]
+    return D, I
@@ -3,6 +3,7 @@ from app.rag.keyword_search import KeyWordSearch
 
 from app.rag.vector_search import VectorSearch
 from config import RESULT_TOPK
+from qwen_agent.utils.rank_fusion import rrf_fuse
 
 
 class RagSearch(object):
@@ -18,38 +19,72 @@ class RagSearch(object):
         self.vector_search = VectorSearch(faiss_path, embedding_model)
         self.rerank_model = rank_model
     def rrf_fusion(self, list1, list2, k=60, w1=0.1, w2=1.0):
-       
-        scores = {}
+        """ RRF fusion of two lists of ids
 
-        for rank, item in enumerate(list1, start=1):
-            scores[item] = scores.get(item, 0.0) + w1 * (1.0 / (k + rank))
-
-        for rank, item in enumerate(list2, start=1):
-            scores[item] = scores.get(item, 0.0) + w2 * (1.0 / (k + rank))
+        Returns:
+            list: fused ids
+        """
+        return rrf_fuse([list1, list2], weights=[w1, w2], k=k).ids.tolist()
 
-        fused = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        return [item for item, _ in fused]
-
-    def search(self, query, bm25, data_list,w=0.1,flat_flag=True):
-        """ sum vector、bm25 、rerank search
+    def search_scored(self, query, bm25, w=0.1, flat_flag=True, top_k=None):
+        """ sum vector、bm25 search, keeping the fused scores so that callers can threshold them
 
         Args:
             query (str): question
             bm25 (object): bm25
-            data_list (list): data list
+            top_k (int): only keep the best top_k ids
+
+        Returns:
+            FusionResult: ids, fused scores and the scores of (keyword, vector) search
         """
-        search_sum = []
-        vector_search_result = self.vector_search.simple_vector_search(query, data_list)
-        keyword_search_result = self.key_search.keyword_search(query, bm25, data_list)
+        return self.search_scored_batch([query], bm25, w=w, flat_flag=flat_flag, top_k=top_k)[0]
 
-        rrf_result = self.rrf_fusion(keyword_search_result, vector_search_result, k=60,w1=w)
+    def search_scored_batch(self, queries, bm25, w=0.1, flat_flag=True, top_k=None, vector_search=None):
+        """ search_scored for several queries, embedding all of them in one request
+
+        Args:
+            queries (list): questions
+            bm25 (object): bm25
+            vector_search (object): searches the vectors instead of self.vector_search, e.g. an IndexSnapshot
+
+        Returns:
+            list: one FusionResult per query
+        """
+        vector_search_results = (vector_search or self.vector_search).vector_search_ids_batch(queries)
 
         if flat_flag:
             print('flat RAG search')
-            return vector_search_result
-        else:
+            # flat search is the vector ranking alone
+            return [rrf_fuse([ids], top_k=top_k) for ids in vector_search_results]
 
-            return rrf_result
+        results = []
+        for query, vector_search_result in zip(queries, vector_search_results):
+            keyword_search_result = self.key_search.keyword_search_ids(query, bm25)
+            results.append(rrf_fuse([keyword_search_result, vector_search_result], weights=[w, 1.0], k=60,
+                                    top_k=top_k))
+        return results
+
+    def search_ids(self, query, bm25, w=0.1, flat_flag=True):
+        """ sum vector、bm25 search, working on the ids of data list
+
+        Args:
+            query (str): question
+            bm25 (object): bm25
+
+        Returns:
+            list: ids of the search results
+        """
+        return self.search_scored(query, bm25, w=w, flat_flag=flat_flag).ids.tolist()
+
+    def search(self, query, bm25, data_list,w=0.1,flat_flag=True):
+        """ sum vector、bm25 、rerank search
+
+        Args:
+            query (str): question
+            bm25 (object): bm25
+            data_list (list): data list
+        """
+        return [data_list[i] for i in self.search_ids(query, bm25, w=w, flat_flag=flat_flag)]
 
     def rerank(self, query, search_sum):
         """rerank vector、bm25 results
@@ -59,8 +94,6 @@ class RagSearch(object):
             search_sum (list): search list
 
         Returns:
-            list: rerank scores list
+            RerankResult: indices into search_sum and their scores, best first
         """
-        reranked_dict = self.rerank_model.compute_score(query, search_sum)
-
-        return reranked_dict
+        return self.rerank_model.compute_score(query, search_sum)
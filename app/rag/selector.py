@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.rag.model import RagQA
+from app.service_registry import get_registry
+from config import FAISS_PATH, SERVICE_CATALOG
+
+
+class ToolSelector(object):
+    """
+    Hi-RAG 工具选择: 混合检索 (BM25 + 向量，RRF 融合) 召回工具，再用层级描述 (type、service、tool) 重排，
+    取排名最前的几个服务。选择逻辑与 SigMCP.hi_rag_test_top3 一致，但可以一次处理一批查询:
+    一批查询只发一次向量化请求，各查询的重排请求并发发出
+    """
+
+    def __init__(self, qa_engine=None, registry=None, rerank_workers=8, index=None):
+        """
+        :param qa_engine: RagQA，默认使用服务目录中的工具描述作为语料
+        :param registry: ServiceRegistry
+        :param rerank_workers: 同时进行的重排请求数
+        :param index: IncrementalIndex，给定时在它的当前快照上检索，服务目录可以在线更新
+        """
+        self.index = index
+        if index is not None:
+            qa_engine, registry = index.qa_engine, index.registry
+        self.registry = registry or get_registry()
+        self.qa_engine = qa_engine or RagQA(FAISS_PATH, SERVICE_CATALOG, 'summary')
+        if index is None and self.qa_engine.data_sum != self.registry.tool_summaries:
+            raise ValueError(f"RAG 语料与服务目录不一致: {SERVICE_CATALOG}")
+        self.rerank_pool = ThreadPoolExecutor(max_workers=rerank_workers)
+
+    def rerank_scored(self, query, tool_ids):
+        """
+        使用层级描述对工具重排
+        :return: [(工具 id, 重排分数)]，按分数从高到低
+        """
+        hier_descriptions = self.registry.hier_descriptions
+        results = self.qa_engine.search_engine.rerank(query, [hier_descriptions[i] for i in tool_ids])
+        return [(tool_ids[i], score) for i, score in zip(results.ids.tolist(), results.scores.tolist())]
+
+    def rerank_all(self, queries, candidates):
+        """
+        各查询的重排请求并发发出
+        :return: 每个查询的 rerank_scored 结果
+        """
+        return list(self.rerank_pool.map(self.rerank_scored, queries, candidates))
+
+    def select_batch(self, queries, w=0.1, top_services=3, num_candidates=10, max_candidates=10, rerank=True):
+        """
+        :param queries: 查询列表
+        :param w: BM25 在 RRF 融合中的权重
+        :param top_services: 返回的服务数
+        :param num_candidates: 参与重排的工具数，其中不足 top_services 个服务时扩大到 max_candidates
+        :param max_candidates: 默认与 num_candidates 相同即不扩大，与 hi_rag_test_top3 的默认行为一致
+        :param rerank: 是否使用层级描述重排，否则直接按融合分数排序
+        :return: 每个查询的选择结果，见 _format_result
+        """
+        if self.index is not None:
+            fused_list = self.index.search_scored_batch(queries, w=w, flat_flag=False)
+        else:
+            fused_list = self.qa_engine.search_engine.search_scored_batch(
+                queries, self.qa_engine.bm25_engine, w=w, flat_flag=False)
+
+        candidates = []
+        for fused in fused_list:
+            all_tool_ids = fused.ids.tolist()
+            tool_ids = all_tool_ids[:num_candidates]
+            if len(self.registry.unique_services(tool_ids, limit=top_services)) < top_services:
+                tool_ids = all_tool_ids[:max_candidates]
+            candidates.append(tool_ids)
+
+        if rerank:
+            ranked_list = self.rerank_all(queries, candidates)
+        else:
+            ranked_list = [
+                [(tool_id, float(score)) for tool_id, score in zip(fused.ids.tolist(), fused.scores.tolist())
+                 if tool_id in tool_ids]
+                for fused, tool_ids in zip(fused_list, candidates)
+            ]
+
+        return [
+            self._format_result(query, ranked, fused, top_services)
+            for query, ranked, fused in zip(queries, ranked_list, fused_list)
+        ]
+
+    def select(self, query, **kwargs):
+        return self.select_batch([query], **kwargs)[0]
+
+    def _format_result(self, query, ranked, fused, top_services):
+        """
+        :param ranked: [(工具 id, 分数)]，按分数从高到低
+        :param fused: 混合检索的 FusionResult
+        :return: {'query', 'tools': 排好序的候选工具, 'services': 前 top_services 个服务及其候选工具,
+                  'mcpServers': 可直接传给 Agent 的服务配置}
+        """
+        registry = self.registry
+        rrf_scores = dict(zip(fused.ids.tolist(), fused.scores.tolist()))
+
+        tools = []
+        for tool_id, score in ranked:
+            service_id = registry.tool_service[tool_id]
+            tools.append({
+                'id': tool_id,
+                'service': registry.service_names[service_id],
+                'summary': registry.tool_summaries[tool_id],
+                'path': registry.tool_paths[tool_id],
+                'method': registry.tool_methods[tool_id],
+                'score': score,
+                'rrf_score': rrf_scores.get(tool_id, 0.0),
+            })
+
+        service_ids = registry.unique_services([tool_id for tool_id, _ in ranked], limit=top_services)
+        services = []
+        for service_id in service_ids:
+            service_name = registry.service_names[service_id]
+            service_tools = [tool for tool in tools if tool['service'] == service_name]
+            services.append({
+                'id': service_id,
+                'name': service_name,
+                'type': registry.type_names[registry.service_types[service_id]],
+                'url': registry.service_url(service_id),
+                # 服务的分数取其排名最前的工具的分数
+                'score': service_tools[0]['score'],
+                'tools': service_tools,
+            })
+
+        return {
+            'query': query,
+            'services': services,
+            'tools': tools,
+            'mcpServers': registry.mcp_servers(service_ids)['mcpServers'],
+        }
@@ -0,0 +1,290 @@
+import os
+import time
+import asyncio
+import threading
+from typing import List, Optional
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, ConfigDict, Field
+
+from config import HIRAG_MAX_BATCH, HIRAG_MAX_WAIT_MS, HIRAG_MAX_INFLIGHT
+
+
+class SelectOptions(BaseModel):
+    w: float = Field(0.1, description="BM25 在 RRF 融合中的权重")
+    top_services: int = Field(3, ge=1, description="返回的服务数")
+    num_candidates: int = Field(10, ge=1, description="参与重排的工具数")
+    max_candidates: int = Field(10, ge=1, description="候选中服务不足时扩大到的工具数")
+    rerank: bool = Field(True, description="是否使用层级描述重排")
+
+
+class SelectToolsRequest(SelectOptions):
+    query: str
+
+
+class SelectToolsBatchRequest(SelectOptions):
+    queries: List[str] = Field(..., min_length=1)
+
+
+class Endpoint(BaseModel):
+    # 其余字段 (parameters、description 等) 原样写入服务目录
+    model_config = ConfigDict(extra='allow')
+
+    path: str
+    method: str
+    summary: str
+
+
+class ServiceItem(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    path: str = Field(..., description="run.py 相对 app/mcp_service 的路径")
+    port: int
+    transport: str = 'sse'
+    type: Optional[str] = Field(None, description="层级描述中的 type，默认取 path 的第一级目录")
+    hier_title: Optional[str] = Field(None, description="层级描述中的 service")
+    endpoints: List[Endpoint] = []
+
+
+class AddToolsRequest(BaseModel):
+    endpoints: List[Endpoint] = Field(..., min_length=1)
+
+
+class Metrics(object):
+    """
+    进程内的计数器，以 Prometheus 文本格式输出。多 worker 部署时每个 worker 各自计数，用 pid 标签区分
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self.counters = {
+            'hirag_requests_total': 0,
+            'hirag_request_errors_total': 0,
+            'hirag_queries_total': 0,
+            'hirag_batches_total': 0,
+            'hirag_request_seconds_sum': 0.0,
+            'hirag_batch_seconds_sum': 0.0,
+            'hirag_catalog_updates_total': 0,
+        }
+        self.index_tools = 0
+        # 返回重排缓存统计的函数，未启用缓存时为 None
+        self.rerank_cache_stats = None
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def render(self):
+        with self._lock:
+            counters = dict(self.counters)
+        labels = f'{{pid="{os.getpid()}"}}'
+        lines = [f"{name}{labels} {value}" for name, value in counters.items()]
+        lines.append(f"hirag_index_tools{labels} {self.index_tools}")
+        lines.append(f"hirag_uptime_seconds{labels} {time.time() - self.start_time:.3f}")
+        if self.rerank_cache_stats is not None:
+            for name, value in self.rerank_cache_stats().items():
+                lines.append(f"hirag_rerank_cache_{name}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class MicroBatcher(object):
+    """
+    把并发到达的请求合并成一批: 等待最多 max_wait 秒或凑满 max_batch 个查询后，选项相同的查询一起交给
+    fn(queries, options) 处理，一批只发一次向量化请求。fn 在线程池中运行，不阻塞事件循环
+    """
+
+    def __init__(self, fn, max_batch=HIRAG_MAX_BATCH, max_wait=HIRAG_MAX_WAIT_MS / 1000,
+                 max_inflight=HIRAG_MAX_INFLIGHT, metrics=None):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics or Metrics()
+        self._max_inflight = max_inflight
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._inflight = asyncio.Semaphore(self._max_inflight)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, queries, options):
+        """
+        :return: 与 queries 一一对应的结果
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((queries, options, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            num_queries = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+            while num_queries < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                num_queries += len(item[0])
+
+            groups = {}
+            for item in items:
+                groups.setdefault(tuple(sorted(item[1].items())), []).append(item)
+            for group in groups.values():
+                # 限制同时处理的批数，处理期间继续收集下一批
+                await self._inflight.acquire()
+                asyncio.create_task(self._dispatch(group))
+
+    async def _dispatch(self, items):
+        try:
+            queries = [query for item in items for query in item[0]]
+            start = time.perf_counter()
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(None, self.fn, queries, items[0][1])
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self.metrics.inc('hirag_batches_total')
+            self.metrics.inc('hirag_queries_total', len(queries))
+            self.metrics.inc('hirag_batch_seconds_sum', time.perf_counter() - start)
+
+            offset = 0
+            for item_queries, _, future in items:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(item_queries)])
+                offset += len(item_queries)
+        finally:
+            self._inflight.release()
+
+
+def _num_tools(registry):
+    return len(registry.tool_alive) - registry.tool_alive.count(0)
+
+
+def create_app(selector_factory=None, max_batch=HIRAG_MAX_BATCH, max_wait_ms=HIRAG_MAX_WAIT_MS,
+               max_inflight=HIRAG_MAX_INFLIGHT):
+    """
+    Hi-RAG 检索服务。索引在启动时加载并常驻内存，请求经 MicroBatcher 合并后批量检索和重排
+    :param selector_factory: 返回 ToolSelector 的函数，默认使用服务目录中的工具
+    :param max_batch: 一批的最大查询数
+    :param max_wait_ms: 凑批最多等待的毫秒数
+    :param max_inflight: 同时处理的批数
+    """
+    metrics = Metrics()
+    state = {}
+
+    @asynccontextmanager
+    async def lifespan(_app):
+        if selector_factory is None:
+            from app.rag.selector import ToolSelector
+            factory = ToolSelector
+        else:
+            factory = selector_factory
+        # 加载索引较慢，放到线程中避免阻塞事件循环
+        selector = await asyncio.get_running_loop().run_in_executor(None, factory)
+        state['selector'] = selector
+        metrics.index_tools = _num_tools(selector.registry)
+        metrics.rerank_cache_stats = getattr(selector.qa_engine.search_engine.rerank_model, 'stats', None)
+        batcher = MicroBatcher(lambda queries, options: selector.select_batch(queries, **options),
+                               max_batch=max_batch, max_wait=max_wait_ms / 1000, max_inflight=max_inflight,
+                               metrics=metrics)
+        await batcher.start()
+        state['batcher'] = batcher
+        yield
+        await batcher.stop()
+
+    app = FastAPI(title="Hi-RAG tool selection", lifespan=lifespan)
+
+    async def _select(queries, options):
+        metrics.inc('hirag_requests_total')
+        start = time.perf_counter()
+        try:
+            return await state['batcher'].submit(queries, options)
+        except Exception as e:
+            metrics.inc('hirag_request_errors_total')
+            raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {e}")
+        finally:
+            metrics.inc('hirag_request_seconds_sum', time.perf_counter() - start)
+
+    @app.post("/select_tools", summary="Select the top services and tools for a query")
+    async def select_tools(request: SelectToolsRequest):
+        results = await _select([request.query], request.model_dump(exclude={'query'}))
+        return results[0]
+
+    @app.post("/select_tools:batch", summary="Select the top services and tools for several queries")
+    async def select_tools_batch(request: SelectToolsBatchRequest):
+        results = await _select(request.queries, request.model_dump(exclude={'queries'}))
+        return {'results': results}
+
+    async def _update(method, *args):
+        """
+        在线更新服务目录，只有 selector 使用 IncrementalIndex 时可用
+        """
+        selector = state.get('selector')
+        if selector is None or getattr(selector, 'index', None) is None:
+            raise HTTPException(status_code=409, detail="服务未开启增量索引 (hirag_server.py --incremental)")
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, getattr(selector.index, method), *args)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        metrics.inc('hirag_catalog_updates_total')
+        metrics.index_tools = _num_tools(selector.registry)
+        return result
+
+    @app.put("/services/{name}", summary="Add a service or replace its tools")
+    async def upsert_service(name: str, item: ServiceItem):
+        return await _update('upsert_service', dict(item.model_dump(exclude_none=True), name=name))
+
+    @app.delete("/services/{name}", summary="Delete all tools of a service")
+    async def delete_service(name: str):
+        return {'deleted': await _update('delete_service', name)}
+
+    @app.post("/services/{name}/tools", summary="Add tools to a service")
+    async def add_tools(name: str, request: AddToolsRequest):
+        return {'ids': await _update('add_tools', name, [e.model_dump() for e in request.endpoints])}
+
+    @app.put("/tools/{tool_id}", summary="Update a tool, keeping its id")
+    async def update_tool(tool_id: int, endpoint: Endpoint):
+        await _update('update_tool', tool_id, endpoint.model_dump())
+        return {'id': tool_id}
+
+    @app.delete("/tools/{tool_id}", summary="Delete a tool")
+    async def delete_tool(tool_id: int):
+        await _update('delete_tools', [tool_id])
+        return {'deleted': [tool_id]}
+
+    @app.post("/index:compact", summary="Rebuild the base index and write a checkpoint")
+    async def compact():
+        await _update('compact')
+        return {'version': state['selector'].index.snapshot.version}
+
+    @app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus metrics of this worker")
+    async def get_metrics():
+        return metrics.render()
+
+    @app.get("/health", summary="Whether the index is loaded")
+    async def health():
+        return {'status': 'ok' if 'batcher' in state else 'starting', 'tools': metrics.index_tools}
+
+    return app
@@ -1,7 +1,10 @@
+import os
+import threading
+
 import numpy as np
-import faiss
 
-from config import SEARCH_TOPK
+from app.rag.quantization import is_quantized, load_vectors, rescore
+from config import SEARCH_TOPK, VECTOR_RESCORE_FACTOR
 
 
 class VectorSearch(object):
@@ -16,21 +19,77 @@ class VectorSearch(object):
 
         self.faiss_path = faiss_path
         self.embedding_model = embedding_model
+        # 索引只在文件变化时重新加载，不再每次查询都读盘
+        self._index = None
+        self._vectors = None
+        self._index_mtime = None
+        self._index_lock = threading.Lock()
 
-    def simple_vector_search(self, query, data_list):
+    def get_index(self):
+        """
+        常驻内存的 FAISS 索引，索引文件被重建后自动重新加载
+        """
+        return self.load()[0]
+
+    def load(self):
+        """
+        :return: (索引, 精排用的 float32 向量)，索引没有量化时向量为 None
+        """
+        mtime = os.path.getmtime(self.faiss_path)
+        if self._index is None or mtime != self._index_mtime:
+            with self._index_lock:
+                if self._index is None or mtime != self._index_mtime:
+                    import faiss
+                    index = faiss.read_index(self.faiss_path)
+                    vectors = load_vectors(self.faiss_path) if is_quantized(index) else None
+                    if vectors is not None and len(vectors) != index.ntotal:
+                        vectors = None
+                    self._index, self._vectors = index, vectors
+                    self._index_mtime = mtime
+        return self._index, self._vectors
+
+    def vector_search_ids(self, query):
         """use vector search
 
         Args:
             query (str):
-            data_list (list): data sum list
 
         Returns:
-            list: vector search list
+            list: ids of the nearest vectors
         """
-        index = faiss.read_index(self.faiss_path)
+        return self.vector_search_ids_batch([query])[0]
 
-        query_embedding = self.embedding_model.encode(query)
+    def vector_search_ids_batch(self, queries):
+        """use vector search for several queries, with one embedding request and one index search
 
-        D, I = index.search(np.array(query_embedding), SEARCH_TOPK)
+        Args:
+            queries (list): questions
+
+        Returns:
+            list: ids of the nearest vectors of each query
+        """
+        index, vectors = self.load()
 
-        return [data_list[i] for i in I[0]]
+        query_embeddings = np.array(self.embedding_model.encode(queries), dtype=np.float32)
+
+        if vectors is None:
+            D, I = index.search(query_embeddings, SEARCH_TOPK)
+        else:
+            # 量化索引多取一些候选，再用 float32 向量精排
+            _, candidates = index.search(query_embeddings, SEARCH_TOPK * VECTOR_RESCORE_FACTOR)
+            D, I = rescore(vectors, query_embeddings, candidates, SEARCH_TOPK)
+
+        # faiss pads with -1 when the index has fewer than SEARCH_TOPK vectors
+        return [[i for i in row if i >= 0] for row in I.tolist()]
+
+    def simple_vector_search(self, query, data_list):
+        """use vector search
+
+        Args:
+            query (str):
+            data_list (list): data sum list
+
+        Returns:
+            list: vector search list
+        """
+        return [data_list[i] for i in self.vector_search_ids(query)]
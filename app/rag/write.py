@@ -1,10 +1,11 @@
 import os
-import faiss
+import json
+import hashlib
 import numpy as np
-from rank_bm25 import BM25Okapi
-from tqdm import tqdm
-import jieba
 
+from app.rag.keyword_search import IncrementalBM25, cut
+from app.rag.quantization import build_index, vectors_path
+from config import VECTOR_QUANTIZATION, VECTOR_PQ_M
 
 
 class DataWrite(object):
@@ -18,25 +19,74 @@ class DataWrite(object):
         """
         self.embedding_model = embedding_model
 
-    def vector_write(self, data_list, faiss_path):
+    def vector_write(self, data_list, faiss_path, batch_size=32, quantization=VECTOR_QUANTIZATION):
+        """
+        向量化语料并写入 FAISS 索引，同时在索引旁记录语料的哈希
+        :param quantization: 向量的存储方式，见 app.rag.quantization.QUANTIZATIONS
+        :return: bm25
+        """
+        from tqdm import tqdm
 
         embeddings = []
-        for data_i in tqdm(data_list):
-            embedding_i = self.embedding_model.encode(data_i)
-            embeddings.append(embedding_i[0])
+        for i in tqdm(range(0, len(data_list), batch_size)):
+            # 一次请求向量化一批文本
+            embeddings.extend(self.embedding_model.encode(data_list[i:i + batch_size]))
 
-        embeddings = np.array(embeddings)
+        embeddings = np.array(embeddings, dtype=np.float32)
+        self.index_write(data_list, embeddings, faiss_path, quantization)
 
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
+        return self.bm25_build(data_list)
+
+    def load_or_write(self, data_list, faiss_path, quantization=VECTOR_QUANTIZATION):
+        """
+        语料和量化方式与已有索引一致时直接复用，不再重新向量化；否则重建索引
+        :return: bm25
+        """
+        hash_path = self.corpus_hash_path(faiss_path)
+        if os.path.exists(faiss_path) and os.path.exists(hash_path):
+            with open(hash_path, encoding='utf-8') as f:
+                if f.read().strip() == self.corpus_hash(data_list, quantization):
+                    return self.bm25_build(data_list)
+        return self.vector_write(data_list, faiss_path, quantization=quantization)
 
-        index.add(embeddings)
+    @classmethod
+    def index_write(cls, data_list, embeddings, faiss_path, quantization=VECTOR_QUANTIZATION):
+        """
+        把已经向量化的语料写入 FAISS 索引
+        :return: 索引
+        """
+        index = build_index(embeddings, quantization, pq_m=VECTOR_PQ_M)
 
-        faiss.write_index(index, faiss_path)
+        # 先写临时文件再替换，其他进程不会读到写了一半的索引。精排用的向量先于索引写入，
+        # 读取方在索引变化时一起重新加载
+        tmp_path = f"{faiss_path}.{os.getpid()}.tmp"
+        if quantization != 'flat':
+            with open(tmp_path, 'wb') as f:
+                np.save(f, embeddings)
+            os.replace(tmp_path, vectors_path(faiss_path))
+        import faiss
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, faiss_path)
+        if quantization == 'flat' and os.path.exists(vectors_path(faiss_path)):
+            os.remove(vectors_path(faiss_path))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(cls.corpus_hash(data_list, quantization))
+        os.replace(tmp_path, cls.corpus_hash_path(faiss_path))
+        return index
 
+    @staticmethod
+    def bm25_build(data_list):
         # bm25
-        tokenized_corpus = [list(jieba.cut(text)) for text in data_list]  
-        bm25 = BM25Okapi(tokenized_corpus)  
+        tokenized_corpus = [cut(text) for text in data_list]
+        bm25 = IncrementalBM25.from_corpus(tokenized_corpus)
         return bm25
 
-    
+    @staticmethod
+    def corpus_hash(data_list, quantization='flat'):
+        # flat 索引的哈希与只对语料计算的一致，已有的索引不需要重建
+        content = data_list if quantization == 'flat' else [quantization, data_list]
+        return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def corpus_hash_path(faiss_path):
+        return f"{faiss_path}.sha256"
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+from array import array
+from functools import lru_cache
+
+from config import SERVICE_DIR, SERVICE_INFO, SERVICE_CATALOG, SUMMARY_PATH
+
+# 注册表中服务的状态
+SERVICE_STATUS = ('starting', 'ready', 'failed', 'crashed')
+
+
+def load_service_catalog():
+    """
+    读取服务目录（名称、run.py 路径、端口、传输方式），替代从 run.py 源码中正则提取端口
+    :return: {service_name: {'name', 'path', 'port', 'transport'}}
+    """
+    catalog = {}
+    for item in json.loads(open(SERVICE_CATALOG, encoding="utf-8").read()):
+        catalog[item['name']] = {
+            'name': item['name'],
+            'path': os.path.join(SERVICE_DIR, item['path']),
+            'port': int(item['port']),
+            'transport': item.get('transport', 'sse')
+        }
+    return catalog
+
+
+def validate_registry(services_info, path=SERVICE_INFO):
+    """
+    校验服务注册表的格式，旧版（制表符分隔或缺少 port/status）的文件直接报错
+    """
+    if not isinstance(services_info, dict):
+        raise ValueError(f"服务注册表格式错误: {path}，请重新运行 python service.py start")
+    for service_name, info in services_info.items():
+        if not isinstance(info, dict) or not isinstance(info.get('port'), int) or \
+                info.get('status') not in SERVICE_STATUS:
+            raise ValueError(f"服务注册表已过期: {path} 中的 {service_name} 缺少 port/status，"
+                             f"请重新运行 python service.py start")
+
+
+def read_registry(path=SERVICE_INFO):
+    """
+    读取服务注册表
+    :return: {service_name: {'name', 'port', 'pid', 'tools_hash', 'status', ...}}，文件不存在时返回空字典
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            services_info = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"服务注册表不是 JSON 格式: {path}，请重新运行 python service.py start") from e
+    validate_registry(services_info, path)
+    return services_info
+
+
+def write_registry(services_info, path=SERVICE_INFO):
+    """
+    原子写入服务注册表，读取方不会看到写了一半的文件
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(services_info, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def ready_services(path=SERVICE_INFO):
+    """
+    注册表中已通过就绪探测的服务，按注册顺序返回
+    :return: [{'name', 'port', 'pid', 'tools_hash', 'status', ...}]
+    """
+    return [info for info in read_registry(path).values() if info.get('status') == 'ready']
+
+
+class ServiceRegistry(object):
+    """
+    编译后的 type -> service -> tool 层级信息。
+
+    工具和服务都用整数 id 表示：工具 id 即服务目录中 endpoints 展开后的顺序（与 RagQA 建索引的顺序一致），
+    按 id 索引数组即可拿到服务、端口、类型，不需要再用较长的 summary 字符串查字典。
+    """
+
+    def __init__(self, catalog_path=SERVICE_CATALOG, summary_path=SUMMARY_PATH):
+        """
+        :param catalog_path: 服务目录，提供服务、端口和工具列表
+        :param summary_path: summary2other.json，提供层级描述中使用的 type 和 title
+        """
+        catalog = json.loads(open(catalog_path, encoding="utf-8").read())
+        summary2other = json.loads(open(summary_path, encoding="utf-8").read())
+
+        self.service_names = []
+        self.service_titles = []
+        self.type_names = []
+        service_ports = []
+        service_types = []
+        self.service_tools = []
+
+        self.tool_summaries = []
+        self.tool_paths = []
+        self.tool_methods = []
+        tool_service = []
+
+        type_ids = {}
+        for item in catalog:
+            service_id = len(self.service_names)
+            service_name = sys.intern(item['name'])
+            endpoints = item.get('endpoints') or []
+
+            first_tool_id = len(self.tool_summaries)
+            # 没有工具的服务不在 summary2other 中，使用服务目录中的分类目录作为 type
+            title, type_name = f"{item['name'].lower()} service", item['path'].split('/')[0]
+            for endpoint in endpoints:
+                summary = endpoint['summary']
+                other = summary2other.get(summary)
+                # summary2other 与服务目录不一致时直接报错，避免按过期的端口或层级信息选择服务
+                if other is None or other['service_name'] != service_name or int(other['port']) != int(item['port']):
+                    raise ValueError(f"{summary_path} 与服务目录不一致: {service_name} 的工具 '{summary}'")
+                title, type_name = other['title'], other['type']
+                self.tool_summaries.append(summary)
+                self.tool_paths.append(endpoint['path'])
+                self.tool_methods.append(sys.intern(endpoint['method'].lower()))
+                tool_service.append(service_id)
+
+            if type_name not in type_ids:
+                type_ids[type_name] = len(self.type_names)
+                self.type_names.append(sys.intern(type_name))
+            self.service_names.append(service_name)
+            self.service_titles.append(sys.intern(title))
+            service_ports.append(int(item['port']))
+            service_types.append(type_ids[type_name])
+            self.service_tools.append(array('i', range(first_tool_id, len(self.tool_summaries))))
+
+        if len(set(self.tool_summaries)) != len(self.tool_summaries):
+            raise ValueError(f"服务目录中存在重复的工具描述: {catalog_path}")
+
+        self.service_ports = array('i', service_ports)
+        self.service_types = array('i', service_types)
+        self.tool_service = array('i', tool_service)
+        self.service_ids = {name: i for i, name in enumerate(self.service_names)}
+        # 增量更新时删除的工具保留原来的 id，只标记为不可用
+        self.tool_alive = bytearray(b'\x01' * len(self.tool_summaries))
+        self.tool_ids = {(tool_service[i], self.tool_paths[i], self.tool_methods[i]): i
+                         for i in range(len(self.tool_summaries))}
+
+        # 重排时使用的层级描述，每个工具只拼接一次
+        self.hier_descriptions = [self._hier_description(i) for i in range(len(self.tool_summaries))]
+
+    def _hier_description(self, tool_id):
+        service_id = self.tool_service[tool_id]
+        return (f"This is hierarchical information: type={self.type_names[self.service_types[service_id]]}, "
+                f"service={self.service_titles[service_id]}, tool={self.tool_summaries[tool_id]}")
+
+    @property
+    def num_tools(self):
+        return len(self.tool_summaries)
+
+    def unique_services(self, tool_ids, limit=None):
+        """
+        按工具的排序取出不重复的服务 id
+        :param tool_ids: 排好序的工具 id
+        :param limit: 最多返回的服务数
+        """
+        service_ids = []
+        for tool_id in tool_ids:
+            service_id = self.tool_service[tool_id]
+            if service_id not in service_ids:
+                service_ids.append(service_id)
+                if limit is not None and len(service_ids) >= limit:
+                    break
+        return service_ids
+
+    def service_url(self, service_id):
+        return f"http://localhost:{self.service_ports[service_id]}/sse"
+
+    def mcp_servers(self, service_ids):
+        """
+        构建 Agent 的 mcpServers 配置
+        """
+        return {
+            'mcpServers': {
+                self.service_names[service_id]: {'url': self.service_url(service_id)}
+                for service_id in service_ids
+            }
+        }
+
+    # 以下方法供 app.rag.incremental 在线更新服务目录: 只追加或整体替换元素，工具和服务 id 不会复用，
+    # 正在使用旧 id 的读取方仍能查到一致的信息
+
+    def find_tool(self, service_name, path, method):
+        """
+        :return: 服务中 (path, method) 对应的可用工具 id，不存在时返回 None
+        """
+        service_id = self.service_ids.get(service_name)
+        tool_id = self.tool_ids.get((service_id, path, method.lower()))
+        return tool_id if tool_id is not None and self.tool_alive[tool_id] else None
+
+    def add_service(self, name, port, type_name, title):
+        """
+        增加服务，已存在时修改其端口和层级信息
+        :return: 服务 id
+        """
+        name = sys.intern(name)
+        if type_name not in self.type_names:
+            self.type_names.append(sys.intern(type_name))
+        type_id = self.type_names.index(type_name)
+
+        service_id = self.service_ids.get(name)
+        if service_id is None:
+            service_id = len(self.service_names)
+            self.service_titles.append(sys.intern(title))
+            self.service_ports.append(int(port))
+            self.service_types.append(type_id)
+            self.service_tools.append(array('i'))
+            self.service_names.append(name)
+            self.service_ids[name] = service_id
+            return service_id
+
+        self.service_ports[service_id] = int(port)
+        if (self.service_titles[service_id], self.service_types[service_id]) != (title, type_id):
+            self.service_titles[service_id] = sys.intern(title)
+            self.service_types[service_id] = type_id
+            for tool_id in self.service_tools[service_id]:
+                self.hier_descriptions[tool_id] = self._hier_description(tool_id)
+        return service_id
+
+    def set_tool(self, tool_id, service_id, summary, path, method):
+        """
+        写入工具，tool_id 等于 num_tools 时新增
+        """
+        method = sys.intern(method.lower())
+        if tool_id == self.num_tools:
+            self.tool_paths.append(path)
+            self.tool_methods.append(method)
+            self.tool_service.append(service_id)
+            self.tool_alive.append(1)
+            self.hier_descriptions.append(None)
+            # 最后追加 summary: 读取方按 num_tools 判断工具是否存在
+            self.tool_summaries.append(summary)
+        else:
+            self._unlink_tool(tool_id)
+            self.tool_summaries[tool_id] = summary
+            self.tool_paths[tool_id] = path
+            self.tool_methods[tool_id] = method
+            self.tool_service[tool_id] = service_id
+            self.tool_alive[tool_id] = 1
+        self.hier_descriptions[tool_id] = self._hier_description(tool_id)
+        self.tool_ids[(service_id, path, method)] = tool_id
+        self.service_tools[service_id] = array('i', sorted([*self.service_tools[service_id], tool_id]))
+
+    def remove_tool(self, tool_id):
+        """
+        删除工具，其 id 不再使用
+        """
+        self._unlink_tool(tool_id)
+        self.tool_alive[tool_id] = 0
+
+    def _unlink_tool(self, tool_id):
+        service_id = self.tool_service[tool_id]
+        key = (service_id, self.tool_paths[tool_id], self.tool_methods[tool_id])
+        if self.tool_ids.get(key) == tool_id:
+            del self.tool_ids[key]
+        self.service_tools[service_id] = array('i', [i for i in self.service_tools[service_id] if i != tool_id])
+
+
+@lru_cache(maxsize=None)
+def get_registry(catalog_path=SERVICE_CATALOG, summary_path=SUMMARY_PATH):
+    """
+    进程内共享的 ServiceRegistry，只加载一次
+    """
+    return ServiceRegistry(catalog_path, summary_path)
@@ -1,18 +1,22 @@
 import os
 from app.rag.model import SimpleRagQA
-from config import SIG_TEST_DIR,SERVICE_INFO
+from app.service_registry import ready_services, get_registry
+from config import SIG_TEST_DIR
 from qwen_agent.agents import Assistant
 import json
 from tqdm import tqdm
-from config import SUMMARY_PATH,FAISS_PATH
+from config import SERVICE_CATALOG,FAISS_PATH
 
 
 class SigMCP(object):
     def __init__(self,):
         self.sig_test_dir = SIG_TEST_DIR
-        self.summary2other=json.loads(open(SUMMARY_PATH,encoding="utf-8").read())
+        # 工具 id 即 RAG 语料中的下标，检索结果直接按 id 查服务和端口
+        self.registry = get_registry()
 
-        self.simple_qa = SimpleRagQA(faiss_path=FAISS_PATH,data_path=SIG_TEST_DIR,embedding_name='summary')
+        self.simple_qa = SimpleRagQA(faiss_path=FAISS_PATH,data_path=SERVICE_CATALOG,embedding_name='summary')
+        if self.simple_qa.qa_engine.data_sum != self.registry.tool_summaries:
+            raise ValueError(f"RAG 语料与服务目录不一致: {SERVICE_CATALOG}")
 
         
     def init_agent_service(self,tools,llm_set,sys_mes=''):
@@ -28,6 +32,16 @@ class SigMCP(object):
                         description="I'm a roboot using the tool calling.")
         return bot
 
+    def rerank_ids(self,query,tool_ids):
+        """
+        使用层级描述 (type、service、tool) 对工具重排
+        :param tool_ids: 检索得到的工具 id
+        :return: 重排后的工具 id
+        """
+        hier_descriptions=self.registry.hier_descriptions
+        results=self.simple_qa.qa_engine.search_engine.rerank(query, [hier_descriptions[i] for i in tool_ids])
+        return [tool_ids[i] for i in results.ids.tolist()]
+
 
     def test(self,query: str,llm_set):
         # Define the agent
@@ -36,10 +50,9 @@ class SigMCP(object):
         }]
         # 在 service 为 27个时，为35K，因此选择26个service作为截断，35108 tokens (33108 in the messages, 2000 in the completion),保证服务的运行
         # qwen3-32b、qwq-32b、qwq_8b为26个，DeepSeek、llama为23个，词表不一样
-        for line in open(SERVICE_INFO, encoding="utf-8").readlines()[:23]:
-            service_name, service_port = line.strip().split("\t")
-            tools[0]['mcpServers'][service_name] = {
-                'url': f"http://localhost:{service_port}/sse"
+        for service_i in ready_services()[:23]:
+            tools[0]['mcpServers'][service_i['name']] = {
+                'url': f"http://localhost:{service_i['port']}/sse"
             }
         print("tools:", tools)
         bot = self.init_agent_service(tools,llm_set)
@@ -57,20 +70,10 @@ class SigMCP(object):
     
 
     def rag_test(self,query,llm_set,w,prompt):
-        res_no_hi_des=self.simple_qa.qa_engine.search(query,w)
-        
-        res_str=res_no_hi_des[0]
+        tool_ids=self.simple_qa.qa_engine.search_ids(query,w)
         
-        service_find=self.summary2other[res_str]['service_name']
-        port_find=self.summary2other[res_str]['port']
         # Define the agent
-        tools=[{
-            'mcpServers': {
-                service_find: {
-                    'url': f"http://localhost:{port_find}/sse"
-                }
-            }
-        }]
+        tools=[self.registry.mcp_servers(self.registry.unique_services(tool_ids[:1]))]
         bot = self.init_agent_service(tools,llm_set=llm_set,sys_mes=prompt)
         # Chat
         messages = [{'role': 'user', 'content': query}]
@@ -85,20 +88,10 @@ class SigMCP(object):
     
     def rag_flat(self,query,llm_set,prompt):
         # step1:调用RAG 来进行相关的工具
-        res_no_hi_des=self.simple_qa.qa_engine.search(query)
+        tool_ids=self.simple_qa.qa_engine.search_ids(query)
         
-        res_str=res_no_hi_des[0]
-        
-        service_find=self.summary2other[res_str]['service_name']
-        port_find=self.summary2other[res_str]['port']
         # Define the agent
-        tools=[{
-            'mcpServers': {
-                service_find: {
-                    'url': f"http://localhost:{port_find}/sse"
-                }
-            }
-        }]
+        tools=[self.registry.mcp_servers(self.registry.unique_services(tool_ids[:1]))]
         
         bot = self.init_agent_service(tools,llm_set=llm_set,sys_mes=prompt)
         # Chat
@@ -114,30 +107,10 @@ class SigMCP(object):
 
     def rag_test_top3(self,query,llm_set,w,prompt):
         # step1:调用RAG 来进行相关的工具
-        res_no_hi_des=self.simple_qa.qa_engine.search(query,w)
-        service_find_list=[]
-        port_find_list=[]
-
-        for res_str_i in res_no_hi_des:
-        
-            service_find_i=self.summary2other[res_str_i]['service_name']
-            port_find_i=self.summary2other[res_str_i]['port']
-            if service_find_i not in service_find_list:
-                service_find_list.append(service_find_i)
-                port_find_list.append(port_find_i)
+        tool_ids=self.simple_qa.qa_engine.search_ids(query,w)
 
         # Define the agent
-        tools=[{
-            'mcpServers': {
-                
-            }
-        }]
-
-
-        for i in range(len(service_find_list[:3])):
-            tools[0]['mcpServers'][service_find_list[i]] = {
-                'url': f"http://localhost:{port_find_list[i]}/sse"
-            }
+        tools=[self.registry.mcp_servers(self.registry.unique_services(tool_ids,limit=3))]
         
         bot = self.init_agent_service(tools,llm_set=llm_set,sys_mes=prompt)
         # Chat
@@ -152,39 +125,14 @@ class SigMCP(object):
         return final_response
     def hi_rag_test(self,query,llm_set,w,prompt):
         # step1:调用RAG 来进行相关的工具
-        res_no_hi_des=self.simple_qa.qa_engine.search(query,w,flat_flag=False)
-        # 根据 res_no_hi_des来建立映射
-        res_no_hi_des=res_no_hi_des[:10]
-        res_no_hi_des_dict={}
-
-        for res_j in res_no_hi_des:
-            res_no_hi_des_dict[res_j]=f"This is hierarchical information: type={self.summary2other[res_j]['type']}, service={self.summary2other[res_j]['title']}, tool={res_j}"
-
-        value_list=list(res_no_hi_des_dict.values())
-
-
-        res_no_hi_des_dict_res={v:k for k,v in res_no_hi_des_dict.items()}
-
-
+        tool_ids=self.simple_qa.qa_engine.search_ids(query,w,flat_flag=False)
+        tool_ids=tool_ids[:10]
 
         # 来进行重排,这块根据 type 和 service name 进行重排
-        results=self.simple_qa.qa_engine.search_engine.rerank(query, value_list)
-        res_list=list(results.keys())
-        # 恢复到原数据
-        end_summary_list=[res_no_hi_des_dict_res[k] for k in res_list]
+        end_tool_ids=self.rerank_ids(query,tool_ids)
         # 选top 1
-        res_str=end_summary_list[0]
-
-        service_find=self.summary2other[res_str]['service_name']
-        port_find=self.summary2other[res_str]['port']
         # Define the agent
-        tools=[{
-            'mcpServers': {
-                service_find: {
-                    'url': f"http://localhost:{port_find}/sse"
-                }
-            }
-        }]
+        tools=[self.registry.mcp_servers(self.registry.unique_services(end_tool_ids[:1]))]
         
         bot = self.init_agent_service(tools,llm_set=llm_set,sys_mes=prompt)
         # bot=self.init_agent_service(tools,llm_set=llm_set,sys_mes="Please determine whether the provided tools can be used to solve the user's question. If they can, select the appropriate function to call without overthinking. If not, answer the user's question directly without overthinking.")
@@ -198,69 +146,24 @@ class SigMCP(object):
         # 处理最后一条完整回复
         final_response = responses[-1] if responses else {}
         return final_response
-    def filter_service(self,res):
-        service_names=[]
-        for sercice_des in res:
-            if self.summary2other[sercice_des]['service_name'] not in service_names:
-                service_names.append(self.summary2other[sercice_des]['service_name'])
-        if len(service_names)>=3:
-            return True
-        else:
-            return False
-    def hi_rag_test_top3(self,query,llm_set,w,prompt):
+    def filter_service(self,tool_ids):
+        return len(self.registry.unique_services(tool_ids,limit=3))>=3
+    def hi_rag_test_top3(self,query,llm_set,w,prompt,max_candidates=10):
+        """
+        :param max_candidates: 前 10 个工具不足 3 个服务时扩大到的候选数，默认 10 即不扩大，与以往的结果可比
+        """
         # step1:调用RAG 来进行相关的工具
-        res_no_hi_des=self.simple_qa.qa_engine.search(query,w,flat_flag=False)
-        # 根据 res_no_hi_des来建立映射
-        res_no_hi_des=res_no_hi_des[:10]
-
-        if not self.filter_service(res_no_hi_des):
-            res_no_hi_des=res_no_hi_des[:20]
-
-        res_no_hi_des_dict={}
-
-        for res_j in res_no_hi_des:
-            res_no_hi_des_dict[res_j]=f"This is hierarchical information: type={self.summary2other[res_j]['type']}, service={self.summary2other[res_j]['title']}, tool={res_j}"
-
-        value_list=list(res_no_hi_des_dict.values())
-
-
-        res_no_hi_des_dict_res={v:k for k,v in res_no_hi_des_dict.items()}
-
+        all_tool_ids=self.simple_qa.qa_engine.search_ids(query,w,flat_flag=False)
+        tool_ids=all_tool_ids[:10]
 
+        if not self.filter_service(tool_ids):
+            tool_ids=all_tool_ids[:max_candidates]
 
         # 来进行重排,这块根据 type 和 service name 进行重排
-        results=self.simple_qa.qa_engine.search_engine.rerank(query, value_list)
-        res_list=list(results.keys())
-        # 恢复到原数据
-        end_summary_list=[res_no_hi_des_dict_res[k] for k in res_list]
+        end_tool_ids=self.rerank_ids(query,tool_ids)
 
-        
         # Define the agent
-        tools=[{
-            'mcpServers': {
-                
-            }
-        }]
-
-        filter_service_name=[]
-        filter_port=[]
-
-
-        for sercice_des in end_summary_list:
-            if self.summary2other[sercice_des]['service_name'] not in filter_service_name:
-                filter_service_name.append(self.summary2other[sercice_des]['service_name'])
-                filter_port.append(self.summary2other[sercice_des]['port'])
-
-        
-
-        for i in range(len(filter_service_name[:3])):
-            service_find=filter_service_name[i]
-            port_find=filter_port[i]
-
-            
-            tools[0]['mcpServers'][service_find] = {
-                'url': f"http://localhost:{port_find}/sse"
-            }
+        tools=[self.registry.mcp_servers(self.registry.unique_services(end_tool_ids,limit=3))]
         
         bot = self.init_agent_service(tools,llm_set=llm_set,sys_mes=prompt)
         # Chat
@@ -0,0 +1,105 @@
+"""
+导入耗时测试: 在新的 Python 进程中用 -X importtime 导入各入口依赖的模块，统计累计导入耗时、
+自身耗时最多的模块，以及工具选择路径上不需要的重量级第三方库是否被导入
+
+用法: python benchmarks/import_time_bench.py [--repeat 5] [--top 10] [--output import_time.json] [模块 ...]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 默认测试的模块: agent 框架、检索、工具选择和各个入口
+TARGETS = (
+    'qwen_agent.agents.assistant',
+    'qwen_agent.tools',
+    'app.rag.model',
+    'app.rag.selector',
+    'app.sig_mcp.sigmcp',
+    'app.mul_mcp.mulmcp',
+)
+
+# 工具选择路径上用不到、应当延迟导入的库
+HEAVY_MODULES = (
+    'faiss', 'jieba', 'rank_bm25', 'tiktoken', 'requests', 'numpy', 'openai', 'dashscope',
+    'ipykernel', 'jupyter_client', 'pdfminer', 'pdfplumber', 'docx', 'pptx', 'pandas', 'bs4', 'PIL', 'mcp',
+)
+
+
+def import_once(module):
+    """
+    :return: (累计导入耗时秒, {模块: 自身耗时秒}, 导入后的 sys.modules)
+    """
+    code = f"import sys, json, {module}; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=PROJECT_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+
+    self_times = {}
+    cumulative = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        self_times[name] = self_times.get(name, 0) + int(self_us) / 1e6
+        if name == module:
+            cumulative = int(cumulative_us) / 1e6
+    return cumulative, self_times, json.loads(result.stdout.splitlines()[-1])
+
+
+def bench(module, repeat, top):
+    runs = [import_once(module) for _ in range(repeat)]
+    cumulative = statistics.median(run[0] for run in runs)
+    # 各模块取多次运行的中位数
+    self_times = {name: statistics.median(run[1].get(name, 0) for run in runs) for name in runs[0][1]}
+    loaded = runs[0][2]
+    packages = {}
+    for name, seconds in self_times.items():
+        root = name.split('.')[0]
+        packages[root] = packages.get(root, 0) + seconds
+    return {
+        'module': module,
+        'cumulative_ms': cumulative * 1000,
+        'num_modules': len(loaded),
+        'heavy_modules': [name for name in HEAVY_MODULES if name in loaded],
+        'top_packages': [(name, seconds * 1000) for name, seconds in
+                         sorted(packages.items(), key=lambda item: -item[1])[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=list(TARGETS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', default=None, help='结果另存为 JSON')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'模块':<28} {'导入耗时':>10} {'模块数':>6}  已导入的重量级库")
+    for module in args.modules:
+        result = bench(module, args.repeat, args.top)
+        results.append(result)
+        print(f"{module:<28} {result['cumulative_ms']:8.1f}ms {result['num_modules']:6d}  "
+              f"{', '.join(result['heavy_modules']) or '-'}")
+
+    for result in results:
+        print(f"\n{result['module']} 自身导入耗时最多的包:")
+        for name, ms in result['top_packages']:
+            print(f"  {ms:8.1f}ms  {name}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
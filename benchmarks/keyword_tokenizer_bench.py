@@ -0,0 +1,93 @@
+"""
+BM25 分词器吞吐测试: 在 HiMCPBench 的工具 summary/description 上对比逐条旧实现、KeywordTokenizer 逐条调用和批量调用
+
+用法: python benchmarks/keyword_tokenizer_bench.py [--rounds 20]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SIG_TEST_DIR
+from qwen_agent.tools.search_tools.keyword_search import (PUNCTUATIONS, SPECIAL_CASES_PATTERN, TOKEN_PATTERN,
+                                                          WORDS_TO_IGNORE, KeywordTokenizer)
+from qwen_agent.utils.utils import has_chinese_chars
+
+
+def legacy_split_text_into_keywords(text):
+    """
+    改造前的实现: 每个 token 编译一次正则，停用词为 list，每次调用新建 stemmer，逐字符判断标点，作为对照组
+    """
+    import snowballstemmer
+
+    text = text.lower().strip()
+    if has_chinese_chars(text):
+        import jieba
+        _wordlist = [word for word in jieba.lcut(text) if not all(char in PUNCTUATIONS for char in word)]
+    else:
+        _wordlist = []
+        for token in TOKEN_PATTERN.findall(text):
+            if not re.compile(SPECIAL_CASES_PATTERN.pattern).match(token):
+                token = token.strip(PUNCTUATIONS)
+            token = token.lower()
+            if token not in WORDS_TO_IGNORE and not all(char in PUNCTUATIONS for char in token):
+                _wordlist.append(token)
+    _wordlist = [word for word in _wordlist if word not in WORDS_TO_IGNORE]
+    stems = snowballstemmer.stemmer('english').stemWords(_wordlist)
+    return [word for word in stems if word not in WORDS_TO_IGNORE]
+
+
+def load_texts(path=SIG_TEST_DIR):
+    """
+    HiMCPBench 服务目录中每个工具的 summary 和 description
+    """
+    texts = []
+    for item in json.loads(open(path, encoding="utf-8").read()):
+        for endpoint in item.get('endpoints') or []:
+            texts.append(endpoint['summary'])
+            if endpoint.get('description'):
+                texts.append(endpoint['description'])
+    return texts
+
+
+def run(name, fn, texts, rounds):
+    """
+    重复 rounds 轮，返回结果并打印吞吐
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn(texts)
+    elapsed = time.perf_counter() - start
+    num_keywords = sum(len(words) for words in result) * rounds
+    print(f"{name:<12} {elapsed:8.3f}s  {len(texts) * rounds / elapsed:12.0f} 条/s  "
+          f"{num_keywords / elapsed:12.0f} 词/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    texts = load_texts()
+    print(f"文本数: {len(texts)}，轮数: {args.rounds}")
+
+    tokenizer = KeywordTokenizer()
+    legacy = run('legacy', lambda batch: [legacy_split_text_into_keywords(text) for text in batch], texts,
+                 args.rounds)
+    single = run('tokenize', lambda batch: [tokenizer.tokenize(text) for text in batch], texts, args.rounds)
+    batch = run('batch', tokenizer.tokenize_batch, texts, args.rounds)
+
+    if not (legacy == single == batch):
+        mismatch = next(i for i, (a, b) in enumerate(zip(legacy, batch)) if a != b)
+        print(f"分词结果不一致: {texts[mismatch]!r}\n  legacy: {legacy[mismatch]}\n  batch:  {batch[mismatch]}")
+        sys.exit(1)
+    print(f"分词结果一致，stem 缓存: {tokenizer.stem.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
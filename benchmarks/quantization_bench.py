@@ -0,0 +1,153 @@
+"""
+向量量化测试: 在 ToolBench 工具语料上对比 flat (float32)、fp16、int8 和 pq 索引的内存占用、检索耗时，
+以及相对 float32 精确检索的 recall@k、NDCG@k (量化索引直接检索和 float32 精排后)
+
+查询取 ToolBench 的 G1~G3 查询，没有查询文件时取部分工具的 tool 描述。语料和查询的向量缓存在 --cache 中，
+只有第一次运行需要向量化服务；--random 使用随机向量，不需要向量化服务
+
+用法: python benchmarks/quantization_bench.py [--k 10] [--rescore-factor 4] [--pq-m 128] [--random 1024]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TOOL_BENCH_DIR
+from app.rag.quantization import QUANTIZATIONS, build_index, rescore
+
+
+def load_texts(num_queries):
+    """
+    :return: (语料, 查询)，语料与 tool_bench_hi_rag.py 的 type_service_tool_index 相同
+    """
+    documents = json.loads(open(TOOL_BENCH_DIR, encoding="utf-8").read())
+    corpus = [f"type: {doc['type']} service: {doc['service']} tool: {doc['tool']}" for doc in documents]
+
+    queries = []
+    base_dir = os.path.dirname(TOOL_BENCH_DIR)
+    for i in range(1, 4):
+        path = os.path.join(base_dir, f'G{i}_query.json')
+        if os.path.exists(path):
+            queries.extend(query_i['query'] for query_i in json.loads(open(path, encoding="utf-8").read()))
+    if not queries:
+        rng = np.random.default_rng(0)
+        queries = [documents[i]['tool'] for i in rng.choice(len(documents), num_queries, replace=False)]
+    return corpus, queries[:num_queries]
+
+
+def encode(texts, batch_size=64):
+    from app.rag.embedding.remote_model import RemoteEmbedder
+
+    embedder = RemoteEmbedder()
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        embeddings.extend(embedder.encode(texts[i:i + batch_size]))
+        print(f"\r向量化 {min(i + batch_size, len(texts))}/{len(texts)}", end='', flush=True)
+    print()
+    return np.array(embeddings, dtype=np.float32)
+
+
+def load_embeddings(cache_path, num_queries):
+    """
+    语料和查询的向量，文本不变时直接读缓存
+    """
+    corpus, queries = load_texts(num_queries)
+    digest = hashlib.sha256(json.dumps([corpus, queries], ensure_ascii=False).encode('utf-8')).hexdigest()
+    if os.path.exists(cache_path):
+        cache = np.load(cache_path)
+        if str(cache['digest']) == digest:
+            return cache['corpus'], cache['queries']
+
+    corpus_embeddings, query_embeddings = encode(corpus), encode(queries)
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    np.savez(cache_path, corpus=corpus_embeddings, queries=query_embeddings, digest=digest)
+    return corpus_embeddings, query_embeddings
+
+
+def random_embeddings(dimension, num_corpus=10657, num_queries=1000, num_clusters=200):
+    """
+    聚成簇的随机单位向量，近似文本向量的分布
+    """
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((num_clusters, dimension)).astype(np.float32)
+
+    def sample(num):
+        x = centers[rng.integers(num_clusters, size=num)] + 0.6 * rng.standard_normal((num, dimension))
+        return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+    return sample(num_corpus), sample(num_queries)
+
+
+def ndcg(pred, exact, k):
+    """
+    以精确检索的排名作为分级相关性: 第 r 名的相关性为 k - r
+    """
+    gains = {doc: k - rank for rank, doc in enumerate(exact[:k])}
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    dcg = sum(gains.get(doc, 0) * discounts[rank] for rank, doc in enumerate(pred[:k]))
+    idcg = sum((k - rank) * discounts[rank] for rank in range(k))
+    return dcg / idcg
+
+
+def evaluate(ids, exact, k):
+    recall = np.mean([len(set(row[:k]) & set(truth[:k])) / k for row, truth in zip(ids, exact)])
+    return recall, np.mean([ndcg(row, truth, k) for row, truth in zip(ids, exact)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rescore-factor', type=int, default=4)
+    parser.add_argument('--pq-m', type=int, default=128)
+    parser.add_argument('--num-queries', type=int, default=1000)
+    parser.add_argument('--cache', default=os.path.join(os.path.dirname(TOOL_BENCH_DIR), 'embeddings_cache.npz'))
+    parser.add_argument('--random', type=int, default=0, metavar='DIM', help='使用 DIM 维的随机向量')
+    args = parser.parse_args()
+
+    if args.random:
+        corpus, queries = random_embeddings(args.random, num_queries=args.num_queries)
+    else:
+        corpus, queries = load_embeddings(args.cache, args.num_queries)
+    print(f"语料: {corpus.shape[0]} 条，查询: {queries.shape[0]} 条，维度: {corpus.shape[1]}，"
+          f"k={args.k}，精排候选: {args.k * args.rescore_factor}")
+
+    flat_bytes = None
+    exact = None
+    print(f"{'方式':<6} {'索引大小':>10} {'压缩':>6} {'构建':>8} {'检索':>10} "
+          f"{'recall@k':>9} {'NDCG@k':>8} {'精排 recall':>11} {'精排 NDCG':>9} {'精排检索':>10}")
+    for quantization in QUANTIZATIONS:
+        start = time.perf_counter()
+        index = build_index(corpus, quantization, pq_m=args.pq_m)
+        build_seconds = time.perf_counter() - start
+        num_bytes = len(faiss.serialize_index(index))
+        flat_bytes = flat_bytes or num_bytes
+
+        start = time.perf_counter()
+        _, I = index.search(queries, args.k)
+        search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        ids = I.tolist()
+        if exact is None:
+            exact = ids
+        recall, ndcg_k = evaluate(ids, exact, args.k)
+
+        line = (f"{quantization:<6} {num_bytes / 2 ** 20:8.1f}MB {flat_bytes / num_bytes:5.1f}x "
+                f"{build_seconds:7.2f}s {search_ms:8.3f}ms {recall:9.4f} {ndcg_k:8.4f}")
+        if quantization != 'flat':
+            start = time.perf_counter()
+            _, candidates = index.search(queries, args.k * args.rescore_factor)
+            _, I = rescore(corpus, queries, candidates, args.k)
+            rescore_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall, ndcg_k = evaluate(I.tolist(), exact, args.k)
+            line += f" {recall:11.4f} {ndcg_k:9.4f} {rescore_ms:8.3f}ms"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,8 @@ FAISS_PATH = os.path.join(DATA_DIR, 'faiss_save','data.index')
 SIG_TEST_DIR=os.path.join(DATA_DIR, 'query_test','sig_mcp_test.json')
 MUL_TEST_DIR=os.path.join(DATA_DIR, 'query_test','mul_mcp_test.json')
 TOOL_BENCH_DIR=os.path.join(DATA_DIR, 'tool_bench','tool_bench_summary.json')
+# 服务目录: 每个服务的 run.py 路径、端口和传输方式
+SERVICE_CATALOG=SIG_TEST_DIR
 
 os.makedirs(os.path.join(DATA_DIR, 'faiss_save'), exist_ok=True)
 
@@ -51,19 +53,59 @@ class LLMConfig():
 
 class RemoteConfig(object):
 
+    # max_wait_ms: 并发请求在后台合并的最长等待时间，0 表示不合并；max_batch: 一次请求最多的文本数；
+    # max_inflight: 合并后同时发出的最大请求数
     embedding_config={
         'model_name':'bge',
-        'model_url':'http://172.20.98.51:8081/v1/embeddings'
+        'model_url':'http://172.20.98.51:8081/v1/embeddings',
+        'max_wait_ms':5,
+        'max_batch':64,
+        'max_inflight':4
     }
 
+    # max_pairs: 一次请求最多的 (query, doc) 对数；score_url: 可选的成对打分接口 (如 vLLM 的 /score)，
+    # 配置后不同 query 的请求也合并成一次，否则一批中不同 query 的请求最多 max_concurrency 个并发发出
+    # max_inflight: 合并后同时处理的最大批数；cache_path: 重排分数的持久化缓存，为空时不缓存；cache_max_entries: 缓存的最大条数，超过后按最近访问时间淘汰
     rerank_config={
         'model_name':'rerank_base',
-        'model_url':"http://172.20.98.51:8084/rerank"
+        'model_url':"http://172.20.98.51:8084/rerank",
+        'max_wait_ms':5,
+        'max_pairs':256,
+        'max_concurrency':8,
+        'max_inflight':4,
+        'score_url':'',
+        'cache_path':os.path.join(DATA_DIR, 'rerank_cache','scores.sqlite3'),
+        'cache_max_entries':1000000
     }
 
     
 
 SEARCH_TOPK=20
 RESULT_TOPK=20
+# 向量索引的存储方式: flat (float32)、fp16、int8 (标量量化) 或 pq (乘积量化)。量化后索引占用的内存减少 2~32 倍，
+# float32 向量以内存映射方式保存在索引旁，对量化索引返回的 SEARCH_TOPK*VECTOR_RESCORE_FACTOR 个候选精确重排
+VECTOR_QUANTIZATION='flat'
+VECTOR_PQ_M=128
+VECTOR_RESCORE_FACTOR=4
+# 增量索引 (app/rag/incremental.py) 的检查点和预写日志目录。标记删除和新增的向量超过基础索引的
+# INDEX_REBUILD_RATIO 倍 (且多于 INDEX_REBUILD_MIN 个) 时在后台重建基础索引并写入检查点
+INDEX_SNAPSHOT_DIR=os.path.join(DATA_DIR, 'index_snapshot')
+INDEX_REBUILD_RATIO=0.1
+INDEX_REBUILD_MIN=64
+
+# Hi-RAG 检索服务 (hirag_server.py)，启动参数通过环境变量传给各个 worker
+HIRAG_HOST=os.getenv('HIRAG_HOST', '127.0.0.1')
+HIRAG_PORT=int(os.getenv('HIRAG_PORT', 8900))
+HIRAG_URL=os.getenv('HIRAG_URL', f"http://{HIRAG_HOST}:{HIRAG_PORT}")
+# 合并并发请求: 最多等待的毫秒数、一批的最大查询数、同时处理的批数
+HIRAG_MAX_WAIT_MS=float(os.getenv('HIRAG_MAX_WAIT_MS', 5))
+HIRAG_MAX_BATCH=int(os.getenv('HIRAG_MAX_BATCH', 32))
+HIRAG_MAX_INFLIGHT=int(os.getenv('HIRAG_MAX_INFLIGHT', 4))
+# show.py 的检索路由模式: 每轮对话只把 Hi-RAG 选出的前 SHOW_TOP_SERVICES 个服务的工具交给 Agent
+SHOW_TOP_SERVICES=int(os.getenv('SHOW_TOP_SERVICES', 3))
+# 入口脚本的 --profile 模式 (app/profiling.py): 报告输出目录、栈采样间隔 (毫秒)、热点函数和内存分配热点的条数
+PROFILE_DIR=os.path.join(DATA_DIR, 'profile')
+PROFILE_INTERVAL_MS=5
+PROFILE_TOP_N=30
 prompt_zh='请判断所提供的工具是否可以用来解决用户的问题。如果可以，请选择合适的函数进行调用，无需过度思考。如果不可以，请直接回答用户的问题，无需进行过度思考。'
 prompt_en="Please determine whether the provided tools can be used to solve the user's problem. If they can, please select the appropriate function to call without overthinking. If they cannot, please directly answer the user's question without overthinking."
\ No newline at end of file
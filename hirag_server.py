@@ -0,0 +1,75 @@
+import os
+import argparse
+
+import uvicorn
+
+from config import HIRAG_HOST, HIRAG_PORT, HIRAG_MAX_BATCH, HIRAG_MAX_WAIT_MS, HIRAG_MAX_INFLIGHT
+
+
+def prepare_index():
+    """
+    在启动 worker 之前准备好 FAISS 索引: 语料变化时只在这里向量化一次，各 worker 启动时直接加载
+    """
+    from app.rag.selector import ToolSelector
+    selector = ToolSelector()
+    print(f"索引已就绪: {selector.registry.num_tools} 个工具", flush=True)
+
+
+def main():
+    """
+    用法: python hirag_server.py [--host 127.0.0.1] [--port 8900] [--workers 1] [--max-batch 32] [--max-wait-ms 5]
+                                [--incremental]
+
+    接口:
+      POST /select_tools        {"query": "...", "top_services": 3}
+      POST /select_tools:batch  {"queries": ["...", "..."], "top_services": 3}
+      GET  /metrics
+
+    --incremental 时服务目录可以在线更新 (只支持单个 worker):
+      PUT    /services/{name}        {"path": "...", "port": 50122, "endpoints": [{"path", "method", "summary"}]}
+      DELETE /services/{name}
+      POST   /services/{name}/tools  {"endpoints": [...]}
+      PUT    /tools/{id}             {"path", "method", "summary"}
+      DELETE /tools/{id}
+      POST   /index:compact
+    """
+    parser = argparse.ArgumentParser(description="Hi-RAG 检索服务")
+    parser.add_argument('--host', default=HIRAG_HOST)
+    parser.add_argument('--port', type=int, default=HIRAG_PORT)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-batch', type=int, default=HIRAG_MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type=float, default=HIRAG_MAX_WAIT_MS)
+    parser.add_argument('--max-inflight', type=int, default=HIRAG_MAX_INFLIGHT)
+    parser.add_argument('--incremental', action='store_true', help='使用增量索引，服务目录可以在线更新')
+    args = parser.parse_args()
+
+    if args.incremental:
+        if args.workers > 1:
+            parser.error('--incremental 只支持单个 worker: 各 worker 的索引相互独立，会重复写预写日志')
+        from app.rag.server import create_app
+        from app.rag.selector import ToolSelector
+        from app.rag.incremental import IncrementalIndex
+        print(f"Hi-RAG 检索服务 (增量索引): http://{args.host}:{args.port}", flush=True)
+        app = create_app(lambda: ToolSelector(index=IncrementalIndex.open()), max_batch=args.max_batch,
+                         max_wait_ms=args.max_wait_ms, max_inflight=args.max_inflight)
+        uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+        return
+
+    prepare_index()
+    print(f"Hi-RAG 检索服务: http://{args.host}:{args.port} (workers: {args.workers})", flush=True)
+    if args.workers <= 1:
+        from app.rag.server import create_app
+        app = create_app(max_batch=args.max_batch, max_wait_ms=args.max_wait_ms, max_inflight=args.max_inflight)
+        uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+        return
+
+    # 多 worker 时每个 worker 进程重新导入 config，参数通过环境变量传递；索引已在上面准备好，worker 只需加载
+    os.environ['HIRAG_MAX_BATCH'] = str(args.max_batch)
+    os.environ['HIRAG_MAX_WAIT_MS'] = str(args.max_wait_ms)
+    os.environ['HIRAG_MAX_INFLIGHT'] = str(args.max_inflight)
+    uvicorn.run('app.rag.server:create_app', factory=True, host=args.host, port=args.port,
+                workers=args.workers, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
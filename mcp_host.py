@@ -0,0 +1,95 @@
+import os
+import sys
+import signal
+import asyncio
+import contextlib
+import importlib.util
+
+import uvicorn
+
+from app.service_registry import load_service_catalog
+
+# 与 run.py 中 mcp.run(transport='sse', port=...) 的默认监听地址一致
+HOST = '127.0.0.1'
+
+
+class HostedServer(uvicorn.Server):
+    """
+    同一个事件循环中运行多个 uvicorn 服务时，信号由 host 统一处理，避免互相覆盖
+    """
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+    def install_signal_handlers(self):
+        pass
+
+
+def load_service_mcp(service):
+    """
+    导入服务的 run.py（不会执行 __main__ 分支），返回其中的 FastMCP 对象
+    :param service: 服务目录中的一项 {'name', 'path', 'port', 'transport'}
+    """
+    module_name = f"mcp_service_{service['name']}"
+    spec = importlib.util.spec_from_file_location(module_name, service['path'])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module.mcp
+
+
+async def _serve_one(service_name, server):
+    try:
+        await server.serve()
+    except SystemExit:
+        # uvicorn 在端口被占用等启动失败时会 sys.exit，只影响这一个服务
+        print(f"  ✗ {service_name} 启动失败 (Port: {server.config.port})", flush=True)
+
+
+async def serve_services(services):
+    """
+    在一个进程、一个事件循环中承载多个 MCP 服务，每个服务仍监听自己的端口，
+    路由和 SSE 会话互不共享
+    """
+    servers = {}
+    for service in services:
+        try:
+            mcp = load_service_mcp(service)
+            app = mcp.http_app(transport=service.get('transport', 'sse'))
+        except Exception as e:
+            # 单个服务导入失败不影响同进程的其他服务
+            print(f"  ✗ 加载失败: {service['name']} - {e}", flush=True)
+            continue
+        config = uvicorn.Config(app, host=HOST, port=service['port'], log_level='warning', lifespan='on')
+        servers[service['name']] = HostedServer(config)
+        print(f"  ✓ 加载服务: {service['name']} (Port: {service['port']})", flush=True)
+
+    def _shutdown():
+        for server in servers.values():
+            server.should_exit = True
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, _shutdown)
+
+    await asyncio.gather(*[_serve_one(name, server) for name, server in servers.items()])
+
+
+def main():
+    """
+    用法: python mcp_host.py [service_name ...]，不指定服务名时承载服务目录中的全部服务
+    """
+    catalog = load_service_catalog()
+    names = sys.argv[1:] or list(catalog)
+    unknown = [name for name in names if name not in catalog]
+    if unknown:
+        print(f"未知的服务: {unknown}")
+        sys.exit(1)
+
+    print(f"MCP host (PID: {os.getpid()}) 承载 {len(names)} 个服务", flush=True)
+    asyncio.run(serve_services([catalog[name] for name in names]))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,8 +13,13 @@
 # limitations under the License.
 
 __version__ = '0.0.27'
-from .agent import Agent
-from .multi_agent_hub import MultiAgentHub
+from .utils.lazy_import import lazy_attrs
+
+# Importing a submodule such as `qwen_agent.utils.rank_fusion` should not pull in the agent framework
+__getattr__ = lazy_attrs(__name__, {
+    'Agent': ('.agent', 'Agent'),
+    'MultiAgentHub': ('.multi_agent_hub', 'MultiAgentHub'),
+})
 
 __all__ = [
     'Agent',
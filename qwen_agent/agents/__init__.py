@@ -12,28 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from qwen_agent.agent import Agent, BasicAgent
-from qwen_agent.multi_agent_hub import MultiAgentHub
+from qwen_agent.utils.lazy_import import lazy_attrs
 
-from .article_agent import ArticleAgent
-from .assistant import Assistant
-from .dialogue_retrieval_agent import DialogueRetrievalAgent
-from .dialogue_simulator import DialogueSimulator
-# DocQAAgent is the default solution for long document question answering.
-# The actual implementation of DocQAAgent may change with every release.
-from .doc_qa import BasicDocQA as DocQAAgent
-from .doc_qa import ParallelDocQA
-from .fncall_agent import FnCallAgent
-from .group_chat import GroupChat
-from .group_chat_auto_router import GroupChatAutoRouter
-from .group_chat_creator import GroupChatCreator
-from .human_simulator import HumanSimulator
-from .react_chat import ReActChat
-from .router import Router
-from .tir_agent import TIRMathAgent
-from .user_agent import UserAgent
-from .virtual_memory_agent import VirtualMemoryAgent
-from .write_from_scratch import WriteFromScratch
+# Agent classes are imported on first access, so using one agent does not import the dependencies of all others
+__getattr__ = lazy_attrs(__name__, {
+    'Agent': ('qwen_agent.agent', 'Agent'),
+    'BasicAgent': ('qwen_agent.agent', 'BasicAgent'),
+    'MultiAgentHub': ('qwen_agent.multi_agent_hub', 'MultiAgentHub'),
+    'ArticleAgent': ('.article_agent', 'ArticleAgent'),
+    'Assistant': ('.assistant', 'Assistant'),
+    'DialogueRetrievalAgent': ('.dialogue_retrieval_agent', 'DialogueRetrievalAgent'),
+    'DialogueSimulator': ('.dialogue_simulator', 'DialogueSimulator'),
+    # DocQAAgent is the default solution for long document question answering.
+    # The actual implementation of DocQAAgent may change with every release.
+    'DocQAAgent': ('.doc_qa', 'BasicDocQA'),
+    'ParallelDocQA': ('.doc_qa', 'ParallelDocQA'),
+    'FnCallAgent': ('.fncall_agent', 'FnCallAgent'),
+    'GroupChat': ('.group_chat', 'GroupChat'),
+    'GroupChatAutoRouter': ('.group_chat_auto_router', 'GroupChatAutoRouter'),
+    'GroupChatCreator': ('.group_chat_creator', 'GroupChatCreator'),
+    'HumanSimulator': ('.human_simulator', 'HumanSimulator'),
+    'ReActChat': ('.react_chat', 'ReActChat'),
+    'Router': ('.router', 'Router'),
+    'TIRMathAgent': ('.tir_agent', 'TIRMathAgent'),
+    'UserAgent': ('.user_agent', 'UserAgent'),
+    'VirtualMemoryAgent': ('.virtual_memory_agent', 'VirtualMemoryAgent'),
+    'WriteFromScratch': ('.write_from_scratch', 'WriteFromScratch'),
+})
 
 __all__ = [
     'Agent',
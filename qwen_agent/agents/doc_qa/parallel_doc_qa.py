@@ -27,10 +27,11 @@ from qwen_agent.agents.keygen_strategies import GenKeyword
 from qwen_agent.llm.base import BaseChatModel, ModelServiceError
 from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, USER, Message
 from qwen_agent.log import logger
+from qwen_agent.settings import PARALLEL_DOC_QA_MAX_WORKERS, PARALLEL_DOC_QA_RATE_LIMIT
 from qwen_agent.tools import BaseTool
 from qwen_agent.tools.doc_parser import DocParser
 from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
-from qwen_agent.utils.parallel_executor import parallel_exec
+from qwen_agent.utils.parallel_executor import parallel_exec_ordered
 from qwen_agent.utils.tokenization_qwen import count_tokens
 from qwen_agent.utils.utils import (extract_files_from_messages, extract_text_from_message, get_file_type,
                                     print_traceback)
@@ -53,7 +54,14 @@ class ParallelDocQA(Assistant):
                  system_message: Optional[str] = DEFAULT_SYSTEM_MESSAGE,
                  name: Optional[str] = DEFAULT_NAME,
                  description: Optional[str] = DEFAULT_DESC,
-                 files: Optional[List[str]] = None):
+                 files: Optional[List[str]] = None,
+                 max_workers: int = PARALLEL_DOC_QA_MAX_WORKERS,
+                 rate_limit: float = PARALLEL_DOC_QA_RATE_LIMIT):
+        """
+        Args:
+            max_workers: The max number of chunks answered at the same time, set it to the concurrency of the LLM server.
+            rate_limit: The max number of member requests started per second, 0 for no limit.
+        """
 
         function_list = function_list or []
         super().__init__(
@@ -72,6 +80,10 @@ class ParallelDocQA(Assistant):
 
         self.doc_parse = DocParser()
         self.summary_agent = ParallelDocQASummary(llm=self.llm)
+        # The member is stateless, so one instance serves all chunks
+        self.member_agent = ParallelDocQAMember(llm=self.llm)
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
 
     def _get_files(self, messages: List[Message]):
         session_files = extract_files_from_messages(messages, include_images=False)
@@ -213,37 +225,32 @@ class ParallelDocQA(Assistant):
                 idx += 1
         logger.info('Parallel Member Num: ' + str(len(data)))
 
-        # Retry for None in 7b model
-        retry_cnt = MAX_NO_RESPONSE_RETRY
-        member_res = ''
-        while retry_cnt > 0:
+        # Retry only the chunks that failed or got an empty response (e.g. None in 7b model)
+        answers = {}
+        pending = list(range(len(data)))
+        for _ in range(MAX_NO_RESPONSE_RETRY):
             time1 = time.time()
-            results = parallel_exec(self._ask_member_agent, data, jitter=0.5)
-            # results = serial_exec(self._qa, data)
+            failed = []
+            for pos, text, ex in parallel_exec_ordered(self._ask_member_agent, [data[i] for i in pending],
+                                                       max_workers=self.max_workers,
+                                                       rate_limit=self.rate_limit):
+                index = pending[pos]
+                if ex is not None:
+                    logger.warning(f'Member {index} failed: {ex}')
+                    failed.append(index)
+                elif not text or not text.strip():
+                    failed.append(index)
+                else:
+                    answer = self._filter_member_response(text)
+                    if answer:
+                        answers[index] = answer
             time2 = time.time()
-            logger.info(f'Finished parallel_exec. Time spent: {time2 - time1} seconds.')
-            ordered_results = sorted(results, key=lambda x: x[0])
-            filtered_results = []
-
-            for index, text in ordered_results:
-                parser_success, parser_json_content = self._parser_json(text)
-                if parser_success and ('res' in parser_json_content) and ('content' in parser_json_content):
-                    pa_res, pa_cotent = parser_json_content['res'], parser_json_content['content']
-                    if (pa_res in ['ans', 'none']) and (isinstance(pa_cotent, str)):
-                        if pa_res == 'ans':
-                            filtered_results.append((index, pa_cotent.strip()))
-                            continue
-                        elif pa_res == 'none':
-                            continue
-                if self._is_none_response(text):
-                    continue
-                clean_output = self._extract_text_from_output(text)
-                filtered_results.append((index, clean_output.strip()))
-
-            if filtered_results:
-                member_res = '\n\n'.join(text for index, text in filtered_results)
+            logger.info(f'Finished {len(pending)} members ({len(failed)} failed). Time spent: {time2 - time1} seconds.')
+            if not failed:
                 break
-            retry_cnt -= 1
+            pending = failed
+
+        member_res = '\n\n'.join(answers[index] for index in sorted(answers))
 
         retrieve_content = self._retrieve_according_to_member_responses(messages=messages,
                                                                         lang=lang,
@@ -251,12 +258,26 @@ class ParallelDocQA(Assistant):
                                                                         member_res=member_res)
         return self.summary_agent.run(messages=messages, lang=lang, knowledge=retrieve_content)
 
+    def _filter_member_response(self, text: str) -> str:
+        """Extract the answer of a member, or return '' when the member has no answer."""
+        parser_success, parser_json_content = self._parser_json(text)
+        if parser_success and ('res' in parser_json_content) and ('content' in parser_json_content):
+            pa_res, pa_cotent = parser_json_content['res'], parser_json_content['content']
+            if (pa_res in ['ans', 'none']) and (isinstance(pa_cotent, str)):
+                if pa_res == 'ans':
+                    return pa_cotent.strip()
+                elif pa_res == 'none':
+                    return ''
+        if self._is_none_response(text):
+            return ''
+        clean_output = self._extract_text_from_output(text)
+        return clean_output.strip()
+
     def _ask_member_agent(self,
                           index: int,
                           messages: List[Message],
                           lang: str = 'en',
                           knowledge: str = '',
-                          instruction: str = '') -> tuple:
-        doc_qa = ParallelDocQAMember(llm=self.llm)
-        *_, last = doc_qa.run(messages=messages, knowledge=knowledge, lang=lang, instruction=instruction)
-        return index, last[-1].content
+                          instruction: str = '') -> str:
+        *_, last = self.member_agent.run(messages=messages, knowledge=knowledge, lang=lang, instruction=instruction)
+        return last[-1].content
@@ -15,16 +15,23 @@
 import copy
 from typing import Union
 
-from .azure import TextChatAtAzure
+from qwen_agent.utils.lazy_import import lazy_attrs
+
 from .base import LLM_REGISTRY, BaseChatModel, ModelServiceError
-from .oai import TextChatAtOAI
-from .openvino import OpenVINO
-from .transformers_llm import Transformers
-from .qwen_dashscope import QwenChatAtDS
-from .qwenaudio_dashscope import QwenAudioChatAtDS
-from .qwenomni_oai import QwenOmniChatAtOAI
-from .qwenvl_dashscope import QwenVLChatAtDS
-from .qwenvl_oai import QwenVLChatAtOAI
+
+# Model classes (and their SDKs, e.g. openai, dashscope) are imported on first access. get_chat_model looks
+# them up through LLM_REGISTRY, which imports the module registering a model_type on first lookup.
+__getattr__ = lazy_attrs(__name__, {
+    'TextChatAtAzure': ('.azure', 'TextChatAtAzure'),
+    'TextChatAtOAI': ('.oai', 'TextChatAtOAI'),
+    'OpenVINO': ('.openvino', 'OpenVINO'),
+    'Transformers': ('.transformers_llm', 'Transformers'),
+    'QwenChatAtDS': ('.qwen_dashscope', 'QwenChatAtDS'),
+    'QwenAudioChatAtDS': ('.qwenaudio_dashscope', 'QwenAudioChatAtDS'),
+    'QwenOmniChatAtOAI': ('.qwenomni_oai', 'QwenOmniChatAtOAI'),
+    'QwenVLChatAtDS': ('.qwenvl_dashscope', 'QwenVLChatAtDS'),
+    'QwenVLChatAtOAI': ('.qwenvl_oai', 'QwenVLChatAtOAI'),
+})
 
 
 def get_chat_model(cfg: Union[dict, str] = 'qwen-plus') -> BaseChatModel:
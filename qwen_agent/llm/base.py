@@ -24,11 +24,25 @@ from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, Union
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, FUNCTION, SYSTEM, USER, Message
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_MAX_INPUT_TOKENS
+from qwen_agent.utils.lazy_import import LazyRegistry
 from qwen_agent.utils.tokenization_qwen import tokenizer
 from qwen_agent.utils.utils import (extract_text_from_message, format_as_multimodal_message, format_as_text_message,
                                     has_chinese_messages, json_dumps_compact, merge_generate_cfgs, print_traceback)
 
-LLM_REGISTRY = {}
+# Built-in model types and the modules that register them, imported the first time the model type is looked up
+BUILTIN_LLMS = {
+    'azure': 'qwen_agent.llm.azure',
+    'oai': 'qwen_agent.llm.oai',
+    'openvino': 'qwen_agent.llm.openvino',
+    'transformers': 'qwen_agent.llm.transformers_llm',
+    'qwen_dashscope': 'qwen_agent.llm.qwen_dashscope',
+    'qwenaudio_dashscope': 'qwen_agent.llm.qwenaudio_dashscope',
+    'qwenomni_oai': 'qwen_agent.llm.qwenomni_oai',
+    'qwenvl_dashscope': 'qwen_agent.llm.qwenvl_dashscope',
+    'qwenvl_oai': 'qwen_agent.llm.qwenvl_oai',
+}
+
+LLM_REGISTRY = LazyRegistry(BUILTIN_LLMS)
 
 
 def register_llm(model_type):
@@ -505,9 +519,9 @@ def _postprocess_stop_words(messages: List[Message], stop: List[str]) -> List[Me
     # The following post-processing step removes partial stop words.
     partial_stop = []
     for s in stop:
-        s = tokenizer.tokenize(s)[:-1]
+        s = tokenizer.encode(s)[:-1]
         if s:
-            s = tokenizer.convert_tokens_to_string(s)
+            s = tokenizer.decode_ids(s)
             partial_stop.append(s)
     partial_stop = sorted(set(partial_stop))
     last_msg = messages[-1].content
@@ -52,6 +52,8 @@ class Memory(Agent):
                 'rag_searchers': ['keyword_search', 'front_page_search']
               }
               And the above is the default settings.
+              When 'vector_search' is used, 'embedder' selects the embedding model, e.g.
+              {'model_type': 'openai', 'model': 'bge-m3', 'model_server': 'http://localhost:8000/v1'}.
         """
         self.cfg = rag_cfg or {}
         self.max_ref_token: int = self.cfg.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
@@ -62,13 +64,17 @@ class Memory(Agent):
             # There is no suitable model available for keygen
             self.rag_keygen_strategy = 'none'
 
-        function_list = function_list or []
-        super().__init__(function_list=[{
+        retrieval_cfg = {
             'name': 'retrieval',
             'max_ref_token': self.max_ref_token,
             'parser_page_size': self.parser_page_size,
             'rag_searchers': self.rag_searchers,
-        }, {
+        }
+        if 'embedder' in self.cfg:
+            retrieval_cfg['embedder'] = self.cfg['embedder']
+
+        function_list = function_list or []
+        super().__init__(function_list=[retrieval_cfg, {
             'name': 'doc_parser',
             'max_ref_token': self.max_ref_token,
             'parser_page_size': self.parser_page_size,
@@ -25,6 +25,12 @@ MAX_LLM_CALL_PER_RUN: int = int(os.getenv('QWEN_AGENT_MAX_LLM_CALL_PER_RUN', 20)
 
 # Settings for tools
 DEFAULT_WORKSPACE: str = os.getenv('QWEN_AGENT_DEFAULT_WORKSPACE', 'workspace')
+DEFAULT_WORKSPACE_MAX_SIZE: int = int(os.getenv(
+    'QWEN_AGENT_DEFAULT_WORKSPACE_MAX_SIZE',
+    2 * 1024**3))  # Bytes of tool caches kept in the workspace before evicting the oldest, 0 to disable
+DEFAULT_STORAGE_BACKEND: str = os.getenv(
+    'QWEN_AGENT_DEFAULT_STORAGE_BACKEND',
+    'sqlite')  # 'sqlite' for one WAL-mode database per storage root, 'file' for one file per key
 
 # Settings for RAG
 DEFAULT_MAX_REF_TOKEN: int = int(os.getenv('QWEN_AGENT_DEFAULT_MAX_REF_TOKEN',
@@ -37,3 +43,22 @@ DEFAULT_RAG_KEYGEN_STRATEGY: Literal['None', 'GenKeyword', 'SplitQueryThenGenKey
 DEFAULT_RAG_SEARCHERS: List[str] = ast.literal_eval(
     os.getenv('QWEN_AGENT_DEFAULT_RAG_SEARCHERS',
               "['keyword_search', 'front_page_search']"))  # Sub-searchers for hybrid retrieval
+PARALLEL_DOC_QA_MAX_WORKERS: int = int(os.getenv('QWEN_AGENT_PARALLEL_DOC_QA_MAX_WORKERS',
+                                                 16))  # Max chunks being answered at the same time in ParallelDocQA
+PARALLEL_DOC_QA_RATE_LIMIT: float = float(os.getenv('QWEN_AGENT_PARALLEL_DOC_QA_RATE_LIMIT',
+                                                    0))  # Max LLM requests started per second in ParallelDocQA, 0 for no limit
+DEFAULT_PDF_PARSER_WORKERS: int = int(os.getenv(
+    'QWEN_AGENT_DEFAULT_PDF_PARSER_WORKERS',
+    0))  # Processes for parsing the pages of long pdfs, 0 for the number of cpus and 1 to parse in the current process
+DEFAULT_PDF_MAX_PAGES: int = int(os.getenv('QWEN_AGENT_DEFAULT_PDF_MAX_PAGES',
+                                           0))  # Only parse the first pages of a pdf, 0 for no limit
+
+# Settings for MCP
+MCP_MAX_CONCURRENT_CONNECTIONS: int = int(os.getenv('QWEN_AGENT_MCP_MAX_CONCURRENT_CONNECTIONS',
+                                                    16))  # Max MCP servers handshaking at the same time
+MCP_CONNECT_TIMEOUT: float = float(os.getenv('QWEN_AGENT_MCP_CONNECT_TIMEOUT',
+                                             30))  # Seconds allowed for connecting to a single MCP server
+MCP_PING_IDLE_THRESHOLD: float = float(os.getenv('QWEN_AGENT_MCP_PING_IDLE_THRESHOLD',
+                                                 60))  # Only sessions idle for longer than this are pinged
+MCP_HEARTBEAT_INTERVAL: float = float(os.getenv('QWEN_AGENT_MCP_HEARTBEAT_INTERVAL',
+                                                30))  # Seconds between background liveness checks, 0 to disable
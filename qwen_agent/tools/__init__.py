@@ -12,20 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .amap_weather import AmapWeather
 from .base import TOOL_REGISTRY, BaseTool
-from .code_interpreter import CodeInterpreter
-from .doc_parser import DocParser
-from .extract_doc_vocabulary import ExtractDocVocabulary
-from .image_gen import ImageGen
-from .python_executor import PythonExecutor
-from .retrieval import Retrieval
-from .search_tools import FrontPageSearch, HybridSearch, KeywordSearch, VectorSearch
-from .simple_doc_parser import SimpleDocParser
-from .storage import Storage
-from .web_extractor import WebExtractor
-from .mcp_manager import MCPManager
-from .web_search import WebSearch
+from qwen_agent.utils.lazy_import import lazy_attrs
+
+# Tool classes are imported on first access. Built-in tools referenced by name are resolved through
+# TOOL_REGISTRY, which imports the registering module on first lookup (see `base.BUILTIN_TOOLS`).
+__getattr__ = lazy_attrs(__name__, {
+    'AmapWeather': ('.amap_weather', 'AmapWeather'),
+    'CodeInterpreter': ('.code_interpreter', 'CodeInterpreter'),
+    'DocParser': ('.doc_parser', 'DocParser'),
+    'ExtractDocVocabulary': ('.extract_doc_vocabulary', 'ExtractDocVocabulary'),
+    'ImageGen': ('.image_gen', 'ImageGen'),
+    'PythonExecutor': ('.python_executor', 'PythonExecutor'),
+    'Retrieval': ('.retrieval', 'Retrieval'),
+    'FrontPageSearch': ('.search_tools', 'FrontPageSearch'),
+    'HybridSearch': ('.search_tools', 'HybridSearch'),
+    'KeywordSearch': ('.search_tools', 'KeywordSearch'),
+    'VectorSearch': ('.search_tools', 'VectorSearch'),
+    'SimpleDocParser': ('.simple_doc_parser', 'SimpleDocParser'),
+    'Storage': ('.storage', 'Storage'),
+    'WebExtractor': ('.web_extractor', 'WebExtractor'),
+    'MCPManager': ('.mcp_manager', 'MCPManager'),
+    'WebSearch': ('.web_search', 'WebSearch'),
+})
 
 __all__ = [
     'BaseTool',
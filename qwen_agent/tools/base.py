@@ -19,9 +19,28 @@ from typing import Dict, List, Optional, Union
 
 from qwen_agent.llm.schema import ContentItem
 from qwen_agent.settings import DEFAULT_WORKSPACE
+from qwen_agent.utils.lazy_import import LazyRegistry
 from qwen_agent.utils.utils import has_chinese_chars, json_loads, logger, print_traceback, save_url_to_local_work_dir
 
-TOOL_REGISTRY = {}
+# Built-in tools and the modules that register them, imported the first time the tool name is looked up
+BUILTIN_TOOLS = {
+    'amap_weather': 'qwen_agent.tools.amap_weather',
+    'code_interpreter': 'qwen_agent.tools.code_interpreter',
+    'doc_parser': 'qwen_agent.tools.doc_parser',
+    'extract_doc_vocabulary': 'qwen_agent.tools.extract_doc_vocabulary',
+    'image_gen': 'qwen_agent.tools.image_gen',
+    'retrieval': 'qwen_agent.tools.retrieval',
+    'front_page_search': 'qwen_agent.tools.search_tools.front_page_search',
+    'hybrid_search': 'qwen_agent.tools.search_tools.hybrid_search',
+    'keyword_search': 'qwen_agent.tools.search_tools.keyword_search',
+    'vector_search': 'qwen_agent.tools.search_tools.vector_search',
+    'simple_doc_parser': 'qwen_agent.tools.simple_doc_parser',
+    'storage': 'qwen_agent.tools.storage',
+    'web_extractor': 'qwen_agent.tools.web_extractor',
+    'web_search': 'qwen_agent.tools.web_search',
+}
+
+TOOL_REGISTRY = LazyRegistry(BUILTIN_TOOLS)
 
 
 class ToolServiceError(Exception):
@@ -12,21 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import os
 import re
 import time
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 from pydantic import BaseModel
 
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_WORKSPACE
 from qwen_agent.tools.base import BaseTool, register_tool
-from qwen_agent.tools.simple_doc_parser import PARAGRAPH_SPLIT_SYMBOL, SimpleDocParser, get_plain_doc
-from qwen_agent.tools.storage import KeyNotExistsError, Storage
-from qwen_agent.utils.tokenization_qwen import count_tokens, tokenizer
-from qwen_agent.utils.utils import get_basename_from_url, hash_sha256
+from qwen_agent.tools.simple_doc_parser import (PARAGRAPH_SPLIT_SYMBOL, SimpleDocParser, get_doc_cache_key,
+                                                 get_plain_doc)
+from qwen_agent.tools.storage import KeyNotExistsError, Storage, evict_workspace
+from qwen_agent.utils.tokenization_qwen import tokenizer
+from qwen_agent.utils.utils import get_basename_from_url
+
+PAGE_MARKER_PATTERN = re.compile(r'^\[page: \d+\]$')
+CHINESE_PERIOD = '。'.encode('utf-8')
+# The tail of the previous chunk repeated at the head of the next one
+CHUNK_OVERLAP_TOKENS = 50
 
 
 class Chunk(BaseModel):
@@ -69,7 +74,7 @@ class DocParser(BaseTool):
         self.parser_page_size: int = self.cfg.get('parser_page_size', DEFAULT_PARSER_PAGE_SIZE)
 
         self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
-        self.db = Storage({'storage_root_path': self.data_root})
+        self.db = Storage({'storage_root_path': self.data_root, 'cache': True})
 
         self.doc_extractor = SimpleDocParser({'structured_doc': True})
 
@@ -99,15 +104,37 @@ class DocParser(BaseTool):
 
         url = params['url']
 
-        cached_name_chunking = f'{hash_sha256(url)}_{str(parser_page_size)}'
-        try:
-            # Directly load the chunked doc
-            record = self.db.get(cached_name_chunking)
-            record = json.loads(record)
-            logger.info(f'Read chunked {url} from cache.')
-            return record
-        except KeyNotExistsError:
-            doc = self.doc_extractor.call({'url': url})
+        doc_key = get_doc_cache_key(url)
+        cached_name_chunking = f'{doc_key}_{str(parser_page_size)}'
+        cached_name_whole = f'{doc_key}_without_chunking'
+        # Concurrent requests for the same doc wait for the first one to parse and chunk it
+        with self.db.lock(cached_name_chunking):
+            for cached_name in [cached_name_chunking, cached_name_whole]:
+                try:
+                    # Directly load the chunked doc
+                    record = self.db.get_json(cached_name)
+                except KeyNotExistsError:
+                    continue
+                if cached_name == cached_name_whole and record['raw'] and record['raw'][0]['token'] > max_ref_token:
+                    # Cached by a call with a larger max_ref_token
+                    continue
+                logger.info(f'Read chunked {url} from cache.')
+                # The same content may have been cached under another path
+                record['url'] = url
+                for chk in record['raw']:
+                    chk['metadata']['source'] = url
+                return record
+
+            new_record, without_chunking = self._parse_and_chunk(url, max_ref_token, parser_page_size)
+            if without_chunking:
+                cached_name_chunking = cached_name_whole
+            # save the document data
+            self.db.put_json(cached_name_chunking, new_record)
+        evict_workspace()
+        return new_record
+
+    def _parse_and_chunk(self, url: str, max_ref_token: int, parser_page_size: int) -> Tuple[dict, bool]:
+        doc = self.doc_extractor.call({'url': url})
 
         total_token = 0
         for page in doc:
@@ -121,7 +148,8 @@ class DocParser(BaseTool):
 
         logger.info(f'Start chunking {url} ({title})...')
         time1 = time.time()
-        if total_token <= max_ref_token:
+        without_chunking = total_token <= max_ref_token
+        if without_chunking:
             # The whole doc is one chunk
             content = [
                 Chunk(content=get_plain_doc(doc),
@@ -132,174 +160,122 @@ class DocParser(BaseTool):
                       },
                       token=total_token)
             ]
-            cached_name_chunking = f'{hash_sha256(url)}_without_chunking'
         else:
             content = self.split_doc_to_chunk(doc, url, title=title, parser_page_size=parser_page_size)
 
         time2 = time.time()
         logger.info(f'Finished chunking {url} ({title}). Time spent: {time2 - time1} seconds.')
 
-        # save the document data
-        new_record = Record(url=url, raw=content, title=title).to_dict()
-        new_record_str = json.dumps(new_record, ensure_ascii=False)
-        self.db.put(cached_name_chunking, new_record_str)
-        return new_record
+        return Record(url=url, raw=content, title=title).to_dict(), without_chunking
 
     def split_doc_to_chunk(self,
                            doc: List[dict],
                            path: str,
                            title: str = '',
                            parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE) -> List[Chunk]:
-        res = []
-        chunk = []
+        return list(self.iter_doc_chunks(doc, path, title=title, parser_page_size=parser_page_size))
+
+    def iter_doc_chunks(self,
+                        doc: List[dict],
+                        path: str,
+                        title: str = '',
+                        parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE) -> Iterator[Chunk]:
+        """Split the doc in one pass and yield the chunks as soon as they are complete.
+
+        The paragraph sizes come from the `token` counted by SimpleDocParser. A paragraph is only encoded (once) when
+        it has to be split into sentences or provides the overlap of the next chunk, and then it is cut by slicing
+        the token ids instead of tokenizing the pieces again.
+        """
+        overlap_size = min(CHUNK_OVERLAP_TOKENS, parser_page_size // 4)
+        chunk_id = 0
+        chunk = []  # Page markers, the overlap text, and [paragraph text, page_num, token ids or None]
+        chunk_page = None  # The page of the last page marker in chunk
         available_token = parser_page_size
         has_para = False
+
+        def make_chunk() -> Chunk:
+            while isinstance(chunk[-1], str) and PAGE_MARKER_PATTERN.fullmatch(chunk[-1]):
+                chunk.pop()  # Redundant page information
+            return Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join([x if isinstance(x, str) else x[0] for x in chunk]),
+                         metadata={
+                             'source': path,
+                             'title': title,
+                             'chunk_id': chunk_id
+                         },
+                         token=parser_page_size - available_token)
+
+        def next_chunk() -> Tuple[list, Optional[int], int]:
+            # Overlap with the tail of the last paragraph
+            last_text, last_page, last_ids = chunk[-1]
+            if last_ids is None:
+                last_ids = tokenizer.encode(last_text)
+            overlap_ids = last_ids[-overlap_size:] if overlap_size > 0 else []
+            # The slice may start in the middle of a character
+            overlap_txt = tokenizer.decode_ids(overlap_ids).lstrip('\ufffd')
+            if overlap_txt.strip():
+                return [f'[page: {str(last_page)}]', overlap_txt], last_page, parser_page_size - len(overlap_ids)
+            return [], None, parser_page_size
+
         for page in doc:
             page_num = page['page_num']
-            if not chunk or f'[page: {str(page_num)}]' != chunk[0]:
-                chunk.append(f'[page: {str(page_num)}]')
-            idx = 0
-            len_para = len(page['content'])
-            while idx < len_para:
-                if not chunk:
-                    chunk.append(f'[page: {str(page_num)}]')
-                para = page['content'][idx]
+            for para in page['content']:
                 txt = para.get('text', para.get('table'))
                 token = para['token']
+                if token > available_token and has_para:
+                    # Record one chunk
+                    yield make_chunk()
+                    chunk_id += 1
+                    chunk, chunk_page, available_token = next_chunk()
+                    has_para = False
                 if token <= available_token:
+                    if chunk_page != page_num:
+                        chunk.append(f'[page: {str(page_num)}]')
+                        chunk_page = page_num
                     available_token -= token
-                    chunk.append([txt, page_num])
+                    chunk.append([txt, page_num, None])
                     has_para = True
-                    idx += 1
-                else:
-                    if has_para:
-                        # Record one chunk
-                        if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
-                            chunk.pop()  # Redundant page information
-                        res.append(
-                            Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
-                                [x if isinstance(x, str) else x[0] for x in chunk]),
-                                  metadata={
-                                      'source': path,
-                                      'title': title,
-                                      'chunk_id': len(res)
-                                  },
-                                  token=parser_page_size - available_token))
-
-                        # Define new chunk
-                        overlap_txt = self._get_last_part(chunk)
-                        if overlap_txt.strip():
-                            chunk = [f'[page: {str(chunk[-1][1])}]', overlap_txt]
-                            has_para = False
-                            available_token = parser_page_size - count_tokens(overlap_txt)
-                        else:
-                            chunk = []
-                            has_para = False
-                            available_token = parser_page_size
-                    else:
-                        # There are excessively long paragraphs present
-                        # Split paragraph to sentences
-                        _sentences = re.split(r'\. |。', txt)
-                        sentences = []
-                        for s in _sentences:
-                            token = count_tokens(s)
-                            if not s.strip() or token == 0:
-                                continue
-                            if token <= available_token:
-                                sentences.append([s, token])
-                            else:
-                                # Limit the length of a sentence to chunk size
-                                token_list = tokenizer.tokenize(s)
-                                for si in range(0, len(token_list), available_token):
-                                    ss = tokenizer.convert_tokens_to_string(
-                                        token_list[si:min(len(token_list), si + available_token)])
-                                    sentences.append([ss, min(available_token, len(token_list) - si)])
-                        sent_index = 0
-                        while sent_index < len(sentences):
-                            s = sentences[sent_index][0]
-                            token = sentences[sent_index][1]
-                            if not chunk:
-                                chunk.append(f'[page: {str(page_num)}]')
-
-                            if token <= available_token or (not has_para):
-                                # Be sure to add at least one sentence
-                                # (not has_para) is a patch of the previous sentence splitting
-                                available_token -= token
-                                chunk.append([s, page_num])
-                                has_para = True
-                                sent_index += 1
-                            else:
-                                assert has_para
-                                if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$',
-                                                                               chunk[-1]) is not None:
-                                    chunk.pop()  # Redundant page information
-                                res.append(
-                                    Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
-                                        [x if isinstance(x, str) else x[0] for x in chunk]),
-                                          metadata={
-                                              'source': path,
-                                              'title': title,
-                                              'chunk_id': len(res)
-                                          },
-                                          token=parser_page_size - available_token))
-
-                                overlap_txt = self._get_last_part(chunk)
-                                if overlap_txt.strip():
-                                    chunk = [f'[page: {str(chunk[-1][1])}]', overlap_txt]
-                                    has_para = False
-                                    available_token = parser_page_size - count_tokens(overlap_txt)
-                                else:
-                                    chunk = []
-                                    has_para = False
-                                    available_token = parser_page_size
-                        # Has split this paragraph by sentence
-                        idx += 1
-        if has_para:
-            if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
-                chunk.pop()  # Redundant page information
-            res.append(
-                Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join([x if isinstance(x, str) else x[0] for x in chunk]),
-                      metadata={
-                          'source': path,
-                          'title': title,
-                          'chunk_id': len(res)
-                      },
-                      token=parser_page_size - available_token))
-
-        return res
-
-    def _get_last_part(self, chunk: list) -> str:
-        overlap = ''
-        need_page = chunk[-1][1]  # Only need this page to prepend
-        available_len = 150
-        for i in range(len(chunk) - 1, -1, -1):
-            if not (isinstance(chunk[i], list) and len(chunk[i]) == 2):
-                continue
-            if chunk[i][1] != need_page:
-                return overlap
-            para = chunk[i][0]
-            if len(para) <= available_len:
-                if overlap:
-                    overlap = f'{para}{PARAGRAPH_SPLIT_SYMBOL}{overlap}'
-                else:
-                    overlap = f'{para}'
-                available_len -= len(para)
-                continue
-            sentence_split_symbol = '. '
-            if '。' in para:
-                sentence_split_symbol = '。'
-            sentences = re.split(r'\. |。', para)
-            sentences = [sentence.strip() for sentence in sentences if sentence]
-            for j in range(len(sentences) - 1, -1, -1):
-                sent = sentences[j]
-                if not sent.strip():
                     continue
-                if len(sent) <= available_len:
-                    if overlap:
-                        overlap = f'{sent}{sentence_split_symbol}{overlap}'
-                    else:
-                        overlap = f'{sent}'
-                    available_len -= len(sent)
-                else:
-                    return overlap
-        return overlap
+
+                # There are excessively long paragraphs present
+                # Split paragraph to sentences, and limit the length of a sentence to what fits next to an overlap
+                max_sentence_len = max(min(available_token, parser_page_size - overlap_size), 1)
+                for sentence_ids in split_ids_to_sentences(tokenizer.encode(txt), max_sentence_len):
+                    s = tokenizer.decode_ids(sentence_ids)
+                    if not s.strip():
+                        continue
+                    token = len(sentence_ids)
+                    if token > available_token and has_para:
+                        yield make_chunk()
+                        chunk_id += 1
+                        chunk, chunk_page, available_token = next_chunk()
+                        has_para = False
+                    if chunk_page != page_num:
+                        chunk.append(f'[page: {str(page_num)}]')
+                        chunk_page = page_num
+                    # Be sure to add at least one sentence
+                    available_token -= token
+                    chunk.append([s, page_num, sentence_ids])
+                    has_para = True
+        if has_para:
+            yield make_chunk()
+
+
+def split_ids_to_sentences(token_ids: List[int], max_len: int) -> Iterator[List[int]]:
+    """Split token ids into sentences (ending with '. ' or '。') of at most max_len ids, by token offsets."""
+    decoder = tokenizer.decoder
+    start = 0
+    for i, token_id in enumerate(token_ids):
+        token = decoder[token_id]
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        end_of_sentence = i + 1 == len(token_ids) or CHINESE_PERIOD in token or (
+            token.endswith(b'.') and _token_bytes(decoder, token_ids[i + 1]).startswith(b' '))
+        if end_of_sentence:
+            for j in range(start, i + 1, max_len):
+                yield token_ids[j:min(i + 1, j + max_len)]
+            start = i + 1
+
+
+def _token_bytes(decoder: dict, token_id: int) -> bytes:
+    token = decoder[token_id]
+    return token.encode('utf-8') if isinstance(token, str) else token
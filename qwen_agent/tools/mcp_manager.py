@@ -25,6 +25,8 @@ from typing import Dict, Optional, Union
 from dotenv import load_dotenv
 
 from qwen_agent.log import logger
+from qwen_agent.settings import (MCP_CONNECT_TIMEOUT, MCP_HEARTBEAT_INTERVAL, MCP_MAX_CONCURRENT_CONNECTIONS,
+                                 MCP_PING_IDLE_THRESHOLD)
 from qwen_agent.tools.base import BaseTool
 
 
@@ -54,6 +56,12 @@ class MCPManager:
             self.processes = []
             self.monkey_patch_mcp_create_platform_compatible_process()
 
+            # Sessions are checked in the background, so that tool calls do not need to ping first
+            self._reconnect_locks: Dict[str, asyncio.Lock] = {}
+            self.heartbeat_future = None
+            if MCP_HEARTBEAT_INTERVAL > 0:
+                self.heartbeat_future = asyncio.run_coroutine_threadsafe(self.heartbeat(), self.loop)
+
     def monkey_patch_mcp_create_platform_compatible_process(self):
         try:
             import mcp.client.stdio
@@ -133,6 +141,9 @@ class MCPManager:
             # If the "env" key exists, it must be a dictionary
             if 'env' in server and not isinstance(server['env'], dict):
                 return False
+            # If the "connect_timeout" key exists, it must be a number of seconds
+            if 'connect_timeout' in server and not isinstance(server['connect_timeout'], (int, float)):
+                return False
         return True
 
     def initConfig(self, config: Dict):
@@ -151,116 +162,189 @@ class MCPManager:
     async def init_config_async(self, config: Dict):
         tools: list = []
         mcp_servers = config['mcpServers']
-        for server_name in mcp_servers:
-            client = MCPClient()
-            server = mcp_servers[server_name]
-            await client.connection_server(mcp_server_name=server_name,
-                                           mcp_server=server)  # Attempt to connect to the server
-
+        semaphore = asyncio.Semaphore(max(1, MCP_MAX_CONCURRENT_CONNECTIONS))
+        # Connect to all servers concurrently, the handshakes of different servers are independent
+        clients = await asyncio.gather(*[
+            self._connect_server(server_name, mcp_servers[server_name], semaphore) for server_name in mcp_servers
+        ])
+
+        failed_servers = [server_name for server_name, client in zip(mcp_servers, clients) if client is None]
+        if failed_servers:
+            if len(failed_servers) == len(mcp_servers):
+                raise RuntimeError(f'Failed in connecting to all MCP servers: {failed_servers}')
+            logger.warning(f'Skipping unreachable MCP servers: {failed_servers}')
+
+        connected = [(server_name, client) for server_name, client in zip(mcp_servers, clients) if client is not None]
+        for server_name, client in connected:
             client_id = server_name + '_' + str(
                 uuid.uuid4())  # To allow the same server name be used across different running agents
             client.client_id = client_id  # Ensure client_id is set on the client instance
             self.clients[client_id] = client  # Add to clients dict after successful connection
-            for tool in client.tools:
-                """MCP tool example:
-                {
-                "name": "read_query",
-                "description": "Execute a SELECT query on the SQLite database",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                        "type": "string",
-                        "description": "SELECT SQL query to execute"
-                        }
-                    },
-                    "required": ["query"]
-                }
-                """
-                parameters = tool.inputSchema
-                # The required field in inputSchema may be empty and needs to be initialized.
-                if 'required' not in parameters:
-                    parameters['required'] = []
-                # Remove keys from parameters that do not conform to the standard OpenAI schema
-                # Check if the required fields exist
-                required_fields = {'type', 'properties', 'required'}
-                missing_fields = required_fields - parameters.keys()
-                if missing_fields:
-                    raise ValueError(f'Missing required fields in schema: {missing_fields}')
-
-                # Keep only the necessary fields
-                cleaned_parameters = {
-                    'type': parameters['type'],
-                    'properties': parameters['properties'],
-                    'required': parameters['required']
-                }
-                register_name = server_name + '-' + tool.name
-                agent_tool = self.create_tool_class(register_name=register_name,
-                                                    register_client_id=client_id,
-                                                    tool_name=tool.name,
-                                                    tool_desc=tool.description,
-                                                    tool_parameters=cleaned_parameters)
-                tools.append(agent_tool)
-
-            if client.resources:
-                """MCP resource example:
-                {
-                    uri: string;           // Unique identifier for the resource
-                    name: string;          // Human-readable name
-                    description?: string;  // Optional description
-                    mimeType?: string;     // Optional MIME type
-                }
-                """
-                # List resources
-                list_resources_tool_name = server_name + '-' + 'list_resources'
-                list_resources_params = {'type': 'object', 'properties': {}, 'required': []}
-                list_resources_agent_tool = self.create_tool_class(
-                    register_name=list_resources_tool_name,
-                    register_client_id=client_id,
-                    tool_name='list_resources',
-                    tool_desc='Servers expose a list of concrete resources through this tool. '
-                    'By invoking it, you can discover the available resources and obtain resource templates, which help clients understand how to construct valid URIs. '
-                    'These URI formats will be used as input parameters for the read_resource function. ',
-                    tool_parameters=list_resources_params)
-                tools.append(list_resources_agent_tool)
-
-                # Read resource
-                resources_template_str = ''  # Check if there are resource templates
-                try:
-                    list_resource_templates = await client.session.list_resource_templates(
-                    )  # Check if the server has resources tesmplate
-                    if list_resource_templates.resourceTemplates:
-                        resources_template_str = '\n'.join(
-                            str(template) for template in list_resource_templates.resourceTemplates)
 
-                except Exception as e:
-                    logger.info(f'Failed in listing MCP resource templates: {e}')
-
-                read_resource_tool_name = server_name + '-' + 'read_resource'
-                read_resource_params = {
-                    'type': 'object',
-                    'properties': {
-                        'uri': {
-                            'type': 'string',
-                            'description': 'The URI identifying the specific resource to access'
-                        }
-                    },
-                    'required': ['uri']
-                }
-                original_tool_desc = 'Request to access a resource provided by a connected MCP server. Resources represent data sources that can be used as context, such as files, API responses, or system information.'
-                if resources_template_str:
-                    tool_desc = original_tool_desc + '\nResource Templates:\n' + resources_template_str
-                else:
-                    tool_desc = original_tool_desc
-                read_resource_agent_tool = self.create_tool_class(register_name=read_resource_tool_name,
-                                                                  register_client_id=client_id,
-                                                                  tool_name='read_resource',
-                                                                  tool_desc=tool_desc,
-                                                                  tool_parameters=read_resource_params)
-                tools.append(read_resource_agent_tool)
+        # Tools are gathered in the order of the config, so that the tool list is deterministic
+        server_tools = await asyncio.gather(
+            *[self._create_server_tools(server_name, client) for server_name, client in connected])
+        for one_server_tools in server_tools:
+            tools.extend(one_server_tools)
 
         return tools
 
+    async def _connect_server(self, server_name: str, server: dict, semaphore: asyncio.Semaphore):
+        """Connect to one MCP server, returning None instead of raising if it is unreachable."""
+        timeout = server.get('connect_timeout', MCP_CONNECT_TIMEOUT)
+        async with semaphore:
+            client = MCPClient()
+            try:
+                await asyncio.wait_for(client.connection_server(mcp_server_name=server_name, mcp_server=server),
+                                       timeout=timeout)
+                return client
+            except asyncio.TimeoutError:
+                logger.warning(f'Timed out after {timeout}s in connecting to MCP server: {server_name}')
+            except Exception as e:
+                logger.warning(f'Failed in connecting to MCP server {server_name}: {e}')
+            try:
+                await client.cleanup()
+            except BaseException:  # The half-opened transport may raise anything when closing
+                pass
+            return None
+
+    async def _create_server_tools(self, server_name: str, client: 'MCPClient') -> list:
+        tools: list = []
+        client_id = client.client_id
+        for tool in client.tools:
+            """MCP tool example:
+            {
+            "name": "read_query",
+            "description": "Execute a SELECT query on the SQLite database",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                    "type": "string",
+                    "description": "SELECT SQL query to execute"
+                    }
+                },
+                "required": ["query"]
+            }
+            """
+            parameters = tool.inputSchema
+            # The required field in inputSchema may be empty and needs to be initialized.
+            if 'required' not in parameters:
+                parameters['required'] = []
+            # Remove keys from parameters that do not conform to the standard OpenAI schema
+            # Check if the required fields exist
+            required_fields = {'type', 'properties', 'required'}
+            missing_fields = required_fields - parameters.keys()
+            if missing_fields:
+                raise ValueError(f'Missing required fields in schema: {missing_fields}')
+
+            # Keep only the necessary fields
+            cleaned_parameters = {
+                'type': parameters['type'],
+                'properties': parameters['properties'],
+                'required': parameters['required']
+            }
+            register_name = server_name + '-' + tool.name
+            agent_tool = self.create_tool_class(register_name=register_name,
+                                                register_client_id=client_id,
+                                                tool_name=tool.name,
+                                                tool_desc=tool.description,
+                                                tool_parameters=cleaned_parameters)
+            tools.append(agent_tool)
+
+        if client.resources:
+            """MCP resource example:
+            {
+                uri: string;           // Unique identifier for the resource
+                name: string;          // Human-readable name
+                description?: string;  // Optional description
+                mimeType?: string;     // Optional MIME type
+            }
+            """
+            # List resources
+            list_resources_tool_name = server_name + '-' + 'list_resources'
+            list_resources_params = {'type': 'object', 'properties': {}, 'required': []}
+            list_resources_agent_tool = self.create_tool_class(
+                register_name=list_resources_tool_name,
+                register_client_id=client_id,
+                tool_name='list_resources',
+                tool_desc='Servers expose a list of concrete resources through this tool. '
+                'By invoking it, you can discover the available resources and obtain resource templates, which help clients understand how to construct valid URIs. '
+                'These URI formats will be used as input parameters for the read_resource function. ',
+                tool_parameters=list_resources_params)
+            tools.append(list_resources_agent_tool)
+
+            # Read resource
+            resources_template_str = ''  # Check if there are resource templates
+            try:
+                list_resource_templates = await client.session.list_resource_templates(
+                )  # Check if the server has resources tesmplate
+                if list_resource_templates.resourceTemplates:
+                    resources_template_str = '\n'.join(
+                        str(template) for template in list_resource_templates.resourceTemplates)
+
+            except Exception as e:
+                logger.info(f'Failed in listing MCP resource templates: {e}')
+
+            read_resource_tool_name = server_name + '-' + 'read_resource'
+            read_resource_params = {
+                'type': 'object',
+                'properties': {
+                    'uri': {
+                        'type': 'string',
+                        'description': 'The URI identifying the specific resource to access'
+                    }
+                },
+                'required': ['uri']
+            }
+            original_tool_desc = 'Request to access a resource provided by a connected MCP server. Resources represent data sources that can be used as context, such as files, API responses, or system information.'
+            if resources_template_str:
+                tool_desc = original_tool_desc + '\nResource Templates:\n' + resources_template_str
+            else:
+                tool_desc = original_tool_desc
+            read_resource_agent_tool = self.create_tool_class(register_name=read_resource_tool_name,
+                                                              register_client_id=client_id,
+                                                              tool_name='read_resource',
+                                                              tool_desc=tool_desc,
+                                                              tool_parameters=read_resource_params)
+            tools.append(read_resource_agent_tool)
+
+        return tools
+
+    async def heartbeat(self):
+        """Ping the sessions that have been idle for long, and reconnect the broken ones."""
+        while True:
+            await asyncio.sleep(MCP_HEARTBEAT_INTERVAL)
+            for client in list(self.clients.values()):
+                if client.idle_seconds() <= MCP_PING_IDLE_THRESHOLD:
+                    continue
+                try:
+                    await asyncio.wait_for(client.session.send_ping(), timeout=MCP_CONNECT_TIMEOUT)
+                    client.touch()
+                except Exception as e:
+                    logger.info(f'Heartbeat of MCP client {client.client_id} failed, try reconnect: {e}')
+                    try:
+                        await self.reconnect_client(client)
+                    except Exception as e2:
+                        # The next tool call on this client will try to reconnect again
+                        logger.info(f'Heartbeat reconnect of MCP client {client.client_id} failed: {e2}')
+
+    async def reconnect_client(self, client: 'MCPClient') -> 'MCPClient':
+        """Replace a broken client with a new connection, sharing the result among concurrent callers."""
+        lock = self._reconnect_locks.setdefault(client.client_id, asyncio.Lock())
+        async with lock:
+            current = self.clients.get(client.client_id)
+            if current is not None and current is not client:
+                return current  # Already reconnected by the heartbeat or by another tool call
+            new_client = await client.reconnect()
+            self.clients[client.client_id] = new_client
+        # Close the SSE stream of the broken session, otherwise a server that stays down leaks one per attempt
+        try:
+            await client.cleanup()
+        except Exception as e:
+            logger.info(f'Failed in closing the replaced MCP client {client.client_id}: {e}')
+        return new_client
+
     def create_tool_class(self, register_name, register_client_id, tool_name, tool_desc, tool_parameters):
 
         class ToolClass(BaseTool):
@@ -286,6 +370,8 @@ class MCPManager:
         return ToolClass()
 
     def shutdown(self):
+        if self.heartbeat_future is not None:
+            self.heartbeat_future.cancel()
         futures = []
         for client_id in list(self.clients.keys()):
             client: MCPClient = self.clients[client_id]
@@ -320,6 +406,7 @@ class MCPClient:
         self._last_mcp_server_name = None
         self._last_mcp_server = None
         self.client_id = None  # For replacing in MCPManager.clients
+        self.last_activity = time.monotonic()  # Time of the last successful round trip with the server
 
     async def connection_server(self, mcp_server_name, mcp_server):
         from mcp import ClientSession, StdioServerParameters
@@ -374,6 +461,7 @@ class MCPClient:
             await self.session.initialize()
             list_tools = await self.session.list_tools()
             self.tools = list_tools.tools
+            self.touch()
             try:
                 list_resources = await self.session.list_resources()  # Check if the server has resources
                 if list_resources.resources:
@@ -396,36 +484,59 @@ class MCPClient:
         await new_client.connection_server(self._last_mcp_server_name, self._last_mcp_server)
         return new_client
 
-    async def execute_function(self, tool_name, tool_args: dict):
-        from mcp.types import TextResourceContents
+    def touch(self):
+        """Record that the session has just completed a round trip with the server."""
+        self.last_activity = time.monotonic()
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
 
-        # Check if session is alive
+    async def execute_function(self, tool_name, tool_args: dict, retry: bool = True):
         try:
-            await self.session.send_ping()
+            # A healthy session needs only one round trip, ping sessions that have been idle for long.
+            # The tool has not been called yet, so any failure here is safe to retry on a new session
+            if self.idle_seconds() > MCP_PING_IDLE_THRESHOLD:
+                await self.session.send_ping()
+                self.touch()
         except Exception as e:
+            if not retry:
+                raise
             logger.info(f"Session is not alive, please increase 'sse_read_timeout' in the config, try reconnect: {e}")
-            # Auto reconnect
+        else:
             try:
-                from qwen_agent.tools.mcp_manager import MCPManager
-                manager = MCPManager()
-                if self.client_id is not None:
-                    manager.clients[self.client_id] = await self.reconnect()
-                    return await manager.clients[self.client_id].execute_function(tool_name, tool_args)
-                else:
-                    logger.info('Reconnect failed: client_id is None')
-                    return 'Session reconnect (client creation) exception: client_id is None'
-            except Exception as e3:
-                logger.info(f'Reconnect (client creation) exception type: {type(e3)}, value: {repr(e3)}')
-                return f'Session reconnect (client creation) exception: {e3}'
+                return await self._execute_function(tool_name, tool_args)
+            except Exception as e:
+                # Only a broken connection is retried: other errors may come after the server has already run
+                # the tool, which must not be called twice
+                if not retry or not _is_connection_error(e):
+                    raise
+                logger.info(f'Connection of the MCP session is broken, try reconnect: {e}')
+        # Auto reconnect and retry the call once
+        try:
+            manager = MCPManager()
+            if self.client_id is None:
+                logger.info('Reconnect failed: client_id is None')
+                return 'Session reconnect (client creation) exception: client_id is None'
+            new_client = await manager.reconnect_client(self)
+        except Exception as e3:
+            logger.info(f'Reconnect (client creation) exception type: {type(e3)}, value: {repr(e3)}')
+            return f'Session reconnect (client creation) exception: {e3}'
+        return await new_client.execute_function(tool_name, tool_args, retry=False)
+
+    async def _execute_function(self, tool_name, tool_args: dict):
+        from mcp.shared.exceptions import McpError
+        from mcp.types import TextResourceContents
+
         if tool_name == 'list_resources':
             try:
                 list_resources = await self.session.list_resources()
+                self.touch()
                 if list_resources.resources:
                     resources_str = '\n\n'.join(str(resource) for resource in list_resources.resources)
                 else:
                     resources_str = 'No resources found'
                 return resources_str
-            except Exception as e:
+            except McpError as e:
                 logger.info(f'No list resources: {e}')
                 return f'Error: {e}'
         elif tool_name == 'read_resource':
@@ -434,6 +545,7 @@ class MCPClient:
                 if not uri:
                     raise ValueError('URI is required for read_resource')
                 read_resource = await self.session.read_resource(uri)
+                self.touch()
                 texts = []
                 for resource in read_resource.contents:
                     if isinstance(resource, TextResourceContents):
@@ -444,11 +556,12 @@ class MCPClient:
                     return '\n\n'.join(texts)
                 else:
                     return 'Failed to read resource'
-            except Exception as e:
+            except (McpError, ValueError) as e:
                 logger.info(f'Failed to read resource: {e}')
                 return f'Error: {e}'
         else:
             response = await self.session.call_tool(tool_name, tool_args)
+            self.touch()
             texts = []
             for content in response.content:
                 if content.type == 'text':
@@ -462,6 +575,17 @@ class MCPClient:
         await self.exit_stack.aclose()
 
 
+def _is_connection_error(e: Exception) -> bool:
+    """Whether the connection of the session is broken, rather than the call having failed on the server."""
+    import anyio
+    import httpx
+
+    if isinstance(e, httpx.TimeoutException) and not isinstance(e, httpx.ConnectTimeout):
+        return False  # The request may have reached the server
+    return isinstance(e, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream,
+                          httpx.TransportError, ConnectionError))
+
+
 def _cleanup_mcp(_sig_num=None, _frame=None):
     if MCPManager._instance is None:
         return
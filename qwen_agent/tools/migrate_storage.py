@@ -0,0 +1,39 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#    http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Move the values of storage roots written with the file backend into their sqlite databases:
+
+    python -m qwen_agent.tools.migrate_storage workspace/tools/doc_parser workspace/tools/simple_doc_parser
+    python -m qwen_agent.tools.migrate_storage --all workspace/tools/storage
+"""
+
+import argparse
+
+from qwen_agent.tools.storage import SQLiteBackend
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate storage roots from the file backend to sqlite')
+    parser.add_argument('roots', nargs='+')
+    parser.add_argument('--all',
+                        action='store_true',
+                        help='import every file under the roots, not only the keys cached by the tools')
+    args = parser.parse_args()
+    for root in args.roots:
+        migrated = SQLiteBackend(root).migrate_from_files(all_files=args.all)
+        print(f'{root}: migrated {migrated} keys')
+
+
+if __name__ == '__main__':
+    main()
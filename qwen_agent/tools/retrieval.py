@@ -63,11 +63,15 @@ class Retrieval(BaseTool):
         self.doc_parse = DocParser({'max_ref_token': self.max_ref_token, 'parser_page_size': self.parser_page_size})
 
         self.rag_searchers = self.cfg.get('rag_searchers', DEFAULT_RAG_SEARCHERS)
+        search_cfg = {'max_ref_token': self.max_ref_token}
+        if 'embedder' in self.cfg:
+            # The embedding model used by vector_search
+            search_cfg['embedder'] = self.cfg['embedder']
         if len(self.rag_searchers) == 1:
-            self.search = TOOL_REGISTRY[self.rag_searchers[0]]({'max_ref_token': self.max_ref_token})
+            self.search = TOOL_REGISTRY[self.rag_searchers[0]](search_cfg)
         else:
             from qwen_agent.tools.search_tools.hybrid_search import HybridSearch
-            self.search = HybridSearch({'max_ref_token': self.max_ref_token, 'rag_searchers': self.rag_searchers})
+            self.search = HybridSearch({**search_cfg, 'rag_searchers': self.rag_searchers})
 
     def call(self, params: Union[str, dict], **kwargs) -> list:
         """RAG tool.
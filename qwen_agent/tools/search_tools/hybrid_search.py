@@ -19,6 +19,7 @@ from qwen_agent.tools.base import TOOL_REGISTRY, register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
 from qwen_agent.tools.search_tools.front_page_search import POSITIVE_INFINITY
+from qwen_agent.utils.rank_fusion import rrf_fuse
 
 
 @register_tool('hybrid_search')
@@ -33,29 +34,41 @@ class HybridSearch(BaseSearch):
         self.search_objs = [TOOL_REGISTRY[name](cfg) for name in self.rag_searchers]
 
     def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
+        import numpy as np
+
         chunk_and_score_list = []
         for s_obj in self.search_objs:
             chunk_and_score_list.append(s_obj.sort_by_scores(query=query, docs=docs, **kwargs))
 
-        chunk_score_map = {}
+        # Number the chunks of all docs consecutively, so that the rankings can be fused as int arrays
+        offsets = {}
+        num_chunks = 0
         for doc in docs:
-            chunk_score_map[doc.url] = [0] * len(doc.raw)
-
-        for chunk_and_score in chunk_and_score_list:
-            for i in range(len(chunk_and_score)):
-                doc_id = chunk_and_score[i][0]
-                chunk_id = chunk_and_score[i][1]
-                score = chunk_and_score[i][2]
-                if score == POSITIVE_INFINITY:
-                    chunk_score_map[doc_id][chunk_id] = POSITIVE_INFINITY
-                else:
-                    # TODO: This needs to be adjusted for performance
-                    chunk_score_map[doc_id][chunk_id] += 1 / (i + 1 + 60)
-
-        all_chunk_and_score = []
-        for k, v in chunk_score_map.items():
-            for i, x in enumerate(v):
-                all_chunk_and_score.append((k, i, x))
-        all_chunk_and_score.sort(key=lambda item: item[2], reverse=True)
-
-        return all_chunk_and_score
+            if doc.url not in offsets:
+                offsets[doc.url] = num_chunks
+                num_chunks += len(doc.raw)
+        ranked_ids = [[offsets[doc_id] + chunk_id for doc_id, chunk_id, _ in chunk_and_score]
+                      for chunk_and_score in chunk_and_score_list]
+        pinned_ids = [
+            offsets[doc_id] + chunk_id
+            for chunk_and_score in chunk_and_score_list
+            for doc_id, chunk_id, score in chunk_and_score
+            if score == POSITIVE_INFINITY
+        ]
+        fused = rrf_fuse(ranked_ids)
+
+        # The chunks with infinite scores (e.g., the front pages) go first, ties are kept in chunk order
+        scores = fused.scores.copy()
+        scores[np.isin(fused.ids, pinned_ids)] = POSITIVE_INFINITY
+        order = np.lexsort((fused.ids, -scores))
+        ids, scores = fused.ids[order], scores[order]
+
+        # Followed by the chunks that no searcher retrieved, in their original order
+        unranked = np.setdiff1d(np.arange(num_chunks), ids, assume_unique=True)
+        ids = np.concatenate([ids, unranked])
+        scores = np.concatenate([scores, np.zeros(len(unranked))])
+
+        urls = list(offsets)
+        starts = np.asarray(list(offsets.values()), dtype=np.int64)
+        doc_index = np.searchsorted(starts, ids, side='right') - 1
+        return [(urls[d], int(i - starts[d]), float(score)) for d, i, score in zip(doc_index, ids, scores)]
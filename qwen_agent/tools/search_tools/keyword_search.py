@@ -12,23 +12,106 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import math
+import os
 import re
 import string
-from typing import List, Tuple
+import threading
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
 import json5
 
 from qwen_agent.log import logger
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN
+from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_WORKSPACE
 from qwen_agent.tools.base import register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
-from qwen_agent.utils.utils import has_chinese_chars
+from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.utils.utils import has_chinese_chars, hash_sha256
+
+# The same parameters as rank_bm25.BM25Okapi
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+# Number of per-doc indexes kept in memory after being loaded from storage
+BM25_INDEX_MEMORY_SIZE = 64
+
+
+def build_bm25_index(chunks: List[str]) -> dict:
+    """Tokenize the chunks of one doc and build its BM25 statistics.
+
+    Returns:
+        {'doc_len': [the number of keywords of each chunk],
+         'postings': {keyword: [[chunk index, term frequency], ...]}}
+    """
+    doc_len = []
+    postings = {}
+    for i, keywords in enumerate(keyword_tokenizer.tokenize_batch(chunks)):
+        doc_len.append(len(keywords))
+        for word, freq in Counter(keywords).items():
+            postings.setdefault(word, []).append([i, freq])
+    return {'doc_len': doc_len, 'postings': postings}
+
+
+def bm25_scores(query: List[str], indexes: List[dict]) -> List[List[float]]:
+    """Score the chunks of several docs as if they were one BM25Okapi corpus.
+
+    The per-doc postings are merged at query time, so the result is the same as building
+    BM25Okapi over all chunks of all docs.
+
+    Returns:
+        The scores of each chunk, grouped by doc.
+    """
+    corpus_size = sum(len(index['doc_len']) for index in indexes)
+    scores = [[0.0] * len(index['doc_len']) for index in indexes]
+    if corpus_size == 0:
+        return scores
+    avgdl = sum(sum(index['doc_len']) for index in indexes) / corpus_size
+
+    doc_freq = Counter()
+    for index in indexes:
+        for word, posting in index['postings'].items():
+            doc_freq[word] += len(posting)
+    if not doc_freq:
+        return scores
+
+    idf = {}
+    idf_sum = 0.0
+    negative_idfs = []
+    for word, freq in doc_freq.items():
+        idf[word] = math.log(corpus_size - freq + 0.5) - math.log(freq + 0.5)
+        idf_sum += idf[word]
+        if idf[word] < 0:
+            negative_idfs.append(word)
+    eps = BM25_EPSILON * idf_sum / len(idf)
+    for word in negative_idfs:
+        idf[word] = eps
+
+    for index, doc_scores in zip(indexes, scores):
+        doc_len = index['doc_len']
+        for word in query:
+            if word not in idf or word not in index['postings']:
+                continue
+            for i, freq in index['postings'][word]:
+                doc_scores[i] += idf[word] * (freq * (BM25_K1 + 1) /
+                                              (freq + BM25_K1 * (1 - BM25_B + BM25_B * doc_len[i] / avgdl)))
+    return scores
 
 
 @register_tool('keyword_search')
 class KeywordSearch(BaseSearch):
 
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        # The tokenized chunks of each doc are only indexed once, and reused by the following queries
+        self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
+        self.db = Storage({'storage_root_path': self.data_root, 'cache': True})
+        self._indexes = OrderedDict()
+
     def search(self, query: str, docs: List[Record], max_ref_token: int = DEFAULT_MAX_REF_TOKEN) -> list:
         chunk_and_score = self.sort_by_scores(query=query, docs=docs)
         if not chunk_and_score:
@@ -48,23 +131,38 @@ class KeywordSearch(BaseSearch):
             # This represents the queries that do not use retrieval: summarize, etc.
             return []
 
-        # Plain all chunks from all docs
-        all_chunks = []
-        for doc in docs:
-            all_chunks.extend(doc.raw)
-
         # Using bm25 retrieval
-        from rank_bm25 import BM25Okapi
-        bm25 = BM25Okapi([split_text_into_keywords(x.content) for x in all_chunks])
-        doc_scores = bm25.get_scores(wordlist)
-        chunk_and_score = [
-            (chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in zip(all_chunks, doc_scores)
-        ]
+        indexes = [self.get_index(doc) for doc in docs]
+        chunk_and_score = []
+        for doc, doc_scores in zip(docs, bm25_scores(wordlist, indexes)):
+            chunk_and_score.extend(
+                (chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in zip(doc.raw, doc_scores))
         chunk_and_score.sort(key=lambda item: item[2], reverse=True)
         assert len(chunk_and_score) > 0
 
         return chunk_and_score
 
+    def get_index(self, doc: Record) -> dict:
+        """Load the BM25 index of the doc, and build it when the doc is seen for the first time."""
+        chunks = [chk.content for chk in doc.raw]
+        # The chunks depend on parser_page_size, so the key covers the content as well as the url
+        cached_name = f'{hash_sha256(doc.url)}_{hash_sha256(json.dumps(chunks, ensure_ascii=False))}_bm25'
+        if cached_name in self._indexes:
+            self._indexes.move_to_end(cached_name)
+            return self._indexes[cached_name]
+
+        try:
+            index = self.db.get_json(cached_name)
+            logger.debug(f'Read bm25 index of {doc.url} from cache.')
+        except KeyNotExistsError:
+            index = build_bm25_index(chunks)
+            self.db.put_json(cached_name, index)
+
+        self._indexes[cached_name] = index
+        while len(self._indexes) > BM25_INDEX_MEMORY_SIZE:
+            self._indexes.popitem(last=False)
+        return index
+
 
 WORDS_TO_IGNORE = [
     'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll", "you'd", 'your',
@@ -91,79 +189,112 @@ ENGLISH_PUNCTUATIONS = string.punctuation.replace('%', '').replace('.', '').repl
 CHINESE_PUNCTUATIONS = '。？！，、；：“”‘’（）《》【】……—『』「」_'
 PUNCTUATIONS = ENGLISH_PUNCTUATIONS + CHINESE_PUNCTUATIONS
 
+# Hashed lookup table of WORDS_TO_IGNORE, which is kept as a list for sklearn's stop_words
+STOP_WORDS = frozenset(WORDS_TO_IGNORE)
 
-def clean_en_token(token: str) -> str:
+# Number of stemmed words kept in memory, shared by indexing and querying
+STEM_CACHE_SIZE = 65536
 
-    punctuations_to_strip = PUNCTUATIONS
 
-    # Detect if the token is a special case like U.S.A., E-mail, percentage, etc.
-    # and skip further processing if that is the case.
-    special_cases_pattern = re.compile(r'^(?:[A-Za-z]\.)+|\w+[@]\w+\.\w+|\d+%$|^(?:[\u4e00-\u9fff]+)$')
-    if special_cases_pattern.match(token):
-        return token
+# Detect if the token is a special case like U.S.A., E-mail, percentage, etc.
+SPECIAL_CASES_PATTERN = re.compile(r'^(?:[A-Za-z]\.)+|\w+[@]\w+\.\w+|\d+%$|^(?:[\u4e00-\u9fff]+)$')
 
-    # Strip unwanted punctuations from front and end
-    token = token.strip(punctuations_to_strip)
-
-    return token
-
-
-def tokenize_and_filter(input_text: str) -> str:
-    patterns = r"""(?x)                    # Enable verbose mode, allowing regex to be on multiple lines and ignore whitespace
+TOKEN_PATTERN = re.compile(
+    r"""(?x)                    # Enable verbose mode, allowing regex to be on multiple lines and ignore whitespace
                 (?:[A-Za-z]\.)+          # Match abbreviations, e.g., U.S.A.
                 |\d+(?:\.\d+)?%?         # Match numbers, including percentages
                 |\w+(?:[-']\w+)*         # Match words, allowing for hyphens and apostrophes
                 |(?:[\w\-\']@)+\w+       # Match email addresses
-                """
+                """)
+
+
+def is_punctuation(word: str) -> bool:
+    # The same as all(char in PUNCTUATIONS for char in word), but the loop runs in C
+    return not word.strip(PUNCTUATIONS)
 
-    tokens = re.findall(patterns, input_text)
 
-    stop_words = WORDS_TO_IGNORE
+def clean_en_token(token: str) -> str:
+    # Skip further processing if the token is a special case
+    if SPECIAL_CASES_PATTERN.match(token):
+        return token
+
+    # Strip unwanted punctuations from front and end
+    return token.strip(PUNCTUATIONS)
 
+
+def tokenize_and_filter(input_text: str) -> List[str]:
     filtered_tokens = []
-    for token in tokens:
+    for token in TOKEN_PATTERN.findall(input_text):
         token_lower = clean_en_token(token).lower()
-        if token_lower not in stop_words and not all(char in PUNCTUATIONS for char in token_lower):
+        if token_lower not in STOP_WORDS and not is_punctuation(token_lower):
             filtered_tokens.append(token_lower)
-
     return filtered_tokens
 
 
-def string_tokenizer(text: str) -> List[str]:
-    text = text.lower().strip()
-    if has_chinese_chars(text):
-        import jieba
-        _wordlist_tmp = list(jieba.lcut(text))
-        _wordlist = []
-        for word in _wordlist_tmp:
-            if not all(char in PUNCTUATIONS for char in word):
-                _wordlist.append(word)
-    else:
+class KeywordTokenizer:
+    """The tokenizer of BM25, used for both indexing and querying.
+
+    The stopword table and regexes are compiled once at import time. The stemmer is created once per
+    thread (snowball stemmers keep their state on the instance), and the stems are memoized in an LRU
+    cache, since the vocabulary of the chunks is much smaller than their total number of words.
+    """
+
+    def __init__(self, stem_cache_size: int = STEM_CACHE_SIZE):
+        self._local = threading.local()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self._stem)
+
+    def _stem(self, word: str) -> str:
+        stemmer = getattr(self._local, 'stemmer', None)
+        if stemmer is None:
+            import snowballstemmer
+            stemmer = self._local.stemmer = snowballstemmer.stemmer('english')
+        return stemmer.stemWord(word)
+
+    def stem_words(self, words: List[str]) -> List[str]:
+        stem = self.stem
+        return [stem(word) for word in words]
+
+    def split_words(self, text: str) -> List[str]:
+        """Split the text into lowercase words, without stop words and punctuations."""
+        text = text.lower().strip()
+        if has_chinese_chars(text):
+            import jieba
+            return [word for word in jieba.lcut(text) if word not in STOP_WORDS and not is_punctuation(word)]
         try:
-            _wordlist = tokenize_and_filter(text)
+            return tokenize_and_filter(text)
         except Exception:
             logger.warning('Tokenize words by spaces.')
-            _wordlist = text.split()
-    _wordlist_res = []
-    for word in _wordlist:
-        if word in WORDS_TO_IGNORE:
-            continue
-        else:
-            _wordlist_res.append(word)
+            return [word for word in text.split() if word not in STOP_WORDS]
 
-    import snowballstemmer
-    stemmer = snowballstemmer.stemmer('english')
-    return stemmer.stemWords(_wordlist_res)
+    def stem_text(self, text: str) -> List[str]:
+        """The stems of the words in the text, which may be stop words again after stemming."""
+        return self.stem_words(self.split_words(text))
+
+    def tokenize(self, text: str) -> List[str]:
+        """Split the text into keywords."""
+        stem = self.stem
+        keywords = []
+        for word in self.split_words(text):
+            word = stem(word)
+            if word not in STOP_WORDS:
+                keywords.append(word)
+        return keywords
+
+    def tokenize_batch(self, texts: List[str]) -> List[List[str]]:
+        """Split many texts, e.g., all chunks of a doc, into keywords."""
+        tokenize = self.tokenize
+        return [tokenize(text) for text in texts]
+
+
+keyword_tokenizer = KeywordTokenizer()
+
+
+def string_tokenizer(text: str) -> List[str]:
+    return keyword_tokenizer.stem_text(text)
 
 
 def split_text_into_keywords(text: str) -> List[str]:
-    _wordlist = string_tokenizer(text)
-    wordlist = []
-    for x in _wordlist:
-        if x in WORDS_TO_IGNORE:
-            continue
-        wordlist.append(x)
-    return wordlist
+    return keyword_tokenizer.tokenize(text)
 
 
 def parse_keyword(text):
@@ -172,9 +303,6 @@ def parse_keyword(text):
     except Exception:
         return split_text_into_keywords(text)
 
-    import snowballstemmer
-    stemmer = snowballstemmer.stemmer('english')
-
     # json format
     _wordlist = []
     try:
@@ -182,12 +310,7 @@ def parse_keyword(text):
             _wordlist.extend([kw.lower() for kw in res['keywords_zh']])
         if 'keywords_en' in res and isinstance(res['keywords_en'], list):
             _wordlist.extend([kw.lower() for kw in res['keywords_en']])
-        _wordlist = stemmer.stemWords(_wordlist)
-        wordlist = []
-        for x in _wordlist:
-            if x in WORDS_TO_IGNORE:
-                continue
-            wordlist.append(x)
+        wordlist = [x for x in keyword_tokenizer.stem_words(_wordlist) if x not in STOP_WORDS]
         split_wordlist = split_text_into_keywords(res['text'])
         wordlist += split_wordlist
         return wordlist
@@ -12,32 +12,135 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
 import json
 import os
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_WORKSPACE
 from qwen_agent.tools.base import register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
+from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.utils.utils import hash_sha256
 
+# Number of document sets whose embedding matrix is kept in memory
+VECTOR_INDEX_MEMORY_SIZE = 16
+# Chunks are truncated to this length before being embedded
+MAX_EMBEDDING_CHARS = 2000
 
-@register_tool('vector_search')
-class VectorSearch(BaseSearch):
-    # TODO: Optimize the accuracy of the embedding retriever.
 
-    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
-        # TODO: More types of embedding can be configured
+class BaseEmbedder:
+    """Embeds texts into vectors. `name` identifies the model, and is part of the embedding cache key."""
+    name: str = ''
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class DashScopeEmbedder(BaseEmbedder):
+
+    def __init__(self, cfg: Dict):
         try:
-            from langchain.schema import Document
+            from langchain_community.embeddings import DashScopeEmbeddings
         except ModuleNotFoundError:
-            raise ModuleNotFoundError('Please install langchain by: `pip install langchain`')
+            raise ModuleNotFoundError('Please install langchain_community by: `pip install langchain_community`')
+        model = cfg.get('model', 'text-embedding-v1')
+        self.name = f'dashscope/{model}'
+        self.embeddings = DashScopeEmbeddings(model=model,
+                                              dashscope_api_key=cfg.get('api_key',
+                                                                        os.getenv('DASHSCOPE_API_KEY', '')))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+class OpenAIEmbedder(BaseEmbedder):
+    """An OpenAI-compatible /embeddings endpoint, such as the one served by vLLM."""
+
+    def __init__(self, cfg: Dict):
+        import requests
+        self.session = requests.Session()
+        self.url = cfg['model_server'].rstrip('/')
+        if not self.url.endswith('/embeddings'):
+            self.url += '/embeddings'
+        self.model = cfg.get('model', '')
+        self.name = f'openai/{self.url}/{self.model}'
+        self.batch_size = cfg.get('batch_size', 64)
+        api_key = cfg.get('api_key', os.getenv('OPENAI_API_KEY', ''))
+        if api_key:
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            response = self.session.post(self.url, json={'model': self.model, 'input': texts[i:i + self.batch_size]})
+            response.raise_for_status()
+            data = sorted(response.json()['data'], key=lambda item: item.get('index', 0))
+            vectors.extend(item['embedding'] for item in data)
+        return vectors
+
+
+class LocalEmbedder(BaseEmbedder):
+    """A sentence-transformers model running in this process, CPU by default."""
+
+    def __init__(self, cfg: Dict):
         try:
-            from langchain_community.embeddings import DashScopeEmbeddings
-            from langchain_community.vectorstores import FAISS
+            from sentence_transformers import SentenceTransformer
         except ModuleNotFoundError:
-            raise ModuleNotFoundError(
-                'Please install langchain_community by: `pip install langchain_community`, '
-                'and install faiss by: `pip install faiss-cpu` or `pip install faiss-gpu` (for CUDA supported GPU)')
+            raise ModuleNotFoundError('Please install sentence-transformers by: `pip install sentence-transformers`')
+        model = cfg.get('model', 'BAAI/bge-small-zh-v1.5')
+        self.name = f'local/{model}'
+        self.batch_size = cfg.get('batch_size', 32)
+        self.model = SentenceTransformer(model, device=cfg.get('device', 'cpu'))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, batch_size=self.batch_size).tolist()
+
+
+EMBEDDERS = {
+    'dashscope': DashScopeEmbedder,
+    'openai': OpenAIEmbedder,
+    'local': LocalEmbedder,
+}
+
+
+def get_embedder(cfg: Optional[Dict] = None) -> BaseEmbedder:
+    """Create the embedder from a config like {'model_type': 'openai', 'model': ..., 'model_server': ...}."""
+    cfg = cfg or {}
+    model_type = cfg.get('model_type', 'dashscope')
+    if model_type not in EMBEDDERS:
+        raise ValueError(f'Unsupported embedder type: {model_type}, available types: {list(EMBEDDERS)}')
+    return EMBEDDERS[model_type](cfg)
+
+
+@register_tool('vector_search')
+class VectorSearch(BaseSearch):
+    # TODO: Optimize the accuracy of the embedding retriever.
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        # Accept a ready-made embedder, or the config to create one
+        embedder = self.cfg.get('embedder')
+        self.embedder = embedder if isinstance(embedder, BaseEmbedder) else None
+        self.embedder_cfg = embedder if isinstance(embedder, dict) else {}
+
+        # Chunk embeddings are computed once per doc and model, only the query is embedded per call
+        self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
+        self.db = Storage({'storage_root_path': self.data_root, 'cache': True})
+        self._indexes = OrderedDict()
+
+    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
+        import numpy as np
+
         # Extract raw query
         try:
             query_json = json.loads(query)
@@ -48,14 +151,56 @@ class VectorSearch(BaseSearch):
             pass
 
         # Plain all chunks from all docs
-        all_chunks = []
-        for doc in docs:
-            for chk in doc.raw:
-                all_chunks.append(Document(page_content=chk.content[:2000], metadata=chk.metadata))
+        docs = [doc for doc in docs if doc.raw]
+        all_chunks = [chk for doc in docs for chk in doc.raw]
+        if not all_chunks:
+            return []
+
+        # The index of a document set is built once, and reused by the following queries
+        embedder = self._get_embedder()
+        index_key = tuple(self._cached_name(doc, embedder) for doc in docs)
+        if index_key in self._indexes:
+            self._indexes.move_to_end(index_key)
+            matrix, sq_norms = self._indexes[index_key]
+        else:
+            matrix = np.concatenate([self._get_doc_embeddings(doc, name) for doc, name in zip(docs, index_key)])
+            sq_norms = (matrix * matrix).sum(axis=1)
+            self._indexes[index_key] = (matrix, sq_norms)
+            while len(self._indexes) > VECTOR_INDEX_MEMORY_SIZE:
+                self._indexes.popitem(last=False)
+
+        # Squared L2 distance, the same as the score of the faiss flat index used before
+        query_vec = np.asarray(embedder.embed_query(query), dtype=np.float32)
+        distances = sq_norms - 2 * matrix.dot(query_vec) + query_vec.dot(query_vec)
+        order = np.argsort(distances, kind='stable')
+        return [(all_chunks[i].metadata['source'], all_chunks[i].metadata['chunk_id'], float(distances[i]))
+                for i in order]
 
-        embeddings = DashScopeEmbeddings(model='text-embedding-v1',
-                                         dashscope_api_key=os.getenv('DASHSCOPE_API_KEY', ''))
-        db = FAISS.from_documents(all_chunks, embeddings)
-        chunk_and_score = db.similarity_search_with_score(query, k=len(all_chunks))
+    def _get_embedder(self) -> BaseEmbedder:
+        if self.embedder is None:
+            self.embedder = get_embedder(self.embedder_cfg)
+        return self.embedder
+
+    @staticmethod
+    def _cached_name(doc: Record, embedder: BaseEmbedder) -> str:
+        chunks = [chk.content for chk in doc.raw]
+        return (f'{hash_sha256(doc.url)}_{hash_sha256(json.dumps(chunks, ensure_ascii=False))}_'
+                f'{hash_sha256(embedder.name)}_embedding')
+
+    def _get_doc_embeddings(self, doc: Record, cached_name: str):
+        import numpy as np
+
+        try:
+            cached = self.db.get_json(cached_name)
+            logger.debug(f'Read embeddings of {doc.url} from cache.')
+            return np.frombuffer(base64.b64decode(cached['data']), dtype=np.float32).reshape(cached['shape'])
+        except KeyNotExistsError:
+            pass
 
-        return [(chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in chunk_and_score]
+        texts = [chk.content[:MAX_EMBEDDING_CHARS] for chk in doc.raw]
+        matrix = np.asarray(self._get_embedder().embed_documents(texts), dtype=np.float32)
+        self.db.put_json(cached_name, {
+            'shape': list(matrix.shape),
+            'data': base64.b64encode(matrix.tobytes()).decode('ascii'),
+        })
+        return matrix
@@ -12,20 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import math
+import multiprocessing
 import os
 import re
 import time
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import Dict, List, Optional, Union
 
 from qwen_agent.log import logger
-from qwen_agent.settings import DEFAULT_WORKSPACE
+from qwen_agent.settings import DEFAULT_PDF_MAX_PAGES, DEFAULT_PDF_PARSER_WORKERS, DEFAULT_WORKSPACE
 from qwen_agent.tools.base import BaseTool, register_tool
-from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.tools.storage import KeyNotExistsError, Storage, evict_workspace
 from qwen_agent.utils.str_processing import rm_cid, rm_continuous_placeholders, rm_hexadecimal
-from qwen_agent.utils.tokenization_qwen import count_tokens
-from qwen_agent.utils.utils import (get_file_type, hash_sha256, is_http_url, read_text_from_file,
+from qwen_agent.utils.tokenization_qwen import count_tokens, count_tokens_batch
+from qwen_agent.utils.utils import (get_file_type, hash_file_sha256, hash_sha256, is_http_url, read_text_from_file,
                                     sanitize_chrome_file_path, save_url_to_local_work_dir)
 
 
@@ -55,6 +58,9 @@ class DocParserError(Exception):
 
 PARAGRAPH_SPLIT_SYMBOL = '\n'
 
+# Shorter pdfs are parsed in the current process, the pool startup costs more than it saves
+PDF_PARALLEL_MIN_PAGES = 16
+
 
 def parse_word(docx_path: str, extract_image: bool = False):
     if extract_image:
@@ -237,7 +243,46 @@ def parse_html_bs(path: str, extract_image: bool = False):
     return [{'page_num': 1, 'content': content, 'title': title}]
 
 
-def parse_pdf(pdf_path: str, extract_image: bool = False) -> List[dict]:
+def parse_pdf(pdf_path: str,
+              extract_image: bool = False,
+              num_workers: int = DEFAULT_PDF_PARSER_WORKERS,
+              max_pages: int = DEFAULT_PDF_MAX_PAGES) -> List[dict]:
+    """Parse a pdf, sharding the pages across a process pool for long documents.
+
+    Args:
+        num_workers: The size of the process pool, 0 means the number of cpus and 1 disables the pool.
+        max_pages: Only the first max_pages pages are parsed, 0 means all pages.
+    """
+    import pdfplumber
+    with pdfplumber.open(pdf_path) as pdf:
+        num_pages = len(pdf.pages)
+    if max_pages > 0:
+        num_pages = min(num_pages, max_pages)
+
+    num_workers = num_workers or os.cpu_count() or 1
+    # Daemon processes (e.g. multiprocessing workers) are not allowed to have children
+    if num_workers <= 1 or num_pages < PDF_PARALLEL_MIN_PAGES or multiprocessing.current_process().daemon:
+        return parse_pdf_pages(pdf_path, list(range(num_pages)), extract_image)
+
+    # Contiguous shards, several per worker so that slow pages do not leave the other workers idle
+    num_workers = min(num_workers, num_pages)
+    shard_size = max(1, math.ceil(num_pages / (num_workers * 4)))
+    shards = [list(range(i, min(i + shard_size, num_pages))) for i in range(0, num_pages, shard_size)]
+    logger.info(f'Parsing {num_pages} pages of {pdf_path} with {num_workers} processes...')
+    doc = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # map keeps the order of the shards, so the pages are merged in page order
+        for pages in executor.map(partial(parse_pdf_pages, pdf_path, extract_image=extract_image, count_token=True),
+                                  shards):
+            doc.extend(pages)
+    return doc
+
+
+def parse_pdf_pages(pdf_path: str,
+                    page_numbers: List[int],
+                    extract_image: bool = False,
+                    count_token: bool = False) -> List[dict]:
+    """Parse the given pages (0-based) of a pdf. It runs in worker processes, and can count tokens there as well."""
     # Todo: header and footer
     from pdfminer.high_level import extract_pages
     from pdfminer.layout import LTImage, LTRect, LTTextContainer
@@ -245,8 +290,9 @@ def parse_pdf(pdf_path: str, extract_image: bool = False) -> List[dict]:
     doc = []
     import pdfplumber
     pdf = pdfplumber.open(pdf_path)
-    for i, page_layout in enumerate(extract_pages(pdf_path)):
-        page = {'page_num': page_layout.pageid, 'content': []}
+    # extract_pages yields the selected pages in document order
+    for i, page_layout in zip(page_numbers, extract_pages(pdf_path, page_numbers=set(page_numbers))):
+        page = {'page_num': i + 1, 'content': []}
 
         elements = []
         for element in page_layout:
@@ -284,7 +330,11 @@ def parse_pdf(pdf_path: str, extract_image: bool = False) -> List[dict]:
 
         # merge elements
         page['content'] = postprocess_page_content(page['content'])
+        if count_token:
+            for para in page['content']:
+                para['token'] = count_tokens(para.get('text', para.get('table')))
         doc.append(page)
+    pdf.close()
 
     return doc
 
@@ -377,6 +427,15 @@ def get_plain_doc(doc: list):
     return PARAGRAPH_SPLIT_SYMBOL.join(paras)
 
 
+def get_doc_cache_key(url: str) -> str:
+    """The cache key of a doc: the content hash (plus the file extension) for local files, the url hash otherwise."""
+    if not is_http_url(url):
+        path = sanitize_chrome_file_path(url)
+        if os.path.isfile(path):
+            return hash_sha256(hash_file_sha256(path) + os.path.splitext(path)[1].lower())
+    return hash_sha256(url)
+
+
 @register_tool('simple_doc_parser')
 class SimpleDocParser(BaseTool):
     description = f'提取出一个文档的内容，支持类型包括：{"/".join(PARSER_SUPPORTED_FILE_TYPES)}'
@@ -392,8 +451,10 @@ class SimpleDocParser(BaseTool):
         self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
         self.extract_image = self.cfg.get('extract_image', False)
         self.structured_doc = self.cfg.get('structured_doc', False)
+        self.pdf_workers = self.cfg.get('pdf_workers', DEFAULT_PDF_PARSER_WORKERS)
+        self.pdf_max_pages = self.cfg.get('pdf_max_pages', DEFAULT_PDF_MAX_PAGES)
 
-        self.db = Storage({'storage_root_path': self.data_root})
+        self.db = Storage({'storage_root_path': self.data_root, 'cache': True})
 
     def call(self, params: Union[str, dict], **kwargs) -> Union[str, list]:
         """Parse pdf by url, and return the formatted content.
@@ -417,66 +478,80 @@ class SimpleDocParser(BaseTool):
 
         params = self._verify_json_format_args(params)
         path = params['url']
-        cached_name_ori = f'{hash_sha256(path)}_ori'
-        try:
-            # Directly load the parsed doc
-            parsed_file = self.db.get(cached_name_ori)
-            parsed_file = json.loads(parsed_file)
-            logger.info(f'Read parsed {path} from cache.')
-        except KeyNotExistsError:
-            logger.info(f'Start parsing {path}...')
-            time1 = time.time()
-
-            f_type = get_file_type(path)
-            if f_type in PARSER_SUPPORTED_FILE_TYPES:
-                if path.startswith('https://') or path.startswith('http://') or re.match(
-                        r'^[A-Za-z]:\\', path) or re.match(r'^[A-Za-z]:/', path):
-                    path = path
-                else:
-                    path = sanitize_chrome_file_path(path)
-
-            os.makedirs(self.data_root, exist_ok=True)
-            if is_http_url(path):
-                # download online url
-                tmp_file_root = os.path.join(self.data_root, hash_sha256(path))
-                os.makedirs(tmp_file_root, exist_ok=True)
-                path = save_url_to_local_work_dir(path, tmp_file_root)
+        # Keyed by the file content, so an edited file is parsed again and a copy at another path is not
+        cached_name_ori = f'{get_doc_cache_key(path)}_ori'
+        if self.pdf_max_pages > 0:
+            cached_name_ori = f'{get_doc_cache_key(path)}_{self.pdf_max_pages}pages_ori'
+        # Concurrent requests for the same doc wait for the first one to parse it
+        with self.db.lock(cached_name_ori):
             try:
-                if f_type == 'pdf':
-                    parsed_file = parse_pdf(path, self.extract_image)
-                elif f_type == 'docx':
-                    parsed_file = parse_word(path, self.extract_image)
-                elif f_type == 'pptx':
-                    parsed_file = parse_ppt(path, self.extract_image)
-                elif f_type == 'txt':
-                    parsed_file = parse_txt(path)
-                elif f_type == 'html':
-                    parsed_file = parse_html_bs(path, self.extract_image)
-                elif f_type == 'csv':
-                    parsed_file = parse_csv(path, self.extract_image)
-                elif f_type == 'tsv':
-                    parsed_file = parse_tsv(path, self.extract_image)
-                elif f_type in ['xlsx', 'xls']:
-                    parsed_file = parse_excel(path, self.extract_image)
-                else:
-                    raise ValueError(
-                        f'Failed: The current parser does not support this file type! Supported types: {"/".join(PARSER_SUPPORTED_FILE_TYPES)}'
-                    )
-            except Exception as ex:
-                exception_type = type(ex).__name__
-                exception_message = str(ex)
-                raise DocParserError(code=exception_type, message=exception_message)
-
-            for page in parsed_file:
-                for para in page['content']:
-                    # Todo: More attribute types
-                    para['token'] = count_tokens(para.get('text', para.get('table')))
-            time2 = time.time()
-            logger.info(f'Finished parsing {path}. Time spent: {time2 - time1} seconds.')
-            # Cache the parsing doc
-            self.db.put(cached_name_ori, json.dumps(parsed_file, ensure_ascii=False, indent=2))
+                # Directly load the parsed doc
+                parsed_file = self.db.get_json(cached_name_ori)
+                logger.info(f'Read parsed {path} from cache.')
+            except KeyNotExistsError:
+                parsed_file = self._parse(path)
+                # Cache the parsing doc
+                self.db.put_json(cached_name_ori, parsed_file)
+                evict_workspace()
 
         if not self.structured_doc:
             return get_plain_doc(parsed_file)
         else:
             return parsed_file
+
+    def _parse(self, path: str) -> list:
+        logger.info(f'Start parsing {path}...')
+        time1 = time.time()
+
+        f_type = get_file_type(path)
+        if f_type in PARSER_SUPPORTED_FILE_TYPES:
+            if path.startswith('https://') or path.startswith('http://') or re.match(
+                    r'^[A-Za-z]:\\', path) or re.match(r'^[A-Za-z]:/', path):
+                path = path
+            else:
+                path = sanitize_chrome_file_path(path)
+
+        os.makedirs(self.data_root, exist_ok=True)
+        if is_http_url(path):
+            # download online url
+            tmp_file_root = os.path.join(self.data_root, hash_sha256(path))
+            os.makedirs(tmp_file_root, exist_ok=True)
+            path = save_url_to_local_work_dir(path, tmp_file_root)
+        try:
+            if f_type == 'pdf':
+                parsed_file = parse_pdf(path,
+                                        self.extract_image,
+                                        num_workers=self.pdf_workers,
+                                        max_pages=self.pdf_max_pages)
+            elif f_type == 'docx':
+                parsed_file = parse_word(path, self.extract_image)
+            elif f_type == 'pptx':
+                parsed_file = parse_ppt(path, self.extract_image)
+            elif f_type == 'txt':
+                parsed_file = parse_txt(path)
+            elif f_type == 'html':
+                parsed_file = parse_html_bs(path, self.extract_image)
+            elif f_type == 'csv':
+                parsed_file = parse_csv(path, self.extract_image)
+            elif f_type == 'tsv':
+                parsed_file = parse_tsv(path, self.extract_image)
+            elif f_type in ['xlsx', 'xls']:
+                parsed_file = parse_excel(path, self.extract_image)
+            else:
+                raise ValueError(
+                    f'Failed: The current parser does not support this file type! Supported types: {"/".join(PARSER_SUPPORTED_FILE_TYPES)}'
+                )
+        except Exception as ex:
+            exception_type = type(ex).__name__
+            exception_message = str(ex)
+            raise DocParserError(code=exception_type, message=exception_message)
+
+        # The paragraphs parsed in worker processes are already counted
+        paras = [para for page in parsed_file for para in page['content'] if 'token' not in para]
+        # Todo: More attribute types
+        tokens = count_tokens_batch([para.get('text', para.get('table')) for para in paras])
+        for para, token in zip(paras, tokens):
+            para['token'] = token
+        time2 = time.time()
+        logger.info(f'Finished parsing {path}. Time spent: {time2 - time1} seconds.')
+        return parsed_file
@@ -12,18 +12,507 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
-from typing import Dict, Optional, Union
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from qwen_agent.settings import DEFAULT_WORKSPACE
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_STORAGE_BACKEND, DEFAULT_WORKSPACE, DEFAULT_WORKSPACE_MAX_SIZE
 from qwen_agent.tools.base import BaseTool, register_tool
-from qwen_agent.utils.utils import read_text_from_file, save_text_to_file
+from qwen_agent.utils.utils import hash_sha256, print_traceback
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LOCK_DIR = '.locks'
+
+# The database of the sqlite backend, one per storage root. The -wal and -shm files live next to it.
+SQLITE_FILE_NAME = 'storage.sqlite3'
+
+# Written into a storage root that only holds cached values (cfg 'cache'), which evict_workspace may delete.
+# The content is the name of the backend
+CACHE_MARKER_FILE = '.cache'
+
+# Keys of the values cached by the tools: a sha256 hex digest followed by a suffix, e.g. `<sha256>_ori`
+CACHE_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}_[^/]+$')
+
+# Values shorter than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+# Number of files moved into the database per transaction when migrating from the file layout
+MIGRATE_BATCH_SIZE = 256
+
+# The access time of a key is only refreshed on reads if it is older than this, to avoid a write per read
+ATIME_RESOLUTION = 60
+
+# evict_workspace runs after every parsed document, but only looks at the caches once per this many seconds
+EVICT_INTERVAL = 60
+
+# Absolute path -> backend name of the cache roots opened by this process
+_CACHE_ROOTS: Dict[str, str] = {}
+_LAST_EVICTION: Dict[str, float] = {}
+
+_THREAD_LOCKS: Dict[str, threading.Lock] = {}
+_THREAD_LOCKS_GUARD = threading.Lock()
 
 
 class KeyNotExistsError(ValueError):
     pass
 
 
+def _atomic_write(path: str, data: bytes) -> None:
+    # Readers never see a half-written file, and concurrent writers do not interleave
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _decode_text(data: bytes) -> str:
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        print_traceback(is_error=False)
+        from charset_normalizer import from_bytes
+        return str(from_bytes(data).best())
+
+
+def _select_evictions(entries: List[tuple], max_size: int) -> List[tuple]:
+    """Pick the least recently used entries to delete, so that the rest fits in max_size bytes.
+
+    Args:
+        entries: [(access time, size, ...), ...]
+
+    Returns:
+        The entries to delete, oldest first.
+    """
+    total_size = sum(entry[1] for entry in entries)
+    if max_size <= 0 or total_size <= max_size:
+        return []
+
+    # Evict down to 90% so that the following writes do not trigger eviction again right away
+    target_size = int(max_size * 0.9)
+    evictions = []
+    for entry in sorted(entries, key=lambda entry: entry[0]):
+        if total_size <= target_size:
+            break
+        evictions.append(entry)
+        total_size -= entry[1]
+    return evictions
+
+
+class KVBackend:
+    """The key-value store behind Storage. Keys are path-like strings, and values are bytes."""
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def put(self, key: str, value: bytes, compress: bool = False) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def scan_keys(self, prefix: str = '') -> List[str]:
+        """The sorted keys starting with prefix, without reading their values."""
+        raise NotImplementedError
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """[(access time, size, key), ...] of all keys, used for eviction."""
+        raise NotImplementedError
+
+    def touch(self, key: str) -> None:
+        """Mark the key as recently used."""
+        pass
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """The values of the keys that exist."""
+        values = {}
+        for key in keys:
+            try:
+                values[key] = self.get(key)
+            except KeyNotExistsError:
+                pass
+        return values
+
+    def put_many(self, items: Dict[str, bytes], compress: bool = False) -> None:
+        for key, value in items.items():
+            self.put(key, value, compress=compress)
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        return sum(self.delete(key) for key in keys)
+
+    def scan(self, prefix: str = '') -> Iterator[Tuple[str, bytes]]:
+        for key in self.scan_keys(prefix):
+            try:
+                yield key, self.get(key)
+            except KeyNotExistsError:
+                continue
+
+    def evict(self, max_size: int) -> int:
+        """Delete the least recently used keys until the values fit in max_size bytes."""
+        return self.delete_many([key for _, _, key in _select_evictions(self.entries(), max_size)])
+
+    def mark_as_cache(self, backend_name: str) -> None:
+        """Flag the root as holding only cached values, so that evict_workspace may delete them."""
+        marker_path = os.path.join(self.root, CACHE_MARKER_FILE)
+        if not os.path.exists(marker_path):
+            _atomic_write(marker_path, backend_name.encode('utf-8'))
+        _CACHE_ROOTS[os.path.abspath(self.root)] = backend_name
+
+
+class FileBackend(KVBackend):
+    """One file for one key value pair, the original layout of Storage."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def get(self, key: str) -> bytes:
+        try:
+            with open(os.path.join(self.root, key), 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            raise KeyNotExistsError(f'Get Failed: {key} does not exist')
+
+    def put(self, key: str, value: bytes, compress: bool = False) -> None:
+        # Files do not record whether they are compressed, so compress is ignored
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _atomic_write(path, value)
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(os.path.join(self.root, key))
+            return True
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            return False
+
+    def touch(self, key: str) -> None:
+        try:
+            os.utime(os.path.join(self.root, key))
+        except OSError:
+            pass
+
+    def _walk(self, prefix: str = ''):
+        # The keys under the deepest directory of prefix
+        top = os.path.join(self.root, prefix[:prefix.rfind('/') + 1])
+        for dir_path, dir_names, file_names in os.walk(top):
+            dir_names[:] = [d for d in dir_names if d != LOCK_DIR]
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and not file_name.endswith('.tmp') and key != CACHE_MARKER_FILE:
+                    yield key, path
+
+    def scan_keys(self, prefix: str = '') -> List[str]:
+        return sorted(key for key, _ in self._walk(prefix))
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for key, path in self._walk():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, key))
+        return entries
+
+
+class SQLiteBackend(KVBackend):
+    """All keys of a storage root in one sqlite database in WAL mode.
+
+    Readers do not block the writer, every write is a transaction so that concurrent processes never see
+    half-written values, and prefix scans and eviction only read the keys and sizes, not the values.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self.db_path = os.path.join(self.root, SQLITE_FILE_NAME)
+        # sqlite connections can neither be shared across threads nor survive a fork
+        self._local = threading.local()
+        self._legacy_checked = False
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS kv ('
+                         'key TEXT PRIMARY KEY, value BLOB NOT NULL, compressed INTEGER NOT NULL, '
+                         'size INTEGER NOT NULL, atime REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS kv_atime ON kv (atime)')
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn
+        # Take the write lock up front, so that concurrent writers wait on busy_timeout instead of failing
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _encode(value: bytes, compress: bool) -> Tuple[bytes, int]:
+        if compress and len(value) >= COMPRESS_MIN_SIZE:
+            compressed = zlib.compress(value)
+            if len(compressed) < len(value):
+                return compressed, 1
+        return value, 0
+
+    @staticmethod
+    def _decode(value: bytes, compressed: int) -> bytes:
+        return zlib.decompress(value) if compressed else bytes(value)
+
+    def _rows(self, items: Dict[str, bytes], compress: bool) -> List[tuple]:
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            data, compressed = self._encode(value, compress)
+            rows.append((key, data, compressed, len(data), now))
+        return rows
+
+    def get(self, key: str) -> bytes:
+        row = self._conn.execute('SELECT value, compressed FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyNotExistsError(f'Get Failed: {key} does not exist')
+        return self._decode(*row)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        values = {}
+        # Stay below the default limit of 999 bound parameters in older sqlite versions
+        for i in range(0, len(keys), 900):
+            batch = keys[i:i + 900]
+            for key, value, compressed in self._conn.execute(
+                    f'SELECT key, value, compressed FROM kv WHERE key IN ({",".join("?" * len(batch))})', batch):
+                values[key] = self._decode(value, compressed)
+        return values
+
+    def put(self, key: str, value: bytes, compress: bool = False) -> None:
+        self.put_many({key: value}, compress=compress)
+
+    def put_many(self, items: Dict[str, bytes], compress: bool = False) -> None:
+        rows = self._rows(items, compress)
+        with self._transaction() as conn:
+            conn.executemany('INSERT OR REPLACE INTO kv (key, value, compressed, size, atime) VALUES (?, ?, ?, ?, ?)',
+                             rows)
+
+    def delete(self, key: str) -> bool:
+        return self.delete_many([key]) > 0
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        with self._transaction() as conn:
+            return conn.executemany('DELETE FROM kv WHERE key = ?', [(key,) for key in keys]).rowcount
+
+    def touch(self, key: str) -> None:
+        now = time.time()
+        try:
+            self._conn.execute('UPDATE kv SET atime = ? WHERE key = ? AND atime < ?',
+                               (now, key, now - ATIME_RESOLUTION))
+        except sqlite3.OperationalError:
+            # Recency is best effort, a busy database should not fail the read
+            pass
+
+    def scan_keys(self, prefix: str = '') -> List[str]:
+        if not prefix:
+            return [key for key, in self._conn.execute('SELECT key FROM kv ORDER BY key')]
+        # A range over the primary key, so that the scan uses the index
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return [
+            key for key, in self._conn.execute('SELECT key FROM kv WHERE key >= ? AND key < ? ORDER BY key',
+                                               (prefix, upper))
+        ]
+
+    def scan(self, prefix: str = '') -> Iterator[Tuple[str, bytes]]:
+        keys = self.scan_keys(prefix)
+        for i in range(0, len(keys), 900):
+            values = self.get_many(keys[i:i + 900])
+            for key in keys[i:i + 900]:
+                if key in values:
+                    yield key, values[key]
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        return self._conn.execute('SELECT atime, size, key FROM kv').fetchall()
+
+    def _legacy_files(self, all_files: bool = False) -> Iterator[Tuple[str, str]]:
+        """(key, path) of the files under root that migrate_from_files would import."""
+        for key, path in FileBackend(self.root)._walk():
+            if not os.path.basename(path).startswith(SQLITE_FILE_NAME) and (all_files or CACHE_KEY_PATTERN.match(key)):
+                yield key, path
+
+    def warn_legacy_files(self, all_files: bool = False) -> None:
+        """Warn once per process if root still holds keys written by FileBackend, which this backend does not read."""
+        if self._legacy_checked:
+            return
+        self._legacy_checked = True
+        if next(self._legacy_files(all_files), None) is not None:
+            logger.warning(f'{self.root} holds keys written by the file storage backend, which are invisible to the '
+                           f'sqlite backend. Move them into {self.db_path} with `python -m qwen_agent.tools.'
+                           f'migrate_storage {"--all " if all_files else ""}{self.root}`, or set the storage backend '
+                           f'to "file".')
+
+    def migrate_from_files(self, all_files: bool = False) -> int:
+        """Move the values FileBackend left under root into the database, and delete their files.
+
+        Only run on request (see qwen_agent/tools/migrate_storage.py): a storage root may share its directory with
+        other files, such as the documents downloaded by simple_doc_parser.
+
+        Args:
+            all_files: Import every file under root, for roots that only ever held Storage keys (e.g. the
+              `storage` tool). By default only the keys cached by the tools (CACHE_KEY_PATTERN) are imported.
+
+        Returns:
+            The number of migrated keys.
+        """
+        paths = list(self._legacy_files(all_files))
+        if not paths:
+            return 0
+
+        migrated = 0
+        # Move the files in batches, so that a large cache is not loaded into memory at once
+        for i in range(0, len(paths), MIGRATE_BATCH_SIZE):
+            items = {}
+            for key, path in paths[i:i + MIGRATE_BATCH_SIZE]:
+                try:
+                    with open(path, 'rb') as f:
+                        items[key] = f.read()
+                except OSError:
+                    continue
+            with self._transaction() as conn:
+                # Values written to the database in the meantime are newer than the files
+                conn.executemany(
+                    'INSERT OR IGNORE INTO kv (key, value, compressed, size, atime) VALUES (?, ?, ?, ?, ?)',
+                    self._rows(items, compress=False))
+            # Only the files that were read into the database are deleted
+            for key, path in paths[i:i + MIGRATE_BATCH_SIZE]:
+                if key not in items:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                # Remove the directories of nested keys once they are empty
+                dir_path = os.path.dirname(path)
+                while os.path.abspath(dir_path) != os.path.abspath(self.root):
+                    try:
+                        os.rmdir(dir_path)
+                    except OSError:
+                        break
+                    dir_path = os.path.dirname(dir_path)
+            migrated += len(items)
+
+        logger.info(f'Migrated {migrated} keys from files to {self.db_path}.')
+        return migrated
+
+
+STORAGE_BACKENDS = {'file': FileBackend, 'sqlite': SQLiteBackend}
+
+_BACKENDS: Dict[Tuple[str, str], KVBackend] = {}
+_BACKENDS_GUARD = threading.Lock()
+
+
+def get_backend(name: str, root: str) -> KVBackend:
+    """The backend of a storage root, shared by all Storage instances of the process."""
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f'Unknown storage backend: {name}, expected one of {list(STORAGE_BACKENDS)}')
+    cache_key = (name, os.path.abspath(root))
+    with _BACKENDS_GUARD:
+        if cache_key not in _BACKENDS:
+            _BACKENDS[cache_key] = STORAGE_BACKENDS[name](root)
+        return _BACKENDS[cache_key]
+
+
+def _cache_roots(root: str) -> Dict[str, str]:
+    """The cache roots under root: those directly under `<root>/tools` (the default roots of the tools), and the
+    ones opened by this process. Only the marker files are read, the rest of the tree is not walked.
+
+    Returns:
+        {absolute path: backend name}
+    """
+    roots = {}
+    tools_dir = os.path.join(root, 'tools')
+    try:
+        names = os.listdir(tools_dir)
+    except OSError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(tools_dir, name, CACHE_MARKER_FILE), encoding='utf-8') as f:
+                roots[os.path.abspath(os.path.join(tools_dir, name))] = f.read().strip() or 'sqlite'
+        except OSError:
+            continue
+    abs_root = os.path.abspath(root)
+    for path, backend_name in list(_CACHE_ROOTS.items()):
+        if path == abs_root or path.startswith(abs_root + os.sep):
+            roots.setdefault(path, backend_name)
+    return roots
+
+
+def evict_workspace(root: str = DEFAULT_WORKSPACE,
+                    max_size: int = DEFAULT_WORKSPACE_MAX_SIZE,
+                    force: bool = False) -> int:
+    """Delete the least recently used cached values under root until they fit in max_size bytes.
+
+    Only the storage roots opened with cfg 'cache' are evicted. Other files under root, such as code_interpreter
+    outputs, downloaded documents and the data of the storage tool, are never deleted.
+
+    Args:
+        force: Evict even if root was evicted less than EVICT_INTERVAL seconds ago.
+
+    Returns:
+        The number of deleted keys.
+    """
+    if max_size <= 0 or not os.path.isdir(root):
+        return 0
+    now = time.time()
+    abs_root = os.path.abspath(root)
+    if not force and now - _LAST_EVICTION.get(abs_root, 0) < EVICT_INTERVAL:
+        return 0
+    _LAST_EVICTION[abs_root] = now
+
+    entries = []
+    for cache_root, backend_name in _cache_roots(root).items():
+        try:
+            backend = get_backend(backend_name, cache_root)
+        except ValueError:
+            continue
+        for atime, size, key in backend.entries():
+            # A file backend root may also hold other files, e.g. the downloads of simple_doc_parser
+            if isinstance(backend, FileBackend) and not CACHE_KEY_PATTERN.match(key):
+                continue
+            entries.append((atime, size, backend, key))
+
+    evictions = _select_evictions(entries, max_size)
+    if not evictions:
+        return 0
+    keys_of_backend = {}
+    for _, _, backend, key in evictions:
+        keys_of_backend.setdefault(id(backend), (backend, []))[1].append(key)
+    deleted = 0
+    for backend, keys in keys_of_backend.values():
+        deleted += backend.delete_many(keys)
+    logger.info(f'Evicted {deleted} cached entries from {root}.')
+    return deleted
+
+
 @register_tool('storage')
 class Storage(BaseTool):
     """
@@ -49,7 +538,28 @@ class Storage(BaseTool):
     def __init__(self, cfg: Optional[Dict] = None):
         super().__init__(cfg)
         self.root = self.cfg.get('storage_root_path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
-        os.makedirs(self.root, exist_ok=True)
+        # 'sqlite' or 'file', see STORAGE_BACKENDS
+        self.backend_name = self.cfg.get('backend', DEFAULT_STORAGE_BACKEND)
+        # Compress large values transparently (only supported by the sqlite backend)
+        self.compress = self.cfg.get('compress', False)
+        # Evict the least recently used keys after writes when the values exceed this many bytes, 0 to disable
+        self.max_size = self.cfg.get('max_size', 0)
+        self.backend = get_backend(self.backend_name, self.root)
+        # Whether the root only holds cached values that can be recomputed, which evict_workspace may delete
+        if self.cfg.get('cache', False):
+            self.backend.mark_as_cache(self.backend_name)
+        if isinstance(self.backend, SQLiteBackend):
+            # Caches are only recomputed, but other roots (e.g. this tool's own data) need all their files
+            self.backend.warn_legacy_files(all_files=not self.cfg.get('cache', False))
+
+    def _get_backend(self, path: Optional[str] = None) -> KVBackend:
+        if path is None or path == self.root:
+            return self.backend
+        return get_backend(self.backend_name, path)
+
+    def _after_write(self, backend: KVBackend) -> None:
+        if self.max_size > 0:
+            backend.evict(self.max_size)
 
     def call(self, params: Union[str, dict], **kwargs) -> str:
         params = self._verify_json_format_args(params)
@@ -69,48 +579,90 @@ class Storage(BaseTool):
             return self.scan(key)
 
     def put(self, key: str, value: str, path: Optional[str] = None) -> str:
-        path = path or self.root
-
-        # one file for one key value pair
-        path = os.path.join(path, key)
-
-        path_dir = path[:path.rfind('/') + 1]
-        if path_dir:
-            os.makedirs(path_dir, exist_ok=True)
-
-        save_text_to_file(path, value)
+        backend = self._get_backend(path)
+        backend.put(key, value.encode('utf-8'), compress=self.compress)
+        self._after_write(backend)
         return f'Successfully saved {key}.'
 
     def get(self, key: str, path: Optional[str] = None) -> str:
-        path = path or self.root
-        if not os.path.exists(os.path.join(path, key)):
-            raise KeyNotExistsError(f'Get Failed: {key} does not exist')
-        return read_text_from_file(os.path.join(path, key))
+        return _decode_text(self._get_backend(path).get(key))
 
     def delete(self, key, path: Optional[str] = None) -> str:
-        path = path or self.root
-        path = os.path.join(path, key)
-        if os.path.exists(path):
-            os.remove(path)
+        if self._get_backend(path).delete(key):
             return f'Successfully deleted {key}'
         else:
             return f'Delete Failed: {key} does not exist'
 
     def scan(self, key: str, path: Optional[str] = None) -> str:
-        path = path or self.root
-        path = os.path.join(path, key)
-        if os.path.exists(path):
-            if not os.path.isdir(path):
+        backend = self._get_backend(path)
+        folder = key.strip('/')
+        prefix = f'{folder}/' if folder else ''
+        keys = backend.scan_keys(prefix)
+        if not keys and folder:
+            if folder in backend.scan_keys(folder):
                 return 'Scan Failed: The scan operation requires passing in a folder path as the key.'
-            # All key-value pairs
-            kvs = {}
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    k = os.path.join(root, file)[len(path):]
-                    if not k.startswith('/'):
-                        k = '/' + k
-                    v = read_text_from_file(os.path.join(root, file))
-                    kvs[k] = v
-            return '\n'.join([f'{k}: {v}' for k, v in kvs.items()])
-        else:
             return f'Scan Failed: {key} does not exist.'
+        # All key-value pairs, with keys relative to the folder
+        return '\n'.join([f'/{k[len(prefix):]}: {_decode_text(v)}' for k, v in backend.scan(prefix)])
+
+    def scan_keys(self, prefix: str = '', path: Optional[str] = None) -> List[str]:
+        """The keys starting with prefix, without reading the values."""
+        return self._get_backend(path).scan_keys(prefix)
+
+    def put_many(self, kvs: Dict[str, str], path: Optional[str] = None) -> str:
+        """Save several key value pairs in one transaction."""
+        backend = self._get_backend(path)
+        backend.put_many({key: value.encode('utf-8') for key, value in kvs.items()}, compress=self.compress)
+        self._after_write(backend)
+        return f'Successfully saved {len(kvs)} keys.'
+
+    def get_many(self, keys: List[str], path: Optional[str] = None) -> Dict[str, str]:
+        """Load several keys at once, the missing keys are left out of the result."""
+        return {key: _decode_text(value) for key, value in self._get_backend(path).get_many(keys).items()}
+
+    def delete_many(self, keys: List[str], path: Optional[str] = None) -> int:
+        return self._get_backend(path).delete_many(keys)
+
+    def put_json(self, key: str, value, path: Optional[str] = None) -> str:
+        """Save a json value compactly (zlib-compressed, without indentation)."""
+        backend = self._get_backend(path)
+        data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        backend.put(key, zlib.compress(data))
+        self._after_write(backend)
+        return f'Successfully saved {key}.'
+
+    def get_json(self, key: str, path: Optional[str] = None):
+        """Load a value saved by `put_json`, and mark it as recently used for eviction."""
+        backend = self._get_backend(path)
+        data = backend.get(key)
+        backend.touch(key)
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            # Saved as plain json before put_json compressed its values
+            pass
+        return json.loads(data.decode('utf-8'))
+
+    def evict(self, max_size: Optional[int] = None, path: Optional[str] = None) -> int:
+        """Delete the least recently used keys until the values fit in max_size bytes."""
+        return self._get_backend(path).evict(self.max_size if max_size is None else max_size)
+
+    @contextmanager
+    def lock(self, key: str):
+        """Hold an exclusive lock on key, across threads and (where fcntl is available) processes.
+
+        Used for single-flight: the first caller computes and saves the value, the others wait and then read it.
+        """
+        lock_path = os.path.join(self.root, LOCK_DIR, hash_sha256(key))
+        with _THREAD_LOCKS_GUARD:
+            thread_lock = _THREAD_LOCKS.setdefault(lock_path, threading.Lock())
+        with thread_lock:
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            with open(lock_path, 'a') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,104 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+import sys
+import threading
+from typing import Callable, Dict, Tuple
+
+
+class LazyRegistry(dict):
+    """A name -> class registry whose built-in entries are imported on first lookup.
+
+    `lazy_entries` maps a registered name to the module that registers it (through a decorator that writes
+    into this registry). Membership tests, lookups and listing behave as if every built-in entry had been
+    imported, but a module is only imported when one of its names is actually used.
+    """
+
+    def __init__(self, lazy_entries: Dict[str, str]):
+        super().__init__()
+        self._lazy = dict(lazy_entries)
+        self._lock = threading.RLock()
+
+    def _resolve(self, name) -> None:
+        if dict.__contains__(self, name):
+            return
+        # Other threads wait here until the module registering `name` has finished importing. A name that is
+        # looked up again while its own module is being imported (e.g. the duplicate check of the register
+        # decorator) is already popped and resolves to "not registered yet".
+        with self._lock:
+            module = self._lazy.pop(name, None)
+            if module is None:
+                return
+            try:
+                importlib.import_module(module)
+            except BaseException:
+                self._lazy[name] = module
+                raise
+
+    def _resolve_all(self) -> None:
+        for name in list(self._lazy):
+            self._resolve(name)
+
+    def __contains__(self, name) -> bool:
+        self._resolve(name)
+        return dict.__contains__(self, name)
+
+    def __getitem__(self, name):
+        self._resolve(name)
+        return dict.__getitem__(self, name)
+
+    def get(self, name, default=None):
+        self._resolve(name)
+        return dict.get(self, name, default)
+
+    def keys(self):
+        return list(dict.fromkeys([*dict.keys(self), *self._lazy]))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def values(self):
+        self._resolve_all()
+        return dict.values(self)
+
+    def items(self):
+        self._resolve_all()
+        return dict.items(self)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.keys()})'
+
+
+def lazy_attrs(package: str, attrs: Dict[str, Tuple[str, str]]) -> Callable[[str], object]:
+    """Builds a module-level `__getattr__` (PEP 562) that imports public names of a package on first access.
+
+    Args:
+        package: `__name__` of the package.
+        attrs: Maps a public name to (module, attribute); relative modules are resolved against `package`.
+    """
+
+    def __getattr__(name: str):
+        if name not in attrs:
+            raise AttributeError(f'module {package!r} has no attribute {name!r}')
+        module, attr = attrs[name]
+        value = getattr(importlib.import_module(module, package), attr)
+        # Cache on the package so the next access is a plain attribute lookup
+        setattr(sys.modules[package], name, value)
+        return value
+
+    return __getattr__
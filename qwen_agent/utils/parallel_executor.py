@@ -13,9 +13,10 @@
 # limitations under the License.
 
 import random
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 
 
 def parallel_exec(
@@ -54,6 +55,66 @@ def parallel_exec(
     return results
 
 
+class TokenBucket:
+    """A thread-safe token bucket: `acquire` blocks until a request is allowed under `rate` requests per second."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parallel_exec_ordered(
+    fn: Callable,
+    list_of_kwargs: List[dict],
+    max_workers: int = 8,
+    rate_limit: float = 0.0,
+) -> Iterator[Tuple[int, Any, Optional[Exception]]]:
+    """
+    Executes `fn` on a bounded thread pool, and yields the results in the order of `list_of_kwargs`,
+    each as soon as it and all the earlier ones are done.
+
+    Args:
+    - fn (Callable): The function to execute in parallel.
+    - list_of_kwargs (list): A list of dicts, where each dict contains arguments for a single call to `fn`.
+    - max_workers (int): The maximum number of calls running at the same time.
+    - rate_limit (float): The maximum number of calls started per second, 0 for no limit. Unlike a fixed sleep
+      between submissions, the limit is applied by the workers and does not delay the submission of other jobs.
+
+    Yields:
+    - (index, result, exception): the exception raised by the call is returned instead of raised, so that the
+      caller can retry only the failed calls.
+    """
+    bucket = TokenBucket(rate_limit) if rate_limit > 0 else None
+
+    def _call(kwargs: dict):
+        if bucket is not None:
+            bucket.acquire()
+        return fn(**kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_call, kwargs) for kwargs in list_of_kwargs]
+        for index, future in enumerate(futures):
+            try:
+                yield index, future.result(), None
+            except Exception as ex:
+                yield index, None, ex
+
+
 # for debug
 def serial_exec(fn: Callable, list_of_kwargs: List[dict]) -> List[Any]:
     results = []
@@ -0,0 +1,92 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#    http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, NamedTuple, Optional, Sequence
+
+# The smoothing constant of reciprocal rank fusion, rank r of a retriever contributes weight / (k + r)
+RRF_K = 60
+
+
+class FusionResult(NamedTuple):
+    """The fused ranking, best first.
+
+    Attributes:
+        ids: The fused ids, an int64 array of shape (n,).
+        scores: The fused score of each id, a float64 array of shape (n,).
+        retriever_scores: The weighted reciprocal rank each retriever gave to each id (0 if it did not
+            retrieve the id), a float64 array of shape (number of retrievers, n). It sums to `scores`.
+    """
+    ids: Any
+    scores: Any
+    retriever_scores: Any
+
+
+def rrf_fuse(ranked_ids: Sequence[Sequence[int]],
+             weights: Optional[Sequence[float]] = None,
+             k: int = RRF_K,
+             top_k: Optional[int] = None) -> FusionResult:
+    """Reciprocal rank fusion of the rankings of several retrievers.
+
+    The score of an id is sum_i weights[i] / (k + rank_i(id)), with ranks starting from 1. The ids are
+    compacted with np.unique, the reciprocal ranks are scatter-added into a (retrievers, ids) matrix, and only
+    the top_k ids are selected with a partition before being sorted. Ties are broken by the first
+    appearance of the id, in the order of ranked_ids.
+
+    Args:
+        ranked_ids: One ranking of non-negative integer ids per retriever, most relevant first.
+        weights: The weight of each retriever, 1.0 for all by default.
+        k: The smoothing constant.
+        top_k: Only return the best top_k ids, all ids by default.
+
+    Returns:
+        The fused ids with their fused and per-retriever scores.
+    """
+    import numpy as np
+
+    if weights is None:
+        weights = [1.0] * len(ranked_ids)
+    if len(weights) != len(ranked_ids):
+        raise ValueError(f'Got {len(weights)} weights for {len(ranked_ids)} rankings')
+
+    rankings = [np.asarray(ids, dtype=np.int64).reshape(-1) for ids in ranked_ids]
+    if not rankings or sum(len(ids) for ids in rankings) == 0:
+        empty = np.zeros(0, dtype=np.float64)
+        return FusionResult(np.zeros(0, dtype=np.int64), empty, np.zeros((len(rankings), 0), dtype=np.float64))
+
+    all_ids = np.concatenate(rankings)
+    retriever = np.repeat(np.arange(len(rankings)), [len(ids) for ids in rankings])
+    contribution = np.concatenate([
+        w / (k + np.arange(1, len(ids) + 1, dtype=np.float64)) for w, ids in zip(weights, rankings)
+    ])
+
+    unique_ids, first_seen, inverse = np.unique(all_ids, return_index=True, return_inverse=True)
+    retriever_scores = np.zeros((len(rankings), len(unique_ids)), dtype=np.float64)
+    # add.at also accumulates an id repeated within one ranking
+    np.add.at(retriever_scores, (retriever, inverse.reshape(-1)), contribution)
+    scores = retriever_scores.sum(axis=0)
+
+    candidates = np.arange(len(unique_ids))
+    if top_k is not None and top_k < len(unique_ids):
+        if top_k <= 0:
+            candidates = candidates[:0]
+        else:
+            # The k-th best score, ids tied with it at the boundary are taken by first appearance
+            threshold = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+            better = np.flatnonzero(scores > threshold)
+            tied = np.flatnonzero(scores == threshold)
+            tied = tied[np.argsort(first_seen[tied], kind='stable')][:top_k - len(better)]
+            candidates = np.concatenate([better, tied])
+    # Sort by score descending, then by first appearance
+    order = candidates[np.lexsort((first_seen[candidates], -scores[candidates]))]
+    return FusionResult(unique_ids[order], scores[order], retriever_scores[:, order])
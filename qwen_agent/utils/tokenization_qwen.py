@@ -15,11 +15,12 @@
 """Tokenization classes for QWen."""
 
 import base64
+import hashlib
+import threading
 import unicodedata
+from collections import OrderedDict
 from pathlib import Path
-from typing import Collection, Dict, List, Set, Union
-
-import tiktoken
+from typing import Collection, Dict, List, Optional, Set, Union
 
 from qwen_agent.log import logger
 
@@ -44,6 +45,12 @@ SPECIAL_TOKENS = tuple(enumerate(
     start=SPECIAL_START_ID,
 ))
 SPECIAL_TOKENS_SET = set(t for i, t in SPECIAL_TOKENS)
+# all special tokens start with this prefix, texts without it can skip special token matching
+SPECIAL_TOKEN_PREFIX = '<|'
+
+# texts shorter than this are cheaper to count than to hash, so they bypass the cache
+TOKEN_COUNT_CACHE_MIN_CHARS = 256
+TOKEN_COUNT_CACHE_SIZE = 4096
 
 
 def _load_tiktoken_bpe(tiktoken_bpe_file: str) -> Dict[bytes, int]:
@@ -64,6 +71,7 @@ class QWenTokenizer:
         vocab_file=None,
         errors='replace',
         extra_vocab_file=None,
+        count_cache_size: int = TOKEN_COUNT_CACHE_SIZE,
     ):
         if not vocab_file:
             vocab_file = VOCAB_FILES_NAMES['vocab_file']
@@ -90,6 +98,7 @@ class QWenTokenizer:
                 self.mergeable_ranks[token] = index
             # the index may be sparse after this, but don't worry tiktoken.Encoding will handle this
 
+        import tiktoken
         enc = tiktoken.Encoding(
             'Qwen',
             pat_str=PAT_STR,
@@ -109,15 +118,25 @@ class QWenTokenizer:
         self.im_start_id = self.special_tokens[IMSTART]
         self.im_end_id = self.special_tokens[IMEND]
 
+        # bounded LRU of token counts, keyed by the digest of the text instead of the text itself
+        self.count_cache_size = count_cache_size
+        self._count_cache = OrderedDict()  # type: OrderedDict[bytes, int]
+        self._count_cache_lock = threading.Lock()
+
     def __getstate__(self):
         # for pickle lovers
         state = self.__dict__.copy()
         del state['tokenizer']
+        del state['_count_cache']
+        del state['_count_cache_lock']
         return state
 
     def __setstate__(self, state):
         # tokenizer is not python native; don't pass it; rebuild it
         self.__dict__.update(state)
+        self._count_cache = OrderedDict()
+        self._count_cache_lock = threading.Lock()
+        import tiktoken
         enc = tiktoken.Encoding(
             'Qwen',
             pat_str=PAT_STR,
@@ -168,33 +187,34 @@ class QWenTokenizer:
         Returns:
             `List[bytes|str]`: The list of tokens.
         """
-        tokens = []
         text = unicodedata.normalize('NFC', text)
 
         # this implementation takes a detour: text -> token id -> token surface forms
-        for t in self.tokenizer.encode(text, allowed_special=allowed_special, disallowed_special=disallowed_special):
-            tokens.append(self.decoder[t])
-        return tokens
+        decoder = self.decoder
+        return [
+            decoder[t]
+            for t in self.tokenizer.encode(text, allowed_special=allowed_special, disallowed_special=disallowed_special)
+        ]
 
     def convert_tokens_to_string(self, tokens: List[Union[bytes, str]]) -> str:
         """
         Converts a sequence of tokens in a single string.
         """
-        text = ''
-        temp = b''
+        parts = []
+        temp = []
         for t in tokens:
             if isinstance(t, str):
                 if temp:
-                    text += temp.decode('utf-8', errors=self.errors)
-                    temp = b''
-                text += t
+                    parts.append(b''.join(temp).decode('utf-8', errors=self.errors))
+                    temp = []
+                parts.append(t)
             elif isinstance(t, bytes):
-                temp += t
+                temp.append(t)
             else:
                 raise TypeError('token should only be of type types or str')
         if temp:
-            text += temp.decode('utf-8', errors=self.errors)
-        return text
+            parts.append(b''.join(temp).decode('utf-8', errors=self.errors))
+        return ''.join(parts)
 
     @property
     def vocab_size(self):
@@ -213,34 +233,116 @@ class QWenTokenizer:
         return self.tokenizer.decode(token_ids, errors=errors or self.errors)
 
     def encode(self, text: str) -> List[int]:
-        return self.convert_tokens_to_ids(self.tokenize(text))
+        """Encodes a text to token ids, with the same special token handling as `tokenize`."""
+        text = unicodedata.normalize('NFC', text)
+        if SPECIAL_TOKEN_PREFIX not in text:
+            return self.tokenizer.encode_ordinary(text)
+        return self.tokenizer.encode(text, allowed_special='all', disallowed_special=())
+
+    def encode_batch(self, texts: List[str], num_threads: int = 8) -> List[List[int]]:
+        """Encodes many texts at once on tiktoken's thread pool."""
+        texts = [unicodedata.normalize('NFC', text) for text in texts]
+        return self.tokenizer.encode_batch(texts, num_threads=num_threads, allowed_special='all', disallowed_special=())
+
+    def decode_ids(self, token_ids: List[int]) -> str:
+        """Decodes token ids to a string in one pass, equivalent to `convert_tokens_to_string` on their tokens."""
+        return self.tokenizer.decode_bytes(token_ids).decode('utf-8', errors=self.errors)
+
+    def _count_cache_key(self, text: str) -> Optional[bytes]:
+        if self.count_cache_size <= 0 or len(text) < TOKEN_COUNT_CACHE_MIN_CHARS:
+            return None
+        return hashlib.blake2b(text.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+
+    def _count_cache_get(self, key: Optional[bytes]) -> Optional[int]:
+        if key is None:
+            return None
+        with self._count_cache_lock:
+            num = self._count_cache.get(key)
+            if num is not None:
+                self._count_cache.move_to_end(key)
+            return num
+
+    def _count_cache_put(self, key: Optional[bytes], num: int):
+        if key is None:
+            return
+        with self._count_cache_lock:
+            self._count_cache[key] = num
+            self._count_cache.move_to_end(key)
+            while len(self._count_cache) > self.count_cache_size:
+                self._count_cache.popitem(last=False)
 
     def count_tokens(self, text: str) -> int:
-        return len(self.tokenize(text))
+        key = self._count_cache_key(text)
+        num = self._count_cache_get(key)
+        if num is None:
+            num = len(self.encode(text))
+            self._count_cache_put(key, num)
+        return num
+
+    def count_tokens_batch(self, texts: List[str], num_threads: int = 8) -> List[int]:
+        """Counts tokens of many texts, only the cache misses are encoded (in one batch)."""
+        keys = [self._count_cache_key(text) for text in texts]
+        nums = [self._count_cache_get(key) for key in keys]
+        missed = [i for i, num in enumerate(nums) if num is None]
+        if missed:
+            encoded = self.encode_batch([texts[i] for i in missed], num_threads=num_threads)
+            for i, ids in zip(missed, encoded):
+                nums[i] = len(ids)
+                self._count_cache_put(keys[i], nums[i])
+        return nums
 
     def truncate(self, text: str, max_token: int, start_token: int = 0, keep_both_sides: bool = False) -> str:
-        token_list = self.tokenize(text)[start_token:]
-        if len(token_list) <= max_token:
-            return self.convert_tokens_to_string(token_list)
+        token_ids = self.encode(text)[start_token:]
+        if len(token_ids) <= max_token:
+            if start_token == 0:
+                # decoding the full ids gives back the normalized text, skip the round trip
+                return unicodedata.normalize('NFC', text)
+            return self.decode_ids(token_ids)
 
         if keep_both_sides:
-            ellipsis_tokens = self.tokenize("...")
-            ellipsis_len = len(ellipsis_tokens)
-            available = max_token - ellipsis_len
+            ellipsis_ids = self.encode('...')
+            available = max_token - len(ellipsis_ids)
             if available <= 0: # Degenerate case: not enough space even for "..."
-                return self.convert_tokens_to_string(token_list[:max_token])
+                return self.decode_ids(token_ids[:max_token])
 
             left_len = available // 2
             right_len = available - left_len
-            token_list = token_list[:left_len] + ellipsis_tokens + token_list[-right_len:]
+            token_ids = token_ids[:left_len] + ellipsis_ids + token_ids[-right_len:]
         else:
-            token_list = token_list[:max_token]
+            token_ids = token_ids[:max_token]
 
-        return self.convert_tokens_to_string(token_list)
+        return self.decode_ids(token_ids)
 
 
-tokenizer = QWenTokenizer(Path(__file__).resolve().parent / 'qwen.tiktoken')
+class _LazyTokenizer:
+    """Builds the default tokenizer on first use, so that importing modules which reference it does not load
+    the tiktoken vocabulary."""
+
+    def __init__(self, vocab_file):
+        self._vocab_file = vocab_file
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def _get(self) -> QWenTokenizer:
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = QWenTokenizer(self._vocab_file)
+        return self._tokenizer
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __len__(self) -> int:
+        return len(self._get())
+
+
+tokenizer = _LazyTokenizer(Path(__file__).resolve().parent / 'qwen.tiktoken')
 
 
 def count_tokens(text: str) -> int:
     return tokenizer.count_tokens(text)
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    return tokenizer.count_tokens_batch(texts)
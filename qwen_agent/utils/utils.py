@@ -22,6 +22,7 @@ import shutil
 import signal
 import socket
 import sys
+import threading
 import time
 import traceback
 import urllib.parse
@@ -29,7 +30,6 @@ from io import BytesIO
 from typing import Any, List, Literal, Optional, Tuple, Union
 
 import json5
-import requests
 from pydantic import BaseModel
 
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, FUNCTION, SYSTEM, USER, ContentItem, Message
@@ -81,6 +81,30 @@ def hash_sha256(text: str) -> str:
     return key
 
 
+# path -> (size, mtime_ns, sha256), so unchanged files are not read again
+_FILE_DIGESTS = {}
+_FILE_DIGESTS_LOCK = threading.Lock()
+
+
+def hash_file_sha256(path: str) -> str:
+    """The sha256 of the file content, reusing the last result while the size and mtime are unchanged."""
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    with _FILE_DIGESTS_LOCK:
+        cached = _FILE_DIGESTS.get(abs_path)
+    if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    hash_object = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hash_object.update(block)
+    key = hash_object.hexdigest()
+    with _FILE_DIGESTS_LOCK:
+        _FILE_DIGESTS[abs_path] = (stat.st_size, stat.st_mtime_ns, key)
+    return key
+
+
 def print_traceback(is_error: bool = True):
     tb = ''.join(traceback.format_exception(*sys.exc_info(), limit=3))
     if is_error:
@@ -191,6 +215,7 @@ def save_url_to_local_work_dir(url: str, save_dir: str, save_filename: str = '')
         url = sanitize_chrome_file_path(url)
         shutil.copy(url, new_path)
     else:
+        import requests
         headers = {
             'User-Agent':
                 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
@@ -229,6 +254,7 @@ def contains_html_tags(text: str) -> bool:
 
 
 def get_content_type_by_head_request(path: str) -> str:
+    import requests
     try:
         response = requests.head(path, timeout=5)
         content_type = response.headers.get('Content-Type', '')
@@ -1,8 +1,10 @@
 import os
+from app.profiling import run_main
 from app.mul_mcp.mulmcp import MulMCP
 from config import PROJECT_DIR, LLMConfig, prompt_zh, prompt_en
 
-if __name__ == '__main__':
+
+def main():
     mul_engine = MulMCP()
     model_name = 'Qwen3-32B'
 
@@ -84,4 +86,9 @@ if __name__ == '__main__':
             rag_type='HIRAG',
             topk=3,
             prompt=prompt_en
-        )
\ No newline at end of file
+        )
+
+
+if __name__ == '__main__':
+    # --profile: 采样剖析，报告写到 data/profile/ 下
+    run_main('run_mul_HI_rag', main)
@@ -1,8 +1,10 @@
 import os
+from app.profiling import run_main
 from app.sig_mcp.sigmcp import SigMCP
 from config import PROJECT_DIR,LLMConfig,prompt_zh,prompt_en
 
-if __name__ == '__main__':
+
+def main():
     sig_engine=SigMCP()
     model_name='Qwen3-32B'
 
@@ -40,15 +42,8 @@ if __name__ == '__main__':
         save_path=os.path.join(PROJECT_DIR,'data','infer','chatgpt','sig_mcp_HIRAG.json')
 
         sig_engine.signal_infer(save_path,llm_set=LLMConfig.LLM_SET_chatgpt,rag_type='HIRAG',prompt=prompt_en)
-    
-
-
-
-
-
-
-
-
-
 
 
+if __name__ == '__main__':
+    # --profile: 采样剖析，报告写到 data/profile/ 下
+    run_main('run_sig_HI_rag', main)
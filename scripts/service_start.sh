@@ -1,5 +1,15 @@
 #!/bin/bash
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+LOG_DIR="${SCRIPT_DIR}/../data/service_info/logs"
+mkdir -p "${LOG_DIR}"
 
-python3 "${SCRIPT_DIR}/../service.py" start
\ No newline at end of file
+# 停止旧的监控进程和服务
+python3 "${SCRIPT_DIR}/../service.py" stop
+
+# 后台监控进程: 并行启动所有服务、就绪探测、崩溃后退避重启
+# 传入 --workers N 时由 N 个 mcp_host.py 进程合并承载全部服务
+nohup python3 "${SCRIPT_DIR}/../service.py" supervise "$@" > "${LOG_DIR}/supervisor.log" 2>&1 &
+
+# 等待首轮就绪探测完成
+python3 "${SCRIPT_DIR}/../service.py" wait
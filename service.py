@@ -1,11 +1,33 @@
 import os
 import subprocess
 import signal
-import re
+import socket
 import sys
 import json
 import time
-from config import SERVICE_DIR, SERVICE_INFO
+import hashlib
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from config import PROJECT_DIR, SERVICE_DIR, SERVICE_INFO
+from app.service_registry import load_service_catalog, read_registry, write_registry
+
+# 单个服务从启动到就绪的截止时间(秒)
+READY_TIMEOUT = float(os.environ.get('SERVICE_READY_TIMEOUT', 60))
+# 就绪探测的间隔(秒)
+PROBE_INTERVAL = 0.2
+# 崩溃重启的退避: 1s, 2s, 4s ... 最长 60s，最多重启 5 次
+RESTART_BACKOFF_BASE = 1
+RESTART_BACKOFF_MAX = 60
+MAX_RESTARTS = 5
+# 监控进程的 pid 文件
+SUPERVISOR_PID = os.path.join(os.path.dirname(SERVICE_INFO), 'supervisor.pid')
+# 停止时等待监控进程退出的最长时间(秒)，正在进行的重启会在下一次就绪探测时放弃
+SUPERVISOR_STOP_TIMEOUT = 30
+# 合并承载多个服务的进程入口
+HOST_SCRIPT = os.path.join(PROJECT_DIR, 'mcp_host.py')
+
 
 def get_conda_python():
     """
@@ -17,34 +39,219 @@ def get_conda_python():
         python_path = os.path.join(conda_prefix, 'bin', 'python')
         if os.path.exists(python_path):
             return python_path
-    
+
     # 如果没有找到，返回当前的 Python
     return sys.executable
 
 
-def extract_port_from_runpy(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+def probe_tcp(port, timeout=0.5):
+    """
+    检查端口是否已开始监听
+    """
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _iter_sse_events(response):
+    """
+    逐个解析 SSE 事件，返回 (event, data)
+    """
+    event, data = 'message', []
+    while True:
+        line = response.readline()
+        if not line:
+            raise ConnectionError('SSE 连接已关闭')
+        line = line.decode('utf-8').rstrip('\r\n')
+        if not line:
+            if data:
+                yield event, '\n'.join(data)
+            event, data = 'message', []
+        elif line.startswith(':'):
+            continue
+        elif line.startswith('event:'):
+            event = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            data.append(line[len('data:'):].strip())
+
+
+def _post_jsonrpc(endpoint, message, timeout):
+    url = urllib.parse.urlsplit(endpoint)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+    try:
+        path = url.path + (f'?{url.query}' if url.query else '')
+        conn.request('POST', path, body=json.dumps(message), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        if response.status >= 300:
+            raise RuntimeError(f"{message['method']} 返回 HTTP {response.status}")
+    finally:
+        conn.close()
+
+
+def _wait_jsonrpc_result(events, request_id):
+    for event, data in events:
+        if event != 'message':
+            continue
+        message = json.loads(data)
+        if message.get('id') != request_id:
+            continue
+        if 'error' in message:
+            raise RuntimeError(f"MCP 错误: {message['error']}")
+        return message.get('result', {})
+
+
+def probe_mcp_sse(port, timeout=5):
+    """
+    通过 SSE 完成一次 MCP initialize + tools/list 握手，确认服务真正可用
+    :return: 服务暴露的工具列表
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', '/sse', headers={'Accept': 'text/event-stream'})
+        response = conn.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f'GET /sse 返回 HTTP {response.status}')
+        events = _iter_sse_events(response)
+        event, data = next(events)
+        if event != 'endpoint':
+            raise RuntimeError(f'未收到 endpoint 事件: {event}')
+        endpoint = urllib.parse.urljoin(f'http://127.0.0.1:{port}/sse', data)
+
+        _post_jsonrpc(endpoint, {
+            'jsonrpc': '2.0',
+            'id': 1,
+            'method': 'initialize',
+            'params': {
+                'protocolVersion': '2024-11-05',
+                'capabilities': {},
+                'clientInfo': {'name': 'service-supervisor', 'version': '1.0.0'}
+            }
+        }, timeout)
+        _wait_jsonrpc_result(events, 1)
+        _post_jsonrpc(endpoint, {'jsonrpc': '2.0', 'method': 'notifications/initialized'}, timeout)
+        _post_jsonrpc(endpoint, {'jsonrpc': '2.0', 'id': 2, 'method': 'tools/list', 'params': {}}, timeout)
+        return _wait_jsonrpc_result(events, 2).get('tools', [])
+    finally:
+        conn.close()
+
+
+def tools_hash(tools):
+    """
+    工具名称和参数 schema 的摘要，用于发现服务的工具发生了变化
+    """
+    payload = sorted(({'name': t.get('name'), 'inputSchema': t.get('inputSchema')} for t in tools),
+                     key=lambda t: t['name'] or '')
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def wait_until_ready(proc, port, timeout=READY_TIMEOUT, stop_event=None):
+    """
+    等待服务就绪：进程存活、端口可连接、并且 MCP 握手成功
+    :param stop_event: 设置后立即放弃等待
+    :return: (status, tools_hash, tool_count, error)
+    """
+    deadline = time.time() + timeout
+    last_error = '端口未监听'
+    while time.time() < deadline:
+        if stop_event is not None and stop_event.is_set():
+            return 'failed', None, 0, '监控进程正在退出'
+        if proc.poll() is not None:
+            return 'failed', None, 0, f'进程已退出 (exit code {proc.returncode})'
+        if probe_tcp(port):
+            try:
+                tools = probe_mcp_sse(port, timeout=max(0.5, min(5, deadline - time.time())))
+                return 'ready', tools_hash(tools), len(tools), None
+            except Exception as e:
+                last_error = str(e)
+        time.sleep(PROBE_INTERVAL)
+    return 'failed', None, 0, f'{timeout:.0f}s 内未就绪: {last_error}'
+
 
-    match = re.search(r'mcp\.run\([^)]*port\s*=\s*(\d+)', content)
-    if match:
-        return int(match.group(1))
+def spawn_process(args, cwd, log_file, env, mode='w'):
+    """
+    启动单个进程，输出写入日志文件
+    """
+    with open(log_file, mode) as log_f:
+        # 写入启动信息到日志
+        log_f.write(f"启动命令: {' '.join(args)}\n")
+        log_f.write(f"工作目录: {cwd}\n")
+        log_f.write(f"Python 路径: {args[0]}\n")
+        log_f.write(f"CONDA_PREFIX: {env.get('CONDA_PREFIX', 'N/A')}\n")
+        log_f.write(f"环境: {env.get('CONDA_DEFAULT_ENV', 'N/A')}\n")
+        log_f.write("=" * 60 + "\n")
+        log_f.flush()
+
+        return subprocess.Popen(
+            args,
+            cwd=cwd,
+            stdout=log_f,
+            stderr=subprocess.STDOUT,
+            env=env,
+            start_new_session=True
+        )
+
+
+def build_workers(service_paths, python_executable, log_dir, workers=0):
+    """
+    把服务分配到进程上
+    :param service_paths: {service_name: run_path}
+    :param workers: 0 表示每个服务一个独立进程；N>0 表示所有服务由 N 个 mcp_host.py 进程承载
+    :return: {worker_name: {'args', 'cwd', 'log', 'services', 'proc', 'restarts'}}
+    """
+    units = {}
+    if workers <= 0:
+        for service_name, run_path in service_paths.items():
+            units[service_name] = {
+                'args': [python_executable, "-u", run_path],
+                'cwd': os.path.dirname(run_path),
+                'log': os.path.join(log_dir, f"{service_name}.log"),
+                'services': [service_name]
+            }
     else:
-        return None
+        names = list(service_paths)
+        for i in range(min(workers, len(names))):
+            worker_name = f"mcp_host_{i}"
+            units[worker_name] = {
+                'args': [python_executable, "-u", HOST_SCRIPT] + names[i::workers],
+                'cwd': PROJECT_DIR,
+                'log': os.path.join(log_dir, f"{worker_name}.log"),
+                'services': names[i::workers]
+            }
+    for unit in units.values():
+        unit.update({'proc': None, 'restarts': 0})
+    return units
+
+
+def _print_log_tail(log_file):
+    if log_file and os.path.exists(log_file):
+        try:
+            with open(log_file, 'r') as f:
+                lines = f.readlines()
+                if lines:
+                    print(f"     最后几行日志:")
+                    for line in lines[-3:]:
+                        print(f"       {line.strip()}")
+        except:
+            pass
 
 
-def service_run():
+def service_run(workers=0):
     """
-    遍历 data 目录下的所有子目录，查找并运行其中的 run.py 文件。
+    遍历服务目录，并行启动所有服务，并等待每个服务通过就绪探测。
+    :param workers: 0 表示每个服务一个进程；N>0 表示由 N 个 mcp_host.py 进程合并承载所有服务
+    :return: (units, services_info)
     """
     # 获取正确的 Python 解释器
     python_executable = get_conda_python()
-    
+
     print("正在启动服务...")
     print(f"使用 Python: {python_executable}")
     print(f"当前环境: {os.environ.get('CONDA_DEFAULT_ENV', 'N/A')}")
     print(f"CONDA_PREFIX: {os.environ.get('CONDA_PREFIX', 'N/A')}")
-    
+
     # 验证 Python 环境
     try:
         result = subprocess.run(
@@ -59,154 +266,282 @@ def service_run():
             print(f"  错误: {result.stderr}")
     except Exception as e:
         print(f"✗ 警告: 无法验证环境 - {e}")
-    
+
     print()
-    
+
     root_dir = SERVICE_DIR
-    
+    catalog = load_service_catalog()
+
     # 先检查是否有正在运行的服务
     if os.path.exists(SERVICE_INFO):
         print("检测到已有服务信息文件，先停止旧服务...")
         service_stop()
         print()
-    
+
     # 创建日志目录
     log_dir = os.path.join(os.path.dirname(SERVICE_INFO), 'logs')
     os.makedirs(log_dir, exist_ok=True)
-    
-    # 存储服务信息的字典
-    services_info = {}
-    started_count = 0
-    
-    # 获取当前完整环境
-    env = os.environ.copy()
-    
+
     # 遍历所有子目录
+    service_paths = {}
     for dirpath, dirnames, filenames in os.walk(root_dir):
         if "run.py" in filenames:
-            run_path = os.path.join(dirpath, "run.py")
             service_name = os.path.basename(dirpath)
-            
-            # 创建日志文件
-            log_file = os.path.join(log_dir, f"{service_name}.log")
-            
-            try:
-                with open(log_file, 'w') as log_f:
-                    # 写入启动信息到日志
-                    log_f.write(f"启动命令: {python_executable} {run_path}\n")
-                    log_f.write(f"工作目录: {os.path.dirname(run_path)}\n")
-                    log_f.write(f"Python 路径: {python_executable}\n")
-                    log_f.write(f"CONDA_PREFIX: {env.get('CONDA_PREFIX', 'N/A')}\n")
-                    log_f.write(f"环境: {env.get('CONDA_DEFAULT_ENV', 'N/A')}\n")
-                    log_f.write("=" * 60 + "\n")
-                    log_f.flush()
-                    
-                    proc = subprocess.Popen(
-                        [python_executable, "-u", run_path],
-                        cwd=os.path.dirname(run_path),
-                        stdout=log_f,
-                        stderr=subprocess.STDOUT,
-                        env=env,
-                        start_new_session=True
-                    )
-                
-                # 记录服务信息
-                services_info[service_name] = {
-                    'pid': proc.pid,
-                    'path': run_path,
-                    'log': log_file,
-                    'status': 'running'
-                }
-                
-                started_count += 1
-                print(f"  ✓ 启动服务: {service_name} (PID: {proc.pid})")
-            except Exception as e:
-                print(f"  ✗ 启动失败: {service_name} - {e}")
-    
-    # 等待服务启动
-    print("\n等待服务启动...")
-    time.sleep(3)
-    
-    # 验证哪些进程还在运行
+            if service_name not in catalog:
+                print(f"  ✗ 跳过服务: {service_name} (未在服务目录中登记端口)")
+                continue
+            service_paths[service_name] = os.path.join(dirpath, "run.py")
+
+    units = build_workers(service_paths, python_executable, log_dir, workers)
+
+    # 存储服务信息的字典
+    services_info = {}
+    for worker_name, unit in units.items():
+        for service_name in unit['services']:
+            services_info[service_name] = {
+                'name': service_name,
+                'port': catalog[service_name]['port'],
+                'pid': None,
+                'worker': worker_name,
+                'path': service_paths[service_name],
+                'log': unit['log'],
+                'tools_hash': None,
+                'tool_count': 0,
+                'restarts': 0,
+                'status': 'starting'
+            }
+
+    # 获取当前完整环境
+    env = os.environ.copy()
+
+    # 一次性启动全部进程，不等待前一个服务就绪
+    for worker_name, unit in units.items():
+        try:
+            unit['proc'] = spawn_process(unit['args'], unit['cwd'], unit['log'], env)
+            for service_name in unit['services']:
+                services_info[service_name]['pid'] = unit['proc'].pid
+            print(f"  ✓ 启动进程: {worker_name} (PID: {unit['proc'].pid}, 服务数: {len(unit['services'])})")
+        except Exception as e:
+            for service_name in unit['services']:
+                services_info[service_name].update({'status': 'failed', 'error': str(e)})
+            print(f"  ✗ 启动失败: {worker_name} - {e}")
+
+    # 先写入 starting 状态，读取方不会把还在导入依赖的服务当作可用
+    write_registry(services_info)
+
+    # 并行等待服务就绪，总耗时由最慢的服务决定
+    print("\n等待服务就绪...")
+    started = [(service_name, unit['proc']) for unit in units.values() if unit['proc'] is not None
+               for service_name in unit['services']]
+    with ThreadPoolExecutor(max_workers=max(1, len(started))) as executor:
+        futures = {
+            service_name: executor.submit(wait_until_ready, proc, services_info[service_name]['port'])
+            for service_name, proc in started
+        }
+        for service_name, future in futures.items():
+            status, digest, tool_count, error = future.result()
+            services_info[service_name].update({'status': status, 'tools_hash': digest, 'tool_count': tool_count})
+            if error:
+                services_info[service_name]['error'] = error
+
+    # 验证哪些服务已就绪
     print("\n验证服务状态...")
     running_count = 0
     failed_services = []
-    
-    for service_name, info in list(services_info.items()):
-        pid = info['pid']
-        log_file = info.get('log', '')
-        
-        try:
-            os.kill(pid, 0)
+
+    for service_name, info in services_info.items():
+        if info['status'] == 'ready':
             running_count += 1
-            
-            # 尝试获取端口
-            port = None
-            try:
-                port = extract_port_from_runpy(info['path'])
-            except:
-                pass
-            
-            port_info = f", Port: {port}" if port else ""
-            print(f"  ✓ {service_name} (PID: {pid}{port_info})")
-        except:
-            print(f"  ✗ {service_name} (PID: {pid}) 启动失败")
-            failed_services.append((service_name, log_file))
-            
-            # 显示日志的最后几行
-            if log_file and os.path.exists(log_file):
-                try:
-                    with open(log_file, 'r') as f:
-                        lines = f.readlines()
-                        if lines:
-                            print(f"     最后几行日志:")
-                            for line in lines[-3:]:
-                                print(f"       {line.strip()}")
-                except:
-                    pass
-            
-            del services_info[service_name]
-    
+            print(f"  ✓ {service_name} (PID: {info['pid']}, Port: {info['port']}, Tools: {info['tool_count']})")
+        else:
+            print(f"  ✗ {service_name} (PID: {info['pid']}) 启动失败: {info.get('error', '')}")
+            failed_services.append((service_name, info['log']))
+            _print_log_tail(info['log'])
+
+    # 没有任何服务就绪的进程不再保留，避免占用端口
+    for unit in units.values():
+        proc = unit['proc']
+        if proc is not None and proc.poll() is None and \
+                all(services_info[service_name]['status'] != 'ready' for service_name in unit['services']):
+            proc.kill()
+
     # 保存服务信息
     try:
-        os.makedirs(os.path.dirname(SERVICE_INFO), exist_ok=True)
-        
-        with open(SERVICE_INFO, 'w', encoding='utf-8') as f:
-            json.dump(services_info, f, indent=2, ensure_ascii=False)
-        
+        write_registry(services_info)
+
         print(f"\n✓ 服务信息已保存到: {SERVICE_INFO}")
-        print(f"✓ 成功启动 {running_count}/{started_count} 个服务")
-        
+        print(f"✓ 成功启动 {running_count}/{len(started)} 个服务")
+
         if failed_services:
             print(f"\n⚠ 失败的服务 ({len(failed_services)} 个):")
             for svc, log in failed_services[:5]:  # 只显示前5个
                 print(f"  - {svc}")
                 print(f"    日志: {log}")
-        
+
     except Exception as e:
         print(f"\n✗ 警告: 保存服务信息失败: {e}")
-    
+
     print(f"\n服务启动完成")
+    return units, services_info
+
+
+def service_supervise(workers=0):
+    """
+    启动所有服务并持续监控，崩溃的进程按指数退避重启，状态实时写回注册表。
+    使用 python service.py stop 停止监控进程和所有服务。
+    """
+    units, services_info = service_run(workers)
+    env = os.environ.copy()
+    lock = threading.Lock()
+    stop_event = threading.Event()
+    next_restart = {}
+    restarting = set()
+    crashed = set()
+
+    with open(SUPERVISOR_PID, 'w') as f:
+        f.write(str(os.getpid()))
+
+    def _on_signal(_sig_num, _frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+
+    def _restart(worker_name):
+        unit = units[worker_name]
+        # 正在停止时不再拉起新进程，否则它不在 stop 读到的注册表中，会成为孤儿进程
+        if stop_event.is_set():
+            return
+        try:
+            proc = spawn_process(unit['args'], unit['cwd'], unit['log'], env, mode='a')
+        except Exception as e:
+            proc = None
+            results = {service_name: ('failed', None, 0, str(e)) for service_name in unit['services']}
+        else:
+            # 同一进程内的服务并行探测，与 service_run 相同，重启最多等待一个 READY_TIMEOUT
+            with ThreadPoolExecutor(max_workers=len(unit['services'])) as probe_executor:
+                futures = {
+                    service_name: probe_executor.submit(wait_until_ready, proc, services_info[service_name]['port'],
+                                                        stop_event=stop_event)
+                    for service_name in unit['services']
+                }
+                results = {service_name: future.result() for service_name, future in futures.items()}
+            if proc.poll() is None and all(result[0] != 'ready' for result in results.values()):
+                proc.kill()
+        with lock:
+            # 停止过程中启动的进程由监控进程自己终止，也不再写注册表，避免 stop 删除后又被重新创建
+            if stop_event.is_set():
+                if proc is not None and proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+                return
+            unit['proc'] = proc
+            for service_name, (status, digest, tool_count, error) in results.items():
+                info = services_info[service_name]
+                if proc is not None:
+                    info['pid'] = proc.pid
+                if digest and info.get('tools_hash') not in (None, digest):
+                    print(f"  ⚠ {service_name} 的工具发生了变化 (tools_hash: {digest})")
+                info.update({'status': status, 'tools_hash': digest or info.get('tools_hash'),
+                             'tool_count': tool_count, 'restarts': unit['restarts'], 'error': error})
+            restarting.discard(worker_name)
+            crashed.discard(worker_name)
+            write_registry(services_info)
+        ready_count = sum(result[0] == 'ready' for result in results.values())
+        print(f"  {'✓' if ready_count else '✗'} 重启进程: {worker_name} ({ready_count}/{len(results)} 个服务就绪)")
+
+    print(f"\n监控进程已启动 (PID: {os.getpid()})")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        while not stop_event.wait(1):
+            now = time.time()
+            with lock:
+                changed = False
+                for worker_name, unit in units.items():
+                    if worker_name in restarting or unit['restarts'] >= MAX_RESTARTS:
+                        continue
+                    proc = unit['proc']
+                    if proc is not None and proc.poll() is None:
+                        continue
+                    if worker_name not in crashed:
+                        # 刚发现崩溃，安排退避重启
+                        crashed.add(worker_name)
+                        for service_name in unit['services']:
+                            services_info[service_name]['status'] = 'crashed'
+                        delay = min(RESTART_BACKOFF_BASE * 2 ** unit['restarts'], RESTART_BACKOFF_MAX)
+                        next_restart[worker_name] = now + delay
+                        changed = True
+                        exit_code = proc.returncode if proc is not None else None
+                        print(f"  ✗ 进程崩溃: {worker_name} (exit code {exit_code})，{delay}s 后重启")
+                    elif now >= next_restart[worker_name]:
+                        unit['restarts'] += 1
+                        for service_name in unit['services']:
+                            services_info[service_name]['status'] = 'starting'
+                        restarting.add(worker_name)
+                        changed = True
+                        executor.submit(_restart, worker_name)
+                if changed:
+                    write_registry(services_info)
+
+    try:
+        os.remove(SUPERVISOR_PID)
+    except OSError:
+        pass
+    print("监控进程已退出")
+
+
+def wait_pid_exit(pid, timeout):
+    """
+    等待进程退出
+    :return: 是否在 timeout 秒内退出
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(PROBE_INTERVAL)
+    return False
 
 
 def service_stop():
     """
-    停止所有运行中的服务。
+    停止监控进程和所有运行中的服务。
     """
     print("正在停止服务...")
-    
+
+    # 先停止监控进程，避免它把刚停止的服务重新拉起。等它退出后再读注册表: 正在进行的重启会在退出前
+    # 终止新拉起的进程，不会留下注册表中没有的进程
+    if os.path.exists(SUPERVISOR_PID):
+        try:
+            with open(SUPERVISOR_PID) as f:
+                supervisor_pid = int(f.read().strip())
+            os.kill(supervisor_pid, signal.SIGTERM)
+            if wait_pid_exit(supervisor_pid, SUPERVISOR_STOP_TIMEOUT):
+                print("  ✓ 已停止监控进程")
+            else:
+                os.kill(supervisor_pid, signal.SIGKILL)
+                print(f"  ✓ 强制终止监控进程: {SUPERVISOR_STOP_TIMEOUT:.0f}s 内未退出")
+        except (ValueError, ProcessLookupError):
+            pass
+        except Exception as e:
+            print(f"  ✗ 停止监控进程失败: {e}")
+        try:
+            os.remove(SUPERVISOR_PID)
+        except OSError:
+            pass
+
     if not os.path.exists(SERVICE_INFO):
         print(f"  未找到服务信息文件")
         print("  没有找到运行中的服务")
         return
-    
+
     try:
-        with open(SERVICE_INFO, 'r', encoding='utf-8') as f:
-            services_info = json.load(f)
+        services_info = read_registry()
     except Exception as e:
         print(f"  ✗ 读取服务信息失败: {e}")
         return
-    
+
     if not services_info:
         print("  没有找到运行中的服务")
         try:
@@ -214,39 +549,44 @@ def service_stop():
         except:
             pass
         return
-    
+
     stopped_count = 0
     not_found_count = 0
-    
+
+    stopped_pids = set()
     for service_name, info in services_info.items():
-        pid = info['pid']
-        
+        pid = info.get('pid')
+        # 合并承载时多个服务共用一个进程，只终止一次
+        if not pid or pid in stopped_pids:
+            continue
+        stopped_pids.add(pid)
+
         try:
             os.kill(pid, 0)
             os.kill(pid, signal.SIGTERM)
             time.sleep(0.1)
-            
+
             try:
                 os.kill(pid, 0)
                 os.kill(pid, signal.SIGKILL)
                 print(f"  ✓ 强制终止: {service_name} (PID: {pid})")
             except:
                 print(f"  ✓ 已终止: {service_name} (PID: {pid})")
-            
+
             stopped_count += 1
-            
+
         except ProcessLookupError:
             not_found_count += 1
             print(f"  ⚠ 进程已不存在: {service_name} (PID: {pid})")
         except Exception as e:
             print(f"  ✗ 终止失败: {service_name} - {e}")
-    
+
     try:
         os.remove(SERVICE_INFO)
         print(f"\n✓ 服务信息文件已删除")
     except:
         pass
-    
+
     if stopped_count > 0:
         print(f"\n服务停止完成，共停止 {stopped_count} 个服务")
     if not_found_count > 0:
@@ -259,68 +599,90 @@ def service_status():
     """
     print("服务运行状态:")
     print("-" * 80)
-    
+
     if not os.path.exists(SERVICE_INFO):
         print("  没有运行中的服务")
         print("-" * 80)
         return
-    
+
     try:
-        with open(SERVICE_INFO, 'r', encoding='utf-8') as f:
-            services_info = json.load(f)
+        services_info = read_registry()
     except Exception as e:
         print(f"  读取失败: {e}")
         print("-" * 80)
         return
-    
+
     if not services_info:
         print("  没有运行中的服务")
         print("-" * 80)
         return
-    
+
     running_count = 0
     dead_count = 0
-    
+
     for service_name, info in services_info.items():
-        pid = info['pid']
-        path = info.get('path', '')
-        
+        pid = info.get('pid') or 0
+        port_info = f"Port: {info['port']}" if info.get('port') else ""
+
         try:
             os.kill(pid, 0)
-            is_running = True
+            is_running = pid > 0
         except:
             is_running = False
-        
-        if is_running:
-            port_info = ""
-            if path and os.path.exists(path):
-                try:
-                    port = extract_port_from_runpy(path)
-                    port_info = f"Port: {port}" if port else ""
-                except:
-                    pass
-            
+
+        if is_running and info.get('status') == 'ready':
             running_count += 1
             print(f"  ✓ {service_name:<30} PID: {pid:<8} {port_info}")
         else:
             dead_count += 1
-            print(f"  ✗ {service_name:<30} PID: {pid:<8} (已停止)")
-    
+            status = info.get('status') if is_running else '已停止'
+            print(f"  ✗ {service_name:<30} PID: {pid:<8} ({status})")
+
     print("-" * 80)
-    print(f"总计: {running_count} 个运行, {dead_count} 个已停止")
+    print(f"总计: {running_count} 个运行, {dead_count} 个未就绪或已停止")
+
+
+def service_wait(timeout=READY_TIMEOUT + 30):
+    """
+    等待后台监控进程完成首轮就绪探测，然后打印服务状态
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            services_info = read_registry()
+        except (OSError, ValueError):
+            services_info = {}
+        if os.path.exists(SUPERVISOR_PID) and services_info and \
+                all(info.get('status') != 'starting' for info in services_info.values()):
+            break
+        time.sleep(PROBE_INTERVAL)
+    else:
+        print(f"✗ 警告: {timeout:.0f}s 内服务未全部完成启动")
+    service_status()
 
 
 if __name__ == "__main__":
+    # --workers N: 由 N 个 mcp_host.py 进程合并承载所有服务，默认每个服务一个进程
+    workers = 0
+    if "--workers" in sys.argv:
+        idx = sys.argv.index("--workers")
+        workers = int(sys.argv[idx + 1])
+        del sys.argv[idx:idx + 2]
+
     if len(sys.argv) > 1:
         action = sys.argv[1].lower()
         if action == "start":
-            service_run()
+            service_run(workers)
+        elif action == "supervise":
+            service_supervise(workers)
         elif action == "stop":
             service_stop()
         elif action == "status":
             service_status()
+        elif action == "wait":
+            service_wait()
         else:
-            print("用法: python service.py {start|stop|status}")
+            print("用法: python service.py {start|supervise|stop|status|wait} [--workers N]")
             sys.exit(1)
     else:
-        service_run()
\ No newline at end of file
+        service_run(workers)
@@ -1,46 +1,41 @@
 import os
+import copy
 import json
+import argparse
+import threading
 import requests
 import json5
 from typing import List, Dict, Any
 from qwen_agent.agents import Assistant
 from qwen_agent.tools.base import BaseTool, register_tool
 from qwen_agent.utils.output_beautify import typewriter_print
-from qwen_agent.gui import WebUI
+from qwen_agent.utils.utils import extract_text_from_message, get_last_usr_msg_idx
 
-from config import SERVICE_INFO
+from app.service_registry import ready_services
+from config import SERVICE_INFO, HIRAG_URL, SHOW_TOP_SERVICES
+
+# 所有 MCPTool 共用一个会话，复用到各服务的 HTTP 连接，避免每次调用重新建立 TCP 连接
+_http_session = requests.Session()
 
 
 # Step 1: 动态加载 MCP 服务作为工具
 def load_mcp_services() -> List[Dict[str, Any]]:
     """
-    从 service_info.json 加载所有运行中的 MCP 服务信息
+    从服务注册表加载所有已通过就绪探测的 MCP 服务信息
     """
     if not os.path.exists(SERVICE_INFO):
         print(f"警告: 未找到服务信息文件 {SERVICE_INFO}")
         return []
     
     try:
-        with open(SERVICE_INFO, 'r', encoding='utf-8') as f:
-            services_info = json.load(f)
-        
         mcp_services = []
-        for service_name, info in services_info.items():
-            # 检查进程是否还在运行
-            try:
-                os.kill(info['pid'], 0)
-                
-                # 尝试从 run.py 中提取端口信息
-                port = extract_port_from_runpy(info['path'])
-                if port:
-                    mcp_services.append({
-                        'name': service_name,
-                        'pid': info['pid'],
-                        'port': port,
-                        'base_url': f'http://localhost:{port}'
-                    })
-            except:
-                continue
+        for info in ready_services():
+            mcp_services.append({
+                'name': info['name'],
+                'pid': info['pid'],
+                'port': info['port'],
+                'base_url': f"http://localhost:{info['port']}"
+            })
         
         print(f"✓ 加载了 {len(mcp_services)} 个 MCP 服务")
         return mcp_services
@@ -50,21 +45,6 @@ def load_mcp_services() -> List[Dict[str, Any]]:
         return []
 
 
-def extract_port_from_runpy(file_path: str) -> int:
-    """从 run.py 文件中提取端口号"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        import re
-        match = re.search(r'mcp\.run\([^)]*port\s*=\s*(\d+)', content)
-        if match:
-            return int(match.group(1))
-    except:
-        pass
-    return None
-
-
 def create_mcp_tool_class(service_name: str, base_url: str, tool_description: str = None):
     """
     动态创建 MCP 服务对应的工具类
@@ -105,7 +85,7 @@ def create_mcp_tool_class(service_name: str, base_url: str, tool_description: st
                 action_params = parsed_params.get('params', {})
                 
                 # 调用 MCP 服务的 API（使用闭包变量）
-                response = requests.post(
+                response = _http_session.post(
                     f'{_base_url}/{action}',
                     json=action_params,
                     timeout=30
@@ -200,13 +180,120 @@ When using MCP services, call them with appropriate actions and parameters.
     return bot
 
 
+# 检索路由模式: 每轮对话用 Hi-RAG 选出前 k 个服务，只把这些服务的工具交给 LLM
+class HiRagRouter(object):
+    """
+    工具路由: 优先请求 Hi-RAG 检索服务 (hirag_server.py)，服务不可用时在本进程加载 ToolSelector
+    """
+
+    def __init__(self, top_services=SHOW_TOP_SERVICES, url=HIRAG_URL, timeout=30):
+        self.top_services = top_services
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        # 复用到检索服务的连接
+        self.session = requests.Session()
+        self.selector = None
+        if self._server_ready():
+            print(f"✓ 使用 Hi-RAG 检索服务: {self.url}")
+        else:
+            print(f"Hi-RAG 检索服务 {self.url} 不可用，在本进程加载索引...")
+            from app.rag.selector import ToolSelector
+            self.selector = ToolSelector()
+
+    def _server_ready(self):
+        try:
+            response = self.session.get(f"{self.url}/health", timeout=2)
+            return response.status_code == 200 and response.json().get('status') == 'ok'
+        except (requests.RequestException, ValueError):
+            return False
+
+    def select(self, query):
+        """
+        :return: (选出的服务名, {服务名: MCP 服务配置})，后者只包含已就绪的服务，按相关性从高到低
+        """
+        if self.selector is not None:
+            result = self.selector.select(query, top_services=self.top_services)
+        else:
+            response = self.session.post(f"{self.url}/select_tools",
+                                         json={'query': query, 'top_services': self.top_services},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+
+        # 端口以服务注册表中运行的实例为准
+        ports = {info['name']: info['port'] for info in ready_services()}
+        names = [service['name'] for service in result['services']]
+        mcp_servers = {name: {'url': f"http://localhost:{ports[name]}/sse"} for name in names if name in ports}
+        return names, mcp_servers
+
+
+class RoutedAssistant(Assistant):
+    """
+    检索路由的 Agent，只创建一次: 每轮对话先用 HiRagRouter 选出服务，本轮只带这些服务的工具调用 LLM。
+    服务的 MCP 工具在第一次被选中时连接并缓存，之后复用同一个 SSE 会话
+    """
+
+    def __init__(self, router: HiRagRouter, **kwargs):
+        super().__init__(**kwargs)
+        self.router = router
+        # 服务名 -> 该服务的 MCP 工具
+        self._service_tools = {}
+        self._lock = threading.Lock()
+
+    def service_tools(self, mcp_servers):
+        """
+        :param mcp_servers: {服务名: MCP 服务配置}
+        :return: 这些服务的工具，未连接过的服务先并发连接
+        """
+        from qwen_agent.tools.mcp_manager import MCPManager
+
+        with self._lock:
+            missing = {name: cfg for name, cfg in mcp_servers.items() if name not in self._service_tools}
+            if missing:
+                try:
+                    tools = MCPManager().initConfig({'mcpServers': missing})
+                except Exception as e:
+                    print(f"✗ 连接 MCP 服务失败: {list(missing)} - {e}")
+                    tools = []
+                # 工具名为 "服务名-工具名"，服务名互为前缀时取最长的；连接失败的服务不缓存，下次选中时重试
+                for tool in tools:
+                    name = max((name for name in missing if tool.name.startswith(name + '-')), key=len)
+                    self._service_tools.setdefault(name, []).append(tool)
+            return [tool for name in mcp_servers for tool in self._service_tools.get(name, [])]
+
+    def _run(self, messages, lang='en', **kwargs):
+        query = extract_text_from_message(messages[get_last_usr_msg_idx(messages)], add_upload_info=False)
+        names, mcp_servers = self.router.select(query)
+        tools = self.service_tools(mcp_servers)
+        skipped = [name for name in names if name not in mcp_servers]
+        print(f"\n[Hi-RAG] 服务: {', '.join(mcp_servers) or '无'}，工具: {len(tools)} 个"
+              f"{f'，未就绪: {skipped}' if skipped else ''}")
+
+        # 每轮使用浅拷贝的 Agent 挂载本轮的工具，WebUI 中并发的对话互不影响
+        turn = copy.copy(self)
+        turn.function_map = {tool.name: tool for tool in tools}
+        return Assistant._run(turn, messages, lang=lang, **kwargs)
+
+
+def create_routed_agent(top_services=SHOW_TOP_SERVICES):
+    """
+    创建检索路由的 Agent，工具在每轮对话中按检索结果挂载
+    """
+    print("\n正在初始化 Agent (Hi-RAG 路由)...")
+    router = HiRagRouter(top_services=top_services)
+    print(f"✓ 每轮对话挂载前 {top_services} 个服务的工具")
+
+    system_instruction = '''You are a helpful AI assistant. For each request, the tools of the most relevant MCP services are provided.
+If the provided tools can solve the user's problem, call the appropriate one; otherwise answer the user directly.
+'''
+    return RoutedAssistant(router=router, llm=llm_cfg, system_message=system_instruction)
+
+
 # Step 6: 运行 Agent
-def run_cli_mode():
+def run_cli_mode(bot):
     """
     命令行模式
     """
-    bot = create_agent()
-    
     messages = []
     print("\n" + "="*60)
     print("Agent 已启动！输入 'quit' 或 'exit' 退出")
@@ -243,18 +330,23 @@ def run_cli_mode():
             traceback.print_exc()
 
 
-def run_webui_mode():
+def run_webui_mode(bot):
     """
     Web UI 模式
     """
-    bot = create_agent()
+    from qwen_agent.gui import WebUI
+
     print("\n启动 Web UI...")
     WebUI(bot).run()
 
 
 if __name__ == "__main__":
-    import sys
-    
+    parser = argparse.ArgumentParser(description="MCP 服务 Agent，默认每轮对话用 Hi-RAG 选择服务")
+    parser.add_argument('mode', nargs='?', choices=['cli', 'web'], default='cli')
+    parser.add_argument('--top-k', type=int, default=SHOW_TOP_SERVICES, help='每轮对话挂载的服务数')
+    parser.add_argument('--all', action='store_true', help='把所有运行中的服务都注册为工具')
+    args = parser.parse_args()
+
     # 检查服务是否运行
     if not os.path.exists(SERVICE_INFO):
         print("="*60)
@@ -262,8 +354,10 @@ if __name__ == "__main__":
         print("请先运行: python service.py start")
         print("="*60)
     
+    bot = create_agent() if args.all else create_routed_agent(args.top_k)
+
     # 选择运行模式
-    if len(sys.argv) > 1 and sys.argv[1] == 'web':
-        run_webui_mode()
+    if args.mode == 'web':
+        run_webui_mode(bot)
     else:
-        run_cli_mode()
\ No newline at end of file
+        run_cli_mode(bot)
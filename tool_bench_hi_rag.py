@@ -4,10 +4,10 @@ import json
 import pickle
 import requests
 import numpy as np
+import faiss
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass, asdict
-from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 
 # LangChain imports
@@ -17,6 +17,9 @@ from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 
 from config import TOOL_BENCH_DIR
+from app.rag.quantization import build_index, is_quantized, rescore
+from app.profiling import run_main
+from qwen_agent.utils.rank_fusion import rrf_fuse
 
 
 @dataclass
@@ -44,6 +47,11 @@ class RetrievalConfig:
     # 持久化路径
     index_dir: str = "./faiss_index"
     
+    # 向量量化: flat、fp16、int8 或 pq，量化后对 top_k * rescore_factor 个候选用 float32 向量精排
+    vector_quantization: str = "flat"
+    pq_m: int = 128
+    rescore_factor: int = 4
+    
     # 性能优化参数
     enable_cache: bool = True
     batch_size: int = 32
@@ -75,7 +83,8 @@ class ReciprocalRankFusion:
     def fuse(
         self, 
         ranked_lists: List[List[Document]], 
-        weights: Optional[List[float]] = None
+        weights: Optional[List[float]] = None,
+        top_k: Optional[int] = None
     ) -> List[Document]:
         """
         融合多个排序列表
@@ -83,9 +92,11 @@ class ReciprocalRankFusion:
         Args:
             ranked_lists: 多个排序后的文档列表
             weights: 每个列表的权重，如果为 None 则平均分配
+            top_k: 只返回分数最高的 top_k 个文档，None 表示全部返回
         
         Returns:
-            融合后的文档列表（按 RRF 分数排序）
+            融合后的文档列表（按 RRF 分数排序），metadata 中附加融合分数 rrf_score
+            和每个列表各自贡献的分数 rrf_scores
         """
         if not ranked_lists:
             return []
@@ -98,38 +109,31 @@ class ReciprocalRankFusion:
             total_weight = sum(weights)
             weights = [w / total_weight for w in weights] if total_weight > 0 else weights
         
-        # 计算每个文档的 RRF 分数
-        doc_scores = defaultdict(float)
-        doc_map = {}  # 存储文档对象
-        
-        for list_idx, doc_list in enumerate(ranked_lists):
-            for rank, doc in enumerate(doc_list):
+        # 按首次出现的顺序给文档编号，在整数 id 上做向量化的 RRF 融合
+        doc_ids = {}
+        doc_map = []  # 存储文档对象
+        ranked_ids = []
+        for doc_list in ranked_lists:
+            ids = []
+            for doc in doc_list:
                 # 使用文档的唯一标识作为 key
                 doc_key = self._get_doc_key(doc)
-                
-                # RRF 分数计算: weight / (k + rank + 1)
-                # rank + 1 是因为排名从 1 开始，而不是 0
-                rrf_score = weights[list_idx] / (self.k + rank + 1)
-                doc_scores[doc_key] += rrf_score
-                
-                # 保存文档对象（如果还没有保存）
-                if doc_key not in doc_map:
-                    doc_map[doc_key] = doc
-        
-        # 按 RRF 分数排序
-        sorted_doc_keys = sorted(
-            doc_scores.keys(), 
-            key=lambda k: doc_scores[k], 
-            reverse=True
-        )
+                if doc_key not in doc_ids:
+                    doc_ids[doc_key] = len(doc_map)
+                    doc_map.append(doc)
+                ids.append(doc_ids[doc_key])
+            ranked_ids.append(ids)
+        
+        fused = rrf_fuse(ranked_ids, weights=weights, k=self.k, top_k=top_k)
         
         # 构建结果列表，并附加 RRF 分数到 metadata
         result_docs = []
-        for doc_key in sorted_doc_keys:
-            doc = doc_map[doc_key]
+        for i, doc_id in enumerate(fused.ids.tolist()):
+            doc = doc_map[doc_id]
             # 创建新的 Document 对象，添加 RRF 分数
             new_metadata = doc.metadata.copy()
-            new_metadata['rrf_score'] = doc_scores[doc_key]
+            new_metadata['rrf_score'] = float(fused.scores[i])
+            new_metadata['rrf_scores'] = fused.retriever_scores[:, i].tolist()
             result_docs.append(
                 Document(page_content=doc.page_content, metadata=new_metadata)
             )
@@ -157,6 +161,8 @@ class HybridRetrievalSystem:
         self.bm25_retriever = None
         self.vectorstore = None
         self.vector_retriever = None
+        # 量化索引精排用的 float32 向量，加载时以内存映射方式打开
+        self.vectors = None
         self.rrf_fusion = ReciprocalRankFusion(k=config.rrf_k)
         
         # 初始化 Embeddings
@@ -202,6 +208,10 @@ class HybridRetrievalSystem:
             self.documents,
             self.embeddings
         )
+        if self.config.vector_quantization != "flat":
+            print(f"  量化向量索引: {self.config.vector_quantization}")
+            self.vectors = self.vectorstore.index.reconstruct_n(0, self.vectorstore.index.ntotal)
+            self.vectorstore.index = build_index(self.vectors, self.config.vector_quantization, pq_m=self.config.pq_m)
         self.vector_retriever = self.vectorstore.as_retriever(
             search_kwargs={"k": self.config.top_k}
         )
@@ -224,6 +234,8 @@ class HybridRetrievalSystem:
         if self.vectorstore:
             faiss_path = str(index_path / "faiss_index")
             self.vectorstore.save_local(faiss_path)
+            if self.vectors is not None:
+                np.save(index_path / "vectors.f32.npy", self.vectors)
             print(f"  FAISS 索引已保存")
         
         # 保存 BM25 索引（保存原始文档）
@@ -240,7 +252,8 @@ class HybridRetrievalSystem:
             "top_k": self.config.top_k,
             "bm25_weight": self.config.bm25_weight,
             "vector_weight": self.config.vector_weight,
-            "rrf_k": self.config.rrf_k
+            "rrf_k": self.config.rrf_k,
+            "vector_quantization": self.config.vector_quantization
         }
         with open(config_path, 'w', encoding='utf-8') as f:
             json.dump(config_dict, f, indent=2, ensure_ascii=False)
@@ -269,6 +282,9 @@ class HybridRetrievalSystem:
                 self.embeddings,
                 allow_dangerous_deserialization=True
             )
+            vectors_path = index_path / "vectors.f32.npy"
+            if is_quantized(self.vectorstore.index) and vectors_path.exists():
+                self.vectors = np.load(vectors_path, mmap_mode='r')
             self.vector_retriever = self.vectorstore.as_retriever(
                 search_kwargs={"k": self.config.top_k}
             )
@@ -312,12 +328,26 @@ class HybridRetrievalSystem:
             query: 查询文本
             k: 返回文档数量
         """
+        if self.vectors is not None:
+            return self._retrieve_vector_rescored(query, k or self.config.top_k)
         if k is not None:
             results = self.vectorstore.similarity_search(query, k=k)
         else:
             results = self.vector_retriever.invoke(query)
         return results
     
+    def _retrieve_vector_rescored(self, query: str, k: int) -> List[Document]:
+        """
+        量化索引检索 k * rescore_factor 个候选，再用 float32 向量精排
+        """
+        query_embedding = np.array([self.embeddings.embed_query(query)], dtype=np.float32)
+        _, candidates = self.vectorstore.index.search(query_embedding, k * self.config.rescore_factor)
+        _, I = rescore(self.vectors, query_embedding, candidates, k)
+        return [
+            self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[i])
+            for i in I[0].tolist() if i >= 0
+        ]
+    
     def retrieve_hybrid_rrf(self, query: str, k: Optional[int] = None) -> List[Document]:
         """
         混合检索 (使用 RRF 融合)
@@ -339,11 +369,12 @@ class HybridRetrievalSystem:
         # 使用 RRF 融合
         fused_results = self.rrf_fusion.fuse(
             [bm25_results, vector_results],
-            weights=[self.config.bm25_weight, self.config.vector_weight]
+            weights=[self.config.bm25_weight, self.config.vector_weight],
+            top_k=search_k
         )
         
         # 返回 top-k 结果
-        result = fused_results[:search_k]
+        result = fused_results
         
         # 缓存结果
         if self._query_cache is not None:
@@ -803,6 +834,73 @@ def calculate_ndcg(predicted_services: List[str], relevant_services: List[str],
     return dcg / idcg
 
 
+def evaluate_query(
+    multi_stage_system: MultiStageRetrievalSystem,
+    query: str,
+    relevant_services: List[str]
+) -> Tuple[float, float, float, List[str]]:
+    """
+    评测单个查询
+    
+    Returns:
+        (NDCG@1, NDCG@3, NDCG@5, 预测的服务列表)
+    """
+    results = multi_stage_system.multi_stage_search(
+        query=query,
+        stage1_index="type_service_index",
+        stage2_index="type_service_tool_index",
+        stage1_top_k=10,
+        stage2_top_k=5
+    )
+    
+    # 提取预测的services
+    predicted_services = [
+        result['metadata']['service'] 
+        for result in results['results']
+    ]
+    
+    return (
+        calculate_ndcg(predicted_services, relevant_services, k=1),
+        calculate_ndcg(predicted_services, relevant_services, k=3),
+        calculate_ndcg(predicted_services, relevant_services, k=5),
+        predicted_services
+    )
+
+
+def summarize_ndcg(
+    ndcg_at_1_list: List[float],
+    ndcg_at_3_list: List[float],
+    ndcg_at_5_list: List[float],
+    title: str = "评测结果汇总"
+) -> Dict[str, Any]:
+    """
+    汇总每个查询的 NDCG，打印并返回评测指标字典
+    """
+    # 计算平均指标
+    avg_ndcg_1 = np.mean(ndcg_at_1_list)
+    avg_ndcg_3 = np.mean(ndcg_at_3_list)
+    avg_ndcg_5 = np.mean(ndcg_at_5_list)
+    
+    print("="*80)
+    print(title)
+    print("="*80)
+    print(f"平均 NDCG@1: {avg_ndcg_1:.4f}")
+    print(f"平均 NDCG@3: {avg_ndcg_3:.4f}")
+    print(f"平均 NDCG@5: {avg_ndcg_5:.4f}")
+    print(f"总查询数: {len(ndcg_at_1_list)}")
+    print("="*80 + "\n")
+    
+    return {
+        "ndcg@1": float(avg_ndcg_1),
+        "ndcg@3": float(avg_ndcg_3),
+        "ndcg@5": float(avg_ndcg_5),
+        "num_queries": len(ndcg_at_1_list),
+        "detailed_ndcg@1": [float(x) for x in ndcg_at_1_list],
+        "detailed_ndcg@3": [float(x) for x in ndcg_at_3_list],
+        "detailed_ndcg@5": [float(x) for x in ndcg_at_5_list]
+    }
+
+
 def evaluate_retrieval(
     query_list: List[str], 
     label_list: List[List[str]], 
@@ -834,26 +932,10 @@ def evaluate_retrieval(
         if verbose:
             print(f"处理查询 {idx+1}/{len(query_list)}: {query[:80]}...")
         
-        # 执行检索
-        results = multi_stage_system.multi_stage_search(
-            query=query,
-            stage1_index="type_service_index",
-            stage2_index="type_service_tool_index",
-            stage1_top_k=10,
-            stage2_top_k=5
+        ndcg_1, ndcg_3, ndcg_5, predicted_services = evaluate_query(
+            multi_stage_system, query, relevant_services
         )
         
-        # 提取预测的services
-        predicted_services = [
-            result['metadata']['service'] 
-            for result in results['results']
-        ]
-        
-        # 计算NDCG指标
-        ndcg_1 = calculate_ndcg(predicted_services, relevant_services, k=1)
-        ndcg_3 = calculate_ndcg(predicted_services, relevant_services, k=3)
-        ndcg_5 = calculate_ndcg(predicted_services, relevant_services, k=5)
-        
         ndcg_at_1_list.append(ndcg_1)
         ndcg_at_3_list.append(ndcg_3)
         ndcg_at_5_list.append(ndcg_5)
@@ -864,34 +946,123 @@ def evaluate_retrieval(
             print(f"  相关服务: {relevant_services[:3] if len(relevant_services) > 3 else relevant_services}")
             print()
     
-    # 计算平均指标
-    avg_ndcg_1 = np.mean(ndcg_at_1_list)
-    avg_ndcg_3 = np.mean(ndcg_at_3_list)
-    avg_ndcg_5 = np.mean(ndcg_at_5_list)
+    return summarize_ndcg(ndcg_at_1_list, ndcg_at_3_list, ndcg_at_5_list)
+
+
+def load_multi_stage_system(config: RetrievalConfig) -> MultiStageRetrievalSystem:
+    """
+    加载评测用的两级索引
+    """
+    multi_stage_system = MultiStageRetrievalSystem(config, index_dir=config.index_dir)
+    multi_stage_system.load_index("type_service_index")
+    multi_stage_system.load_index("type_service_tool_index")
+    return multi_stage_system
+
+
+# 分片评测时子进程使用的检索系统。fork 启动时直接继承父进程加载好的索引 (写时复制，
+# FAISS 索引和内存映射的向量在各进程间共享同一份物理内存)，spawn 启动时由子进程自己加载
+_shared_system: Optional[MultiStageRetrievalSystem] = None
+
+
+def _init_shard_worker(config: RetrievalConfig):
+    global _shared_system
+    # 并行度来自多进程，每个进程内的 FAISS 检索单线程，避免线程数超过 CPU 核数
+    faiss.omp_set_num_threads(1)
+    if _shared_system is None:
+        _shared_system = load_multi_stage_system(config)
+
+
+def _evaluate_shard(shard: List[Tuple[int, int, str, List[str]]]) -> List[Tuple[int, int, float, float, float]]:
+    """
+    Args:
+        shard: [(测试集, 查询下标, 查询, 相关服务)]
     
-    print("="*80)
-    print("评测结果汇总")
-    print("="*80)
-    print(f"平均 NDCG@1: {avg_ndcg_1:.4f}")
-    print(f"平均 NDCG@3: {avg_ndcg_3:.4f}")
-    print(f"平均 NDCG@5: {avg_ndcg_5:.4f}")
-    print(f"总查询数: {len(query_list)}")
-    print("="*80 + "\n")
+    Returns:
+        [(测试集, 查询下标, NDCG@1, NDCG@3, NDCG@5)]
+    """
+    results = []
+    for group, idx, query, relevant_services in shard:
+        ndcg_1, ndcg_3, ndcg_5, _ = evaluate_query(_shared_system, query, relevant_services)
+        results.append((group, idx, ndcg_1, ndcg_3, ndcg_5))
+    return results
+
+
+def evaluate_sharded(
+    groups: Dict[int, Tuple[List[str], List[List[str]]]],
+    multi_stage_system: MultiStageRetrievalSystem,
+    config: RetrievalConfig,
+    num_workers: int,
+    shard_size: int = 16
+) -> Dict[int, Dict[str, Any]]:
+    """
+    多进程分片评测: 父进程加载一次索引，fork 出的子进程共享索引，各测试集的查询切成小分片交给子进程。
+    结果按 (测试集, 查询下标) 合并，与单进程逐条评测的结果和顺序完全相同
     
-    return {
-        "ndcg@1": float(avg_ndcg_1),
-        "ndcg@3": float(avg_ndcg_3),
-        "ndcg@5": float(avg_ndcg_5),
-        "num_queries": len(query_list),
-        "detailed_ndcg@1": [float(x) for x in ndcg_at_1_list],
-        "detailed_ndcg@3": [float(x) for x in ndcg_at_3_list],
-        "detailed_ndcg@5": [float(x) for x in ndcg_at_5_list]
-    }
+    Args:
+        groups: {测试集编号: (查询列表, 相关服务列表)}
+        multi_stage_system: 已加载索引的多级检索系统
+        config: 检索配置，spawn 启动的子进程用它加载索引
+        num_workers: 子进程数
+        shard_size: 每个分片的查询数，较小的分片可以让各进程负载更均衡
+    
+    Returns:
+        {测试集编号: 评测指标字典}
+    """
+    import gc
+    import multiprocessing as mp
+    
+    global _shared_system
+    tasks = [
+        (group, idx, query, relevant_services)
+        for group, (query_list, label_list) in groups.items()
+        for idx, (query, relevant_services) in enumerate(zip(query_list, label_list))
+    ]
+    shards = [tasks[i:i + shard_size] for i in range(0, len(tasks), shard_size)]
+    
+    if "fork" in mp.get_all_start_methods():
+        context = mp.get_context("fork")
+        _shared_system = multi_stage_system
+        # 冻结父进程的对象，子进程的垃圾回收不会写入这些对象所在的内存页，避免写时复制
+        gc.freeze()
+    else:
+        context = mp.get_context("spawn")
+    
+    print(f"\n分片评测: {len(tasks)} 个查询，{len(shards)} 个分片，{num_workers} 个进程\n")
+    scores = {}
+    try:
+        with context.Pool(num_workers, initializer=_init_shard_worker, initargs=(config,)) as pool:
+            for shard_results in pool.imap_unordered(_evaluate_shard, shards):
+                for group, idx, ndcg_1, ndcg_3, ndcg_5 in shard_results:
+                    scores[(group, idx)] = (ndcg_1, ndcg_3, ndcg_5)
+                print(f"\r已完成 {len(scores)}/{len(tasks)}", end="", flush=True)
+        print()
+    finally:
+        if context.get_start_method() == "fork":
+            gc.unfreeze()
+            _shared_system = None
+    
+    evaluation_results = {}
+    for group, (query_list, _) in groups.items():
+        group_scores = [scores[(group, idx)] for idx in range(len(query_list))]
+        evaluation_results[group] = summarize_ndcg(
+            [x[0] for x in group_scores],
+            [x[1] for x in group_scores],
+            [x[2] for x in group_scores],
+            title=f"G{group} 评测结果汇总"
+        )
+    return evaluation_results
 
 
 def main():
     """主函数 - 演示系统使用和评测"""
     
+    # --workers N: N 个进程分片评测，共享父进程加载的索引；0 表示使用全部 CPU 核
+    num_workers = 1
+    if "--workers" in sys.argv:
+        idx = sys.argv.index("--workers")
+        num_workers = int(sys.argv[idx + 1]) or os.cpu_count()
+        del sys.argv[idx:idx + 2]
+    
     # 配置
     config = RetrievalConfig(
         # Embedding 配置
@@ -940,37 +1111,64 @@ def main():
     # 选择测试集
     if len(sys.argv) > 1:
         action = sys.argv[1]
-        try:
-            test_idx = int(action) - 1
-            if 0 <= test_idx < 3:
-                querys = query_list[test_idx]
-                labels = label_list[test_idx]
-                print(f"\n选择测试集: G{test_idx+1} ({len(querys)} 个查询)\n")
-            else:
-                print("错误: 请输入 1、2 或 3")
+        if action == "all":
+            test_groups = [1, 2, 3]
+        else:
+            try:
+                test_idx = int(action) - 1
+            except ValueError:
+                print("错误: 请输入有效的数字 (1、2 或 3) 或 all")
                 return
-        except ValueError:
-            print("错误: 请输入有效的数字 (1、2 或 3)")
-            return
+            if not 0 <= test_idx < 3:
+                print("错误: 请输入 1、2、3 或 all")
+                return
+            test_groups = [test_idx + 1]
     else:
         print("使用方法:")
-        print("  python retrieval.py 1  # Tool Bench G1 测试")
-        print("  python retrieval.py 2  # Tool Bench G2 测试")
-        print("  python retrieval.py 3  # Tool Bench G3 测试")
+        print("  python tool_bench_hi_rag.py 1  # Tool Bench G1 测试")
+        print("  python tool_bench_hi_rag.py 2  # Tool Bench G2 测试")
+        print("  python tool_bench_hi_rag.py 3  # Tool Bench G3 测试")
+        print("  python tool_bench_hi_rag.py all --workers 8  # G1~G3 一次评测，8 个进程分片")
         return
     
-    # 初始化多级检索系统
-    multi_stage_system = MultiStageRetrievalSystem(config)
+    groups = {}
+    for group in test_groups:
+        if not query_list[group - 1]:
+            print(f"警告: G{group} 没有查询，跳过")
+            continue
+        groups[group] = (query_list[group - 1], label_list[group - 1])
+        print(f"\n选择测试集: G{group} ({len(query_list[group - 1])} 个查询)\n")
+    
+    # 初始化多级检索系统，索引只加载一次，所有测试集和子进程共用
+    multi_stage_system = load_multi_stage_system(config)
     
     # 执行评测
-    evaluation_results = evaluate_retrieval(querys, labels, multi_stage_system, verbose=True)
+    if num_workers > 1:
+        evaluation_results = evaluate_sharded(groups, multi_stage_system, config, num_workers)
+    else:
+        evaluation_results = {
+            group: evaluate_retrieval(querys, labels, multi_stage_system, verbose=True)
+            for group, (querys, labels) in groups.items()
+        }
     
     # 保存评测结果
-    output_path = f"./evaluation_results_G{test_idx+1}.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(evaluation_results, f, indent=2, ensure_ascii=False)
-    print(f"评测结果已保存到: {output_path}\n")
+    for group, group_results in evaluation_results.items():
+        output_path = f"./evaluation_results_G{group}.json"
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(group_results, f, indent=2, ensure_ascii=False)
+        print(f"评测结果已保存到: {output_path}\n")
+
+
+# --profile 时的阶段拆分: 建索引、向量化和重排服务等待、其余检索
+PROFILE_RULES = (
+    ('索引构建', '/tool_bench_hi_rag.py', 'build_indexes'),
+    ('索引构建', '/tool_bench_hi_rag.py', 'load_multi_stage_system'),
+    ('向量化等待', '/langchain_openai/', None),
+    ('重排等待', '/tool_bench_hi_rag.py', '_call_rerank_api'),
+    ('检索', '/tool_bench_hi_rag.py', 'multi_stage_search'),
+)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # --profile: 采样剖析，报告写到 data/profile/ 下；只剖析主进程，建议和 --workers 1 一起使用
+    run_main('tool_bench_hi_rag', main, rules=PROFILE_RULES)
\ No newline at end of file